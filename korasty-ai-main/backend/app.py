@@ -1,22 +1,71 @@
 # Korasty AI - Flask Backend for PythonAnywhere
 
-from flask import Flask, request, jsonify
+from flask import Flask, Request, Response, has_request_context, request, jsonify, send_file, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-import google.generativeai as genai
 import os
 import logging
 from datetime import datetime
-import base64
+import hashlib
+import hmac
+import io
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from google.api_core import exceptions as api_exceptions
+
+from artifact_store import ArtifactStore, accepted_encodings, compress, etag_matches
+from audio_transcribe import AudioSplitter, transcribe_audio
+from chat_memory import ChatMemory
+from context_cache import ContextCache
+from image_prep import downscale_image, image_support_available
+from jobs import JobQueue, QueueFullError
+from map_reduce import condense
+from metrics import BYTE_BUCKETS, Registry
+from model_pool import ModelPool
+from pdf_extract import extract_pdf, pdf_support_available
+from preprocess import PreprocessStats, preprocess_text
+from request_timing import ProfileStore, record_stage, start_timer, stop_timer, timed_stage
+from result_cache import ResultCache, make_cache_key
+from retrieval import RetrievalIndex
+from sharding import generate_shards, merge_shards, plan_shards
+from single_flight import SingleFlight
+from source_store import SourceStore, make_source_id
+from stub_provider import StubPool
+from structured_output import ARTIFACT_SCHEMAS, ParseStats, parse_json_response, validate
+from upstream import UpstreamBusyError, UpstreamScheduler
+from uploads import UploadError, delete_uploaded_file, file_sha256, read_upload, read_uploads, upload_to_file_api
+
+
+class TimedRequest(Request):
+    """Request whose JSON body parsing is timed as the ``json`` stage"""
+
+    def get_json(self, *args, **kwargs):
+        with timed_stage('json'):
+            return super().get_json(*args, **kwargs)
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """jsonify() timed as the ``serialize`` stage"""
+
+    def response(self, *args, **kwargs):
+        with timed_stage('serialize'):
+            return super().response(*args, **kwargs)
+
 
 # Create Flask app
 app = Flask(__name__)
+app.request_class = TimedRequest
+app.json = TimedJSONProvider(app)
 
 # Configure CORS to allow requests from GitHub Pages
 CORS(app, resources={
     r"/api/*": {
         "origins": ["*"],  # Allow all origins for GitHub Pages
         "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization", "X-API-Key"]
+        "allow_headers": ["Content-Type", "Authorization", "X-API-Key", "If-None-Match", "X-Debug-Profile"],
+        "expose_headers": ["X-Cache", "ETag", "Server-Timing", "X-Profile-Id"]
     }
 })
 
@@ -24,6 +73,266 @@ CORS(app, resources={
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Prometheus metrics served on /api/metrics (kept per worker process)
+metrics = Registry()
+HTTP_LATENCY = metrics.histogram(
+    'korasty_http_request_duration_seconds', 'Request latency (streams: until the stream ends)',
+    ('route', 'method')
+)
+HTTP_RESPONSES = metrics.counter(
+    'korasty_http_responses_total', 'Responses by route and status', ('route', 'method', 'status')
+)
+HTTP_REQUEST_BYTES = metrics.histogram(
+    'korasty_http_request_bytes', 'Request body size', ('route',), BYTE_BUCKETS
+)
+HTTP_RESPONSE_BYTES = metrics.histogram(
+    'korasty_http_response_bytes', 'Response body size (non-streamed)', ('route',), BYTE_BUCKETS
+)
+HTTP_IN_FLIGHT = metrics.gauge('korasty_http_requests_in_flight', 'Requests being served', ('route',))
+ERRORS = metrics.counter('korasty_errors_total', 'Errors handled in routes, by exception type', ('route', 'type'))
+UPSTREAM_LATENCY = metrics.histogram(
+    'korasty_upstream_duration_seconds', 'Gemini call latency (streams: until the last chunk)',
+    ('method', 'outcome')
+)
+UPSTREAM_ERRORS = metrics.counter(
+    'korasty_upstream_errors_total', 'Failed Gemini calls by exception type', ('method', 'type')
+)
+UPSTREAM_TOKENS = metrics.counter(
+    'korasty_upstream_tokens_total', 'Tokens reported by Gemini usage metadata', ('method', 'kind')
+)
+IMAGE_BYTES = metrics.counter(
+    'korasty_image_bytes_total', 'Image bytes uploaded by clients and sent to Gemini after downscaling', ('stage',)
+)
+
+
+def observe_upstream(method, seconds, response, error):
+    """ModelPool observer: latency, errors and token usage of every Gemini call"""
+    record_stage('upstream', seconds)
+    UPSTREAM_LATENCY.observe(seconds, method=method, outcome='error' if error else 'ok')
+    if error is not None:
+        UPSTREAM_ERRORS.inc(method=method, type=type(error).__name__)
+        return
+    usage = getattr(response, 'usage_metadata', None)
+    if usage:
+        # 'prompt' counts input tokens sent with the call, 'cached' those read
+        # from a provider-side cached context (billed at a discount)
+        cached = getattr(usage, 'cached_content_token_count', 0) or 0
+        UPSTREAM_TOKENS.inc(usage.prompt_token_count - cached, method=method, kind='prompt')
+        UPSTREAM_TOKENS.inc(cached, method=method, kind='cached')
+        UPSTREAM_TOKENS.inc(usage.candidates_token_count, method=method, kind='output')
+
+
+def route_label():
+    """Metric label for the current request: its URL rule, not the raw path"""
+    if not has_request_context():
+        return 'background'
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def count_error(error):
+    """Count an exception that a route handled itself (and turned into an error response)"""
+    ERRORS.inc(route=route_label(), type=type(error).__name__)
+
+
+# Local data directory for server-side stores
+DATA_DIR = os.environ.get(
+    'KORASTY_DATA_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+)
+
+# Stage timings of every request go out in a Server-Timing header and a JSON
+# log line on the 'korasty.timing' logger. A request sending the header
+# X-Debug-Profile: <KORASTY_PROFILE_TOKEN> is also profiled with cProfile; the
+# capture is saved and its id returned in X-Profile-Id (no token: disabled)
+SERVER_TIMING_ENABLED = os.environ.get('KORASTY_SERVER_TIMING', 'true') != 'false'
+PROFILE_TOKEN = os.environ.get('KORASTY_PROFILE_TOKEN', '')
+profile_store = ProfileStore(
+    os.path.join(DATA_DIR, 'profiles'),
+    keep=int(os.environ.get('KORASTY_PROFILE_KEEP', '20'))
+)
+timing_logger = logging.getLogger('korasty.timing')
+
+
+def profile_requested(token):
+    """True when ``token`` (the X-Debug-Profile header) matches KORASTY_PROFILE_TOKEN"""
+    if not PROFILE_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token.encode('utf-8'), PROFILE_TOKEN.encode('utf-8'))
+
+
+def log_request_timing(route, method, status, timer):
+    timing_logger.info(json.dumps(
+        {'event': 'request_timing', 'route': route, 'method': method, 'status': status, **timer.summary()}
+    ))
+
+# Source text registered once by the client and referenced by source_id
+source_store = SourceStore(
+    spill_dir=os.path.join(DATA_DIR, 'sources'),
+    max_memory_bytes=int(os.environ.get('KORASTY_SOURCE_MEMORY_MB', '64')) * 1024 * 1024,
+    max_disk_bytes=int(os.environ.get('KORASTY_SOURCE_DISK_MB', '1024')) * 1024 * 1024
+)
+
+# Gemini model used for every generation (part of the result cache key)
+MODEL_NAME = os.environ.get('KORASTY_MODEL', 'gemini-2.5-flash')
+
+# Model provider: 'gemini' (real API) or 'stub' (offline, for load tests)
+MODEL_PROVIDER = os.environ.get('KORASTY_MODEL_PROVIDER', 'gemini')
+
+if MODEL_PROVIDER == 'stub':
+    # Stub answers must never be served from cache entries for the real model
+    MODEL_NAME = f'stub:{MODEL_NAME}'
+    model_pool = StubPool(
+        latency=os.environ.get('KORASTY_STUB_LATENCY', 'lognormal:0.8,0.4'),
+        first_token_latency=os.environ.get('KORASTY_STUB_FIRST_TOKEN', 'lognormal:0.3,0.3'),
+        chunk_interval=float(os.environ.get('KORASTY_STUB_CHUNK_INTERVAL', '0.02')),
+        error_rate=float(os.environ.get('KORASTY_STUB_ERROR_RATE', '0')),
+        output_chars=int(os.environ.get('KORASTY_STUB_OUTPUT_CHARS', '2000')),
+        key_rps=float(os.environ.get('KORASTY_STUB_KEY_RPS', '0')),
+        prefill_per_1k_tokens=float(os.environ.get('KORASTY_STUB_PREFILL', '0.02')),
+        decode_per_1k_tokens=float(os.environ.get('KORASTY_STUB_DECODE', '0')),
+        context_caching=os.environ.get('KORASTY_STUB_CONTEXT_CACHE', 'true') != 'false',
+        seed=os.environ.get('KORASTY_STUB_SEED'),
+        observer=observe_upstream
+    )
+elif MODEL_PROVIDER == 'gemini':
+    # Gemini clients pooled per API key (never via the global genai.configure)
+    model_pool = ModelPool(
+        max_keys=int(os.environ.get('KORASTY_MODEL_POOL_KEYS', '128')),
+        idle_seconds=int(os.environ.get('KORASTY_MODEL_POOL_IDLE', '900')),
+        transport=os.environ.get('KORASTY_GENAI_TRANSPORT') or None,
+        async_transport=os.environ.get('KORASTY_GENAI_ASYNC_TRANSPORT', 'grpc_asyncio'),
+        observer=observe_upstream
+    )
+else:
+    raise ValueError(f'Unknown KORASTY_MODEL_PROVIDER: {MODEL_PROVIDER}')
+
+# Per-key upstream rate/concurrency limits that back off on 429s, with retries
+upstream = UpstreamScheduler(
+    rate=float(os.environ.get('KORASTY_UPSTREAM_RATE', '5')),
+    burst=int(os.environ.get('KORASTY_UPSTREAM_BURST', '10')),
+    max_concurrency=int(os.environ.get('KORASTY_UPSTREAM_CONCURRENCY', '8')),
+    queue_timeout=float(os.environ.get('KORASTY_UPSTREAM_QUEUE_TIMEOUT', '30')),
+    retries=int(os.environ.get('KORASTY_UPSTREAM_RETRIES', '3')),
+    base_backoff=float(os.environ.get('KORASTY_UPSTREAM_BACKOFF', '0.5'))
+)
+
+# Generated studio artifacts, keyed by endpoint + content hash + options + model
+result_cache = ResultCache(
+    db_path=os.path.join(DATA_DIR, 'results.sqlite3'),
+    max_memory_entries=int(os.environ.get('KORASTY_RESULT_CACHE_ENTRIES', '256')),
+    max_disk_bytes=int(os.environ.get('KORASTY_RESULT_CACHE_MB', '256')) * 1024 * 1024,
+    default_ttl=int(os.environ.get('KORASTY_RESULT_CACHE_TTL', str(7 * 24 * 3600)))
+)
+
+# Text extracted from uploads, keyed by file hash + mime type + prompt version
+extraction_cache = ResultCache(
+    db_path=os.path.join(DATA_DIR, 'extractions.sqlite3'),
+    max_memory_entries=int(os.environ.get('KORASTY_EXTRACTION_CACHE_ENTRIES', '64')),
+    max_disk_bytes=int(os.environ.get('KORASTY_EXTRACTION_CACHE_MB', '512')) * 1024 * 1024,
+    default_ttl=int(os.environ.get('KORASTY_EXTRACTION_CACHE_TTL', str(30 * 24 * 3600)))
+)
+
+# Studio outputs saved under an id (per API key) for reopening without regenerating
+ARTIFACT_STORE_ENABLED = os.environ.get('KORASTY_ARTIFACT_STORE', 'true') != 'false'
+artifact_store = ArtifactStore(
+    db_path=os.path.join(DATA_DIR, 'artifacts.sqlite3'),
+    ttl=int(os.environ.get('KORASTY_ARTIFACT_TTL', str(90 * 24 * 3600))),
+    max_per_owner=int(os.environ.get('KORASTY_ARTIFACT_MAX_PER_KEY', '500'))
+)
+
+# Bounded worker pool for fanning out several studio generations at once
+STUDIO_BATCH_MAX_ARTIFACTS = int(os.environ.get('KORASTY_STUDIO_BATCH_MAX', '16'))
+studio_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('KORASTY_STUDIO_WORKERS', '8')),
+    thread_name_prefix='studio'
+)
+
+# Identical concurrent generations wait on one upstream call (optionally across processes)
+single_flight = SingleFlight(
+    lock_dir=os.path.join(DATA_DIR, 'locks')
+    if os.environ.get('KORASTY_SINGLE_FLIGHT_SHARED', 'false') == 'true' else None,
+    lock_timeout=int(os.environ.get('KORASTY_SINGLE_FLIGHT_TIMEOUT', '300'))
+)
+
+# Provider-side cached contexts: large sources used more than once are uploaded
+# once per key, and follow-up chat turns and studio artifacts send only their
+# instructions
+context_cache = ContextCache(
+    db_path=os.path.join(DATA_DIR, 'contexts.sqlite3'),
+    provider=model_pool,
+    model_name=MODEL_NAME,
+    enabled=os.environ.get('KORASTY_CONTEXT_CACHE', 'true') != 'false',
+    ttl=int(os.environ.get('KORASTY_CONTEXT_CACHE_TTL', '3600')),
+    min_chars=int(os.environ.get('KORASTY_CONTEXT_CACHE_MIN_CHARS', '16000')),
+    max_chars=int(os.environ.get('KORASTY_CONTEXT_CACHE_MAX_CHARS', '1000000')),
+    min_uses=int(os.environ.get('KORASTY_CONTEXT_CACHE_MIN_USES', '2')),
+    max_per_owner=int(os.environ.get('KORASTY_CONTEXT_CACHE_MAX_PER_KEY', '16')),
+    flight=single_flight
+)
+# Chat puts the whole corpus in a cached context only when every turn would
+# carry it anyway (retrieval off or within the budget) or when opted in;
+# otherwise each turn gets the passages selected for its question
+CHAT_FULL_CONTEXT_CACHE = os.environ.get('KORASTY_CHAT_FULL_CONTEXT_CACHE', 'false') == 'true'
+
+# Background jobs for generations that outlive proxy/request timeouts
+job_queue = JobQueue(
+    db_path=os.path.join(DATA_DIR, 'jobs.sqlite3'),
+    workers=int(os.environ.get('KORASTY_JOB_WORKERS', '4')),
+    max_pending=int(os.environ.get('KORASTY_JOB_QUEUE_MAX', '100')),
+    retention_seconds=int(os.environ.get('KORASTY_JOB_RETENTION', str(24 * 3600)))
+)
+
+# Map-reduce: studio content above this size is digested chunk by chunk (in
+# parallel, cached per chunk) and the artifact is built from the digests
+MAP_REDUCE_THRESHOLD = int(os.environ.get('KORASTY_MAP_REDUCE_CHARS', '100000'))
+MAP_CHUNK_CHARS = int(os.environ.get('KORASTY_MAP_CHUNK_CHARS', '16000'))
+digest_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('KORASTY_DIGEST_WORKERS', '8')),
+    thread_name_prefix='digest'
+)
+
+# Count-based artifacts (flashcards, quiz, slides) are generated as parallel
+# shards of a few items, each from its own section of the content
+SHARDING_ENABLED = os.environ.get('KORASTY_SHARDING', 'true') != 'false'
+SHARD_ITEMS = int(os.environ.get('KORASTY_SHARD_ITEMS', '5'))
+SHARD_MIN_CHARS = int(os.environ.get('KORASTY_SHARD_MIN_CHARS', '2000'))
+SHARD_RETRIES = int(os.environ.get('KORASTY_SHARD_RETRIES', '1'))
+SHARD_DEDUP_THRESHOLD = float(os.environ.get('KORASTY_SHARD_DEDUP_THRESHOLD', '0.8'))
+shard_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('KORASTY_SHARD_WORKERS', '8')),
+    thread_name_prefix='shard'
+)
+
+# Separator used when several sources are joined into one content string
+SOURCE_SEPARATOR = '\n\n---\n\n'
+
+# Every source is cleaned once (boilerplate, tatweel, junk characters,
+# duplicate paragraphs) before any prompt uses it; bump the version when the
+# cleaning changes so cached output is not reused
+PREPROCESS_ENABLED = os.environ.get('KORASTY_PREPROCESS', 'true') != 'false'
+PREPROCESS_VERSION = 3
+preprocess_stats = PreprocessStats()
+
+# Chat context selection: only the top-k chunks go into the prompt once the
+# sources exceed the character budget
+RETRIEVAL_TOP_K = int(os.environ.get('KORASTY_RETRIEVAL_TOP_K', '8'))
+RETRIEVAL_CHAR_BUDGET = int(os.environ.get('KORASTY_RETRIEVAL_CHAR_BUDGET', '12000'))
+retrieval_index = RetrievalIndex(
+    chunk_chars=int(os.environ.get('KORASTY_RETRIEVAL_CHUNK_CHARS', '1200')),
+    max_sources=int(os.environ.get('KORASTY_RETRIEVAL_MAX_SOURCES', '64'))
+)
+
+# Server-side chat sessions: the newest turns verbatim, older ones folded into
+# a rolling summary (in the background) so per-turn prompts stay bounded
+chat_memory = ChatMemory(
+    db_path=os.path.join(DATA_DIR, 'chat_sessions.sqlite3'),
+    recent_messages=int(os.environ.get('KORASTY_CHAT_RECENT_MESSAGES', '6')),
+    recent_chars=int(os.environ.get('KORASTY_CHAT_RECENT_CHARS', '6000')),
+    summary_chars=int(os.environ.get('KORASTY_CHAT_SUMMARY_CHARS', '2000')),
+    ttl=int(os.environ.get('KORASTY_CHAT_SESSION_TTL', str(7 * 24 * 3600)))
+)
+memory_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='memory')
+
 # Teacher AI System Prompt
 TEACHER_SYSTEM_PROMPT = """أنت "المعلم الذكي" - مساعد تعليمي ذكي يتحدث العربية بطلاقة.
 
@@ -41,10 +350,239 @@ TEACHER_SYSTEM_PROMPT = """أنت "المعلم الذكي" - مساعد تعل
 - قدم الاستشهادات عند الحاجة"""
 
 
-def get_genai_model(api_key):
-    """Configure and return a Gemini model"""
-    genai.configure(api_key=api_key)
-    return genai.GenerativeModel('gemini-2.5-flash')
+def get_genai_model(api_key, cached_content=None):
+    """Return a Gemini model bound to this API key's pooled client and limits.
+
+    With ``cached_content`` every call is prefixed with that cached context.
+    """
+    return upstream.wrap(model_pool.get_model(api_key, MODEL_NAME, cached_content), api_key)
+
+
+def get_async_genai_model(api_key, cached_content=None):
+    """Return a Gemini model for ``generate_content_async`` (ASGI mode)"""
+    return upstream.wrap(model_pool.get_async_model(api_key, MODEL_NAME, cached_content), api_key)
+
+
+def preprocess_source(source_id, text):
+    """Cleaned text of a source, computed once per source and cached by its id"""
+    if not PREPROCESS_ENABLED:
+        return text
+    cache_key = make_cache_key('preprocess', source_id, {'version': PREPROCESS_VERSION})
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        return cached['text']
+
+    with timed_stage('preprocess'):
+        cleaned, report = preprocess_text(text)
+    preprocess_stats.record(report)
+    logger.info(
+        f"Preprocessed source {source_id[:12]}: {report['input_chars']} -> {report['output_chars']} chars "
+        f"(x{report['compression_ratio']}, {report['boilerplate_lines']} boilerplate lines, "
+        f"{report['duplicate_paragraphs']} duplicate paragraphs)"
+    )
+    result_cache.set(cache_key, {'text': cleaned, 'report': report})
+    return cleaned
+
+
+def resolve_sources(data, field='content'):
+    """Collect ``(source_id, text)`` pairs from raw text and registered source ids.
+
+    Returns a ``(sources, missing_ids)`` tuple. ``missing_ids`` lists source ids
+    that are unknown (never registered or evicted) so the client can re-register.
+    Texts are preprocessed; ids stay those of the original text.
+    """
+    sources = []
+    raw = data.get(field, '')
+    if raw:
+        sources.append((make_source_id(raw), raw))
+
+    missing = []
+    for source_id in data.get('source_ids') or []:
+        text = source_store.get(source_id)
+        if text is None:
+            missing.append(source_id)
+        elif text:
+            sources.append((source_id, text))
+
+    return [(source_id, preprocess_source(source_id, text)) for source_id, text in sources], missing
+
+
+def resolve_content(data, field='content'):
+    """Build the content string from raw text and/or registered source ids"""
+    sources, missing = resolve_sources(data, field)
+    return SOURCE_SEPARATOR.join(text for _, text in sources), missing
+
+
+def select_chat_context(question, sources, options=None):
+    """Return the source text to put in a chat prompt.
+
+    Small corpora are sent whole. Larger ones are chunked into the retrieval
+    index (once per source) and only the best-matching chunks for the question
+    are kept, within the character budget.
+    """
+    options = options or {}
+    char_budget = int(options.get('char_budget', RETRIEVAL_CHAR_BUDGET))
+    top_k = int(options.get('top_k', RETRIEVAL_TOP_K))
+
+    full_context = SOURCE_SEPARATOR.join(text for _, text in sources)
+    if not options.get('retrieval', True) or len(full_context) <= char_budget:
+        return full_context
+
+    for source_id, text in sources:
+        retrieval_index.add_source(source_id, text)
+
+    return retrieval_index.select_context(
+        question,
+        [source_id for source_id, _ in sources],
+        top_k=top_k,
+        char_budget=char_budget
+    )
+
+
+class RequestError(Exception):
+    """A request answered with an error ``payload`` and ``status`` instead of a result"""
+    
+    def __init__(self, payload, status=400):
+        super().__init__(payload.get('error'))
+        self.payload = payload
+        self.status = status
+
+
+def missing_sources_error(missing):
+    """Error asking the client to re-register evicted sources"""
+    return RequestError({
+        'error': 'بعض المصادر غير موجودة على الخادم، يرجى إعادة رفعها',
+        'missing_source_ids': missing
+    }, 404)
+
+
+def missing_sources_response(missing):
+    """Error response asking the client to re-register evicted sources"""
+    error = missing_sources_error(missing)
+    return jsonify(error.payload), error.status
+
+
+def wants_stream(data):
+    """Check whether the client asked for a Server-Sent Events response"""
+    if data.get('stream'):
+        return True
+    return 'text/event-stream' in request.headers.get('Accept', '')
+
+
+def wants_job(data=None):
+    """Check whether the client asked for a background job (``?async=true`` or ``"async": true``)"""
+    if request.args.get('async') == 'true':
+        return True
+    return bool((data or {}).get('async'))
+
+
+def key_fingerprint(api_key):
+    """Stable, non-reversible owner id for an API key"""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+
+def job_response(kind, api_key, work, release=None):
+    """Queue ``work`` as a background job and answer 202 with its id.
+
+    ``release`` is called when the queue is full and ``work`` will never
+    run, to free what it owns (e.g. spooled uploads).
+    """
+    try:
+        job_id = job_queue.submit(kind, key_fingerprint(api_key), work)
+    except QueueFullError:
+        if release is not None:
+            release()
+        return jsonify({'error': 'قائمة الانتظار ممتلئة، حاول مرة أخرى بعد قليل'}), 503
+    
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': f'/api/jobs/{job_id}',
+        'events_url': f'/api/jobs/{job_id}/events'
+    }), 202
+
+
+def sse_event(event, payload):
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def sse_response(events):
+    """Stream an iterator of SSE strings without proxy buffering"""
+    response = Response(stream_with_context(events), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def iter_response_text(chunks):
+    """Yield the text of streamed response chunks, skipping empty ones"""
+    for chunk in chunks:
+        try:
+            text = chunk.text
+        except ValueError:
+            # Chunks without parts (e.g. the final finish-reason chunk)
+            continue
+        if text:
+            yield text
+
+
+class ModelCall:
+    """One upstream call requested by a model-call generator.
+
+    Handlers that call the model are written as generators that yield a
+    ``ModelCall`` wherever they need a response and receive it (or have the
+    call's exception thrown in) when resumed. ``run_model_calls`` drives them
+    with blocking calls; the ASGI app drives the same generators and awaits
+    only the calls themselves.
+    """
+    
+    def __init__(self, cached_content, prompt, config=None, history=None):
+        self.cached_content = cached_content
+        self.prompt = prompt
+        self.config = config
+        # Chat turns carry their history; other calls are single generations
+        self.history = history
+    
+    def run(self, api_key):
+        model = get_genai_model(api_key, self.cached_content)
+        if self.history is not None:
+            return model.start_chat(history=self.history).send_message(self.prompt)
+        return model.generate_content(self.prompt, generation_config=self.config)
+    
+    async def run_async(self, api_key):
+        model = get_async_genai_model(api_key, self.cached_content)
+        if self.history is not None:
+            return await model.start_chat(history=self.history).send_message_async(self.prompt)
+        return await model.generate_content_async(self.prompt, generation_config=self.config)
+
+
+def advance_model_calls(calls, response=None, error=None):
+    """Resume ``calls`` with a response (or an error to raise at the call).
+
+    Returns ``(False, next_call)``, or ``(True, result)`` once the generator returns.
+    """
+    try:
+        if error is not None:
+            return False, calls.throw(error)
+        return False, calls.send(response)
+    except StopIteration as done:
+        return True, done.value
+
+
+def run_model_calls(api_key, calls):
+    """Drive a model-call generator with blocking calls; returns its result"""
+    response = error = None
+    while True:
+        done, value = advance_model_calls(calls, response, error)
+        if done:
+            return value
+        response = error = None
+        try:
+            response = value.run(api_key)
+        except Exception as e:
+            error = e
 
 
 @app.route('/')
@@ -56,12 +594,155 @@ def home():
         'status': 'running',
         'endpoints': {
             'health': '/api/health',
+            'sources': '/api/sources',
             'chat': '/api/chat',
-            'studio': '/api/studio/*'
+            'studio': '/api/studio/*',
+            'jobs': '/api/jobs/<job_id>',
+            'artifacts': '/api/artifacts',
+            'cache_stats': '/api/cache/stats'
         }
     })
 
 
+@app.before_request
+def start_request_metrics():
+    route = route_label()
+    request.environ['korasty.metrics'] = (route, time.perf_counter())
+    HTTP_IN_FLIGHT.inc(route=route)
+    if request.content_length:
+        HTTP_REQUEST_BYTES.observe(request.content_length, route=route)
+    if SERVER_TIMING_ENABLED:
+        request.environ['korasty.timer'] = start_timer()
+    if profile_requested(request.headers.get('X-Debug-Profile')):
+        request.environ['korasty.profiler'] = profile_store.start()
+
+
+@app.after_request
+def record_response_metrics(response):
+    route = route_label()
+    HTTP_RESPONSES.inc(route=route, method=request.method, status=response.status_code)
+    if not response.is_streamed:
+        HTTP_RESPONSE_BYTES.observe(response.calculate_content_length() or 0, route=route)
+    # Streams are profiled and timed up to their headers
+    profiler = request.environ.pop('korasty.profiler', None)
+    if profiler is not None:
+        response.headers['X-Profile-Id'] = profile_store.finish(profiler)
+    timer = request.environ.get('korasty.timer')
+    if timer is not None:
+        response.headers['Server-Timing'] = timer.server_timing()
+        request.environ['korasty.status'] = response.status_code
+    return response
+
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    # Runs after a streamed body has been fully sent
+    profiler = request.environ.pop('korasty.profiler', None)
+    if profiler is not None:
+        # No response was made (unhandled error); keep the capture anyway
+        profile_store.finish(profiler)
+    timer = request.environ.pop('korasty.timer', None)
+    if timer is not None:
+        stop_timer()
+        log_request_timing(route_label(), request.method, request.environ.get('korasty.status', 500), timer)
+    
+    started = request.environ.pop('korasty.metrics', None)
+    if started is None:
+        return
+    route, started_at = started
+    HTTP_IN_FLIGHT.dec(route=route)
+    HTTP_LATENCY.observe(time.perf_counter() - started_at, route=route, method=request.method)
+
+
+def cache_request_counts():
+    counts = {}
+    for name, cache in (('results', result_cache), ('extractions', extraction_cache)):
+        stats = cache.stats()
+        counts[(name, 'memory_hit')] = stats['memory_hits']
+        counts[(name, 'disk_hit')] = stats['disk_hits']
+        counts[(name, 'miss')] = stats['misses']
+    pool = model_pool.stats()
+    counts[('model_pool', 'hit')] = pool['hits']
+    counts[('model_pool', 'miss')] = pool['misses']
+    scheduler = upstream.stats()
+    for event in ('retries', 'throttled', 'rejected', 'failed'):
+        counts[('upstream_scheduler', event)] = scheduler[event]
+    contexts = context_cache.stats()
+    for event in ('hits', 'created', 'refreshed', 'evicted', 'invalidated', 'rejected', 'fallbacks'):
+        counts[('context_cache', event)] = contexts[event]
+    flights = single_flight.stats()
+    counts[('single_flight', 'leader')] = flights['leaders']
+    counts[('single_flight', 'coalesced')] = flights['followers']
+    counts[('single_flight', 'coalesced_cross_process')] = flights['cross_process']
+    return counts
+
+
+def cache_hit_ratios():
+    return {
+        ('results',): result_cache.stats()['hit_ratio'],
+        ('extractions',): extraction_cache.stats()['hit_ratio']
+    }
+
+
+def store_sizes():
+    sizes = {}
+    for name, cache in (('results', result_cache), ('extractions', extraction_cache)):
+        stats = cache.stats()
+        sizes[(name, 'memory', 'entries')] = stats['memory_entries']
+        sizes[(name, 'disk', 'entries')] = stats['disk_entries']
+        sizes[(name, 'disk', 'bytes')] = stats['disk_bytes']
+    sources = source_store.stats()
+    sizes[('sources', 'memory', 'entries')] = sources['memory_entries']
+    sizes[('sources', 'memory', 'bytes')] = sources['memory_bytes']
+    sizes[('sources', 'disk', 'entries')] = sources['disk_entries']
+    sizes[('sources', 'disk', 'bytes')] = sources['disk_bytes']
+    sizes[('context_cache', 'provider', 'entries')] = context_cache.stats()['live_contexts']
+    artifacts = artifact_store.stats()
+    sizes[('artifacts', 'disk', 'entries')] = artifacts['entries']
+    sizes[('artifacts', 'disk', 'bytes')] = artifacts['stored_bytes']
+    return sizes
+
+
+def upstream_queue():
+    stats = upstream.stats()
+    return {(state,): stats[state] for state in ('in_flight', 'queued', 'throttled_keys')}
+
+
+def json_parse_counts():
+    return {
+        (artifact_type, outcome): count
+        for artifact_type, counts in parse_stats.stats().items()
+        for outcome, count in counts.items()
+    }
+
+
+def job_counts():
+    stats = job_queue.stats()
+    counts = {(status,): count for status, count in stats['jobs'].items()}
+    counts[('pending_in_process',)] = stats['pending']
+    return counts
+
+
+metrics.add_collector(
+    'korasty_cache_requests_total', 'Cache lookups by outcome', cache_request_counts,
+    ('cache', 'result'), kind='counter'
+)
+metrics.add_collector('korasty_cache_hit_ratio', 'Cache hit ratio since start', cache_hit_ratios, ('cache',))
+metrics.add_collector('korasty_store_size', 'Cache and store occupancy', store_sizes, ('store', 'tier', 'unit'))
+metrics.add_collector(
+    'korasty_json_parse_total', 'Studio JSON parse outcomes', json_parse_counts,
+    ('artifact', 'outcome'), kind='counter'
+)
+metrics.add_collector('korasty_upstream_scheduler', 'Upstream calls by scheduler state', upstream_queue, ('state',))
+metrics.add_collector('korasty_jobs', 'Background jobs by status', job_counts, ('status',))
+
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text exposition of this worker's metrics"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -69,26 +750,120 @@ def health_check():
         'status': 'healthy',
         'service': 'korasty-ai',
         'version': '1.0.0',
+        'model_provider': MODEL_PROVIDER,
         'timestamp': datetime.utcnow().isoformat()
     })
 
 
-@app.route('/api/chat', methods=['POST'])
-def chat():
-    """Chat with the Teacher AI"""
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Hit rates of the result and extraction caches, JSON parse outcomes and preprocessing savings"""
+    return jsonify({
+        'results': result_cache.stats(),
+        'extractions': extraction_cache.stats(),
+        'json_parse': parse_stats.stats(),
+        'preprocess': preprocess_stats.stats(),
+        'contexts': context_cache.stats(),
+        'single_flight': single_flight.stats()
+    })
+
+
+@app.route('/api/debug/profiles/<profile_id>', methods=['GET'])
+def get_profile(profile_id):
+    """Top functions of a saved request profile (``?format=prof``: the raw pstats file)"""
+    if not profile_requested(request.headers.get('X-Debug-Profile')):
+        return jsonify({'error': 'رمز التشخيص غير صالح'}), 403
+    if not profile_store.exists(profile_id):
+        return jsonify({'error': 'ملف القياس غير موجود'}), 404
+    if request.args.get('format') == 'prof':
+        return send_file(
+            profile_store.path(profile_id), mimetype='application/octet-stream',
+            as_attachment=True, download_name=f'{profile_id}.prof'
+        )
+    return Response(profile_store.report(profile_id), mimetype='text/plain')
+
+
+@app.route('/api/sources', methods=['POST'])
+def register_source():
+    """Register extracted source text and return its content-hashed id"""
     try:
         data = request.json
-        api_key = request.headers.get('X-API-Key')
+        text = data.get('text', '')
         
-        if not api_key:
-            return jsonify({'error': 'مفتاح API مطلوب'}), 400
+        if not text:
+            return jsonify({'error': 'نص المصدر مطلوب'}), 400
         
-        message = data.get('message', '')
-        context = data.get('context', '')
-        history = data.get('history', [])
+        source_id = source_store.put(text)
+        # Preprocess now so the first prompt using the source does not wait for it
+        processed = preprocess_source(source_id, text)
+        
+        return jsonify({
+            'success': True,
+            'source_id': source_id,
+            'chars': len(text),
+            'processed_chars': len(processed),
+            'compression_ratio': round(len(text) / len(processed), 3) if processed else 0.0
+        })
         
-        if not message:
-            return jsonify({'error': 'الرسالة مطلوبة'}), 400
+    except Exception as e:
+        count_error(e)
+        logger.error(f"Source registration error: {str(e)}")
+        return jsonify({'error': str(e) or 'خطأ في تسجيل المصدر'}), 500
+
+
+@app.route('/api/sources/<source_id>', methods=['GET'])
+def get_source(source_id):
+    """Check whether a source is still registered"""
+    if not source_store.contains(source_id):
+        return jsonify({'error': 'المصدر غير موجود', 'source_id': source_id}), 404
+    
+    return jsonify({
+        'success': True,
+        'source_id': source_id
+    })
+
+
+@app.route('/api/sources/<source_id>', methods=['DELETE'])
+def delete_source(source_id):
+    """Remove a registered source"""
+    if not source_store.delete(source_id):
+        return jsonify({'error': 'المصدر غير موجود', 'source_id': source_id}), 404
+    
+    return jsonify({'success': True, 'source_id': source_id})
+
+
+def chat_context_cacheable(sources, options):
+    """Whether a chat turn may place the whole corpus in a cached context"""
+    if not options.get('context_cache', True):
+        return False
+    if not options.get('retrieval', True):
+        return True
+    corpus_chars = sum(len(text) for _, text in sources) + len(SOURCE_SEPARATOR) * max(0, len(sources) - 1)
+    if corpus_chars <= int(options.get('char_budget', RETRIEVAL_CHAR_BUDGET)):
+        return True
+    return bool(options.get('full_context_cache', CHAT_FULL_CONTEXT_CACHE))
+
+
+def chat_cache_context(sources):
+    """The sources as placed in a cached chat context (after the system prompt)"""
+    context = SOURCE_SEPARATOR.join(text for _, text in sources)
+    return f"المحتوى المتاح للرجوع إليه:\n{context}" if context else ''
+
+
+def build_chat_turn(message, sources, history, options=None, summary='', context_cached=False):
+    """Return ``(chat_history, prompt)`` for one Teacher AI turn.
+
+    With ``context_cached`` the system prompt and sources already sit in a
+    provider-side cached context, so the prompt carries only the question.
+    """
+    if context_cached:
+        full_context = ''
+    else:
+        # Retrieve the passages relevant to this question (and the previous
+        # user turn, so short follow-ups keep their topic)
+        previous_questions = [m.get('content', '') for m in history[-2:] if m.get('role') == 'user']
+        query = ' '.join(previous_questions + [message])
+        context = select_chat_context(query, sources, options)
         
         # Build the prompt
         full_context = TEACHER_SYSTEM_PROMPT
@@ -96,33 +871,197 @@ def chat():
             full_context += f"\n\nالمحتوى المتاح للرجوع إليه:\n{context}"
         else:
             full_context += "\n\nلا يوجد محتوى متاح حالياً."
-        
-        # Configure model
-        model = get_genai_model(api_key)
-        
-        # Build chat history
-        chat_history = []
-        for msg in history[-10:]:  # Limit to last 10 messages
-            role = 'user' if msg.get('role') == 'user' else 'model'
-            chat_history.append({
-                'role': role,
-                'parts': [msg.get('content', '')]
-            })
-        
-        # Create chat session
-        chat = model.start_chat(history=chat_history)
-        
-        # Send message with context
-        prompt = f"{full_context}\n\nسؤال المستخدم: {message}"
-        response = chat.send_message(prompt)
-        
-        return jsonify({
-            'success': True,
-            'response': response.text,
-            'timestamp': datetime.utcnow().isoformat()
+    
+    if summary:
+        full_context += f"\n\nملخص ما سبق في هذه المحادثة:\n{summary}"
+    
+    # Build chat history
+    chat_history = []
+    for msg in history[-10:]:  # Limit to last 10 messages
+        role = 'user' if msg.get('role') == 'user' else 'model'
+        chat_history.append({
+            'role': role,
+            'parts': [msg.get('content', '')]
         })
-        
+    
+    if not full_context:
+        return chat_history, f"سؤال المستخدم: {message}"
+    return chat_history, f"{full_context.lstrip()}\n\nسؤال المستخدم: {message}"
+
+
+CHAT_SUMMARY_PROMPT = """أنت تحدّث ملخصاً جارياً لجلسة تعليمية بين طالب و"المعلم الذكي".
+
+الملخص الحالي:
+{summary}
+
+رسائل جديدة تُضاف إلى الملخص:
+{turns}
+
+اكتب ملخصاً محدثاً باللغة العربية لا يتجاوز {limit} حرف يحفظ:
+- المواضيع والأسئلة التي طرحها الطالب
+- المفاهيم التي شُرحت والأمثلة المستخدمة
+- ما بدا صعباً على الطالب وأي تفضيلات أبداها
+اكتب الملخص فقط:"""
+
+
+def normalize_history(history):
+    """Client history as ``{'role': 'user'|'model', 'content'}`` turns"""
+    return [
+        {'role': 'user' if msg.get('role') == 'user' else 'model', 'content': msg.get('content', '')}
+        for msg in history or []
+        if msg.get('content')
+    ]
+
+
+def load_chat_session(api_key, data):
+    """Return ``(session_id, summary, history)`` for a chat request.
+
+    With a ``session_id`` the server's session memory is used and the
+    client's ``history`` only seeds a session the server does not know yet.
+    Without one the client's history is used as before.
+    """
+    session_id = data.get('session_id')
+    history = data.get('history', [])
+    
+    if not session_id:
+        return None, '', history
+    
+    session = chat_memory.load(session_id, key_fingerprint(api_key))
+    if session is None:
+        return session_id, '', chat_memory.recent(normalize_history(history))
+    
+    return session_id, session['summary'], session['turns']
+
+
+def prepare_chat_turn(api_key, data, message, sources):
+    """Return ``(session_id, cached_content, chat_history, prompt)`` for one chat request.
+
+    ``cached_content`` names the cached context holding the system prompt and
+    sources, or is None when they go inline in ``prompt``.
+    """
+    session_id, summary, history = load_chat_session(api_key, data)
+    options = data.get('options', {})
+    with timed_stage('prompt'):
+        cached_content = None
+        if chat_context_cacheable(sources, options):
+            cached_content = context_cache.get(api_key, TEACHER_SYSTEM_PROMPT, chat_cache_context(sources))
+        chat_history, prompt = build_chat_turn(
+            message, sources, history, options, summary, context_cached=cached_content is not None
+        )
+    return session_id, cached_content, chat_history, prompt
+
+
+def remember_chat_turn(api_key, data, session_id, message, reply):
+    """Store a finished turn; older turns are folded into the summary in the background"""
+    if not session_id or not reply:
+        return
+    
+    owner = key_fingerprint(api_key)
+    fold = chat_memory.append(
+        session_id, owner,
+        [{'role': 'user', 'content': message}, {'role': 'model', 'content': reply}],
+        seed=normalize_history(data.get('history'))
+    )
+    if fold:
+        memory_executor.submit(fold_chat_summary, api_key, session_id, owner, *fold)
+
+
+def fold_chat_summary(api_key, session_id, owner, summary, turns):
+    """Summarize the oldest turns of a session into its running summary"""
+    transcript = '\n'.join(
+        f"{'الطالب' if turn['role'] == 'user' else 'المعلم'}: {turn['content']}" for turn in turns
+    )
+    prompt = CHAT_SUMMARY_PROMPT.format(
+        summary=summary or 'لا يوجد بعد.',
+        turns=transcript,
+        limit=chat_memory.summary_chars
+    )
+    try:
+        response = get_genai_model(api_key).generate_content(prompt)
+        chat_memory.apply_summary(session_id, owner, response.text.strip(), len(turns))
+    except Exception as e:
+        count_error(e)
+        logger.error(f"Chat summary error: {str(e)}")
+        chat_memory.apply_summary(session_id, owner, None, 0)
+
+
+def parse_chat_request(data, api_key):
+    """Validate a chat request; returns ``(message, sources)`` or raises RequestError"""
+    if not api_key:
+        raise RequestError({'error': 'مفتاح API مطلوب'})
+    
+    message = data.get('message', '')
+    sources, missing = resolve_sources(data, 'context')
+    
+    if not message:
+        raise RequestError({'error': 'الرسالة مطلوبة'})
+    
+    if missing:
+        raise missing_sources_error(missing)
+    
+    return message, sources
+
+
+def chat_turn_calls(api_key, data, message, sources, turn):
+    """A non-streamed chat turn as a model-call generator; returns the reply.
+
+    ``turn`` is what ``prepare_chat_turn`` returned for the request.
+    """
+    session_id, cached_content, chat_history, prompt = turn
+    try:
+        response = yield ModelCall(cached_content, prompt, history=chat_history)
+    except api_exceptions.NotFound:
+        if not cached_content:
+            raise
+        # The cached context is gone upstream; answer with it inline
+        context_cache.invalidate(cached_content)
+        _, _, chat_history, prompt = prepare_chat_turn(
+            api_key, dict(data, options=dict(data.get('options', {}), context_cache=False)), message, sources
+        )
+        response = yield ModelCall(None, prompt, history=chat_history)
+    remember_chat_turn(api_key, data, session_id, message, response.text)
+    return response.text
+
+
+def chat_payload(session_id, reply):
+    """The /api/chat success body"""
+    return {
+        'success': True,
+        'response': reply,
+        'session_id': session_id,
+        'timestamp': datetime.utcnow().isoformat()
+    }
+
+
+@app.route('/api/chat', methods=['POST'])
+def chat():
+    """Chat with the Teacher AI"""
+    try:
+        data = request.json
+        api_key = request.headers.get('X-API-Key')
+        message, sources = parse_chat_request(data, api_key)
+        
+        turn = prepare_chat_turn(api_key, data, message, sources)
+        
+        if wants_stream(data):
+            session_id, cached_content, chat_history, prompt = turn
+            chat = get_genai_model(api_key, cached_content).start_chat(history=chat_history)
+            return sse_response(stream_chat(
+                chat, prompt, session_id,
+                lambda reply: remember_chat_turn(api_key, data, session_id, message, reply),
+                cached_content
+            ))
+        
+        reply = run_model_calls(api_key, chat_turn_calls(api_key, data, message, sources, turn))
+        return jsonify(chat_payload(turn[0], reply))
+        
+    except RequestError as e:
+        return jsonify(e.payload), e.status
+    except UpstreamBusyError as e:
+        count_error(e)
+        return jsonify({'error': str(e)}), e.status
     except Exception as e:
+        count_error(e)
         logger.error(f"Chat error: {str(e)}")
         return jsonify({
             'error': str(e) or 'خطأ في المحادثة',
@@ -130,43 +1069,104 @@ def chat():
         }), 500
 
 
-@app.route('/api/studio/audio', methods=['POST'])
-def generate_audio():
-    """Generate audio overview script"""
+def stream_chat(chat_session, prompt, session_id=None, on_complete=None, cached_content=None):
+    """Forward chat tokens as SSE ``delta`` events, then a ``done`` event.
+
+    ``on_complete(reply)`` receives the full reply before ``done`` is sent.
+    A ``cached_content`` the provider no longer knows is dropped on error.
+    """
+    started = time.perf_counter()
+    first_token_ms = None
     try:
-        data = request.json
-        api_key = request.headers.get('X-API-Key')
-        
-        if not api_key:
-            return jsonify({'error': 'مفتاح API مطلوب'}), 400
+        parts = []
+        for text in iter_response_text(chat_session.send_message(prompt, stream=True)):
+            if first_token_ms is None:
+                first_token_ms = round((time.perf_counter() - started) * 1000)
+            parts.append(text)
+            yield sse_event('delta', {'text': text})
         
-        content = data.get('content', '')
-        options = data.get('options', {})
+        if on_complete:
+            on_complete(''.join(parts))
         
-        if not content:
-            return jsonify({'error': 'المحتوى مطلوب'}), 400
-        
-        style_map = {
-            'formal': 'رسمي',
-            'academic': 'أكاديمي',
-            'conversational': 'محادثة طبيعية'
-        }
-        level_map = {
-            'beginner': 'مبتدئ',
-            'intermediate': 'متوسط',
-            'advanced': 'متقدم'
-        }
-        length_map = {
-            'short': 'قصير (2-3 دقائق)',
-            'medium': 'متوسط (5-6 دقائق)',
-            'long': 'طويل (8-10 دقائق)'
+        yield chat_done_event(session_id, started, first_token_ms)
+    except Exception as e:
+        count_error(e)
+        yield chat_stream_failed(e, cached_content)
+
+
+def chat_done_event(session_id, started, first_token_ms):
+    """The ``done`` event closing a chat stream"""
+    return sse_event('done', {
+        'success': True,
+        'session_id': session_id,
+        'timestamp': datetime.utcnow().isoformat(),
+        'timing': {
+            'first_token_ms': first_token_ms,
+            'total_ms': round((time.perf_counter() - started) * 1000)
         }
-        
-        prompt = f"""اكتب نصاً للقراءة الصوتية (Audio Overview) باللغة العربية يلخص المحتوى التالي.
+    })
+
+
+def chat_stream_failed(error, cached_content):
+    """Log a failed chat stream and drop a cached context the provider lost; returns the ``error`` event"""
+    if cached_content and isinstance(error, api_exceptions.NotFound):
+        context_cache.invalidate(cached_content)
+    logger.error(f"Chat stream error: {str(error)}")
+    return sse_event('error', {'error': str(error) or 'خطأ في المحادثة'})
+
+
+# Shared option maps for the studio prompts
+LEVEL_MAP = {
+    'beginner': 'مبتدئ',
+    'intermediate': 'متوسط',
+    'advanced': 'متقدم'
+}
+
+FLASHCARD_COUNTS = {'short': 10, 'medium': 20, 'long': 30}
+QUIZ_COUNTS = {'short': 5, 'medium': 10, 'long': 15}
+SLIDE_COUNTS = {'short': 8, 'medium': 12, 'long': 20}
+
+
+def item_count(options, counts, default):
+    """Items an artifact asks for: by requested length, or one shard's share of them"""
+    count = counts.get(options.get('length', 'medium'), default)
+    if options.get('shard_items'):
+        count = min(count, int(options['shard_items']))
+    return count
+
+
+def shard_requirements(options, first='', last=''):
+    """Extra prompt requirements for one shard of a sharded artifact ('' when not sharded)"""
+    part = options.get('shard_part')
+    if not part:
+        return ''
+    index, total = part
+    lines = f'\n- المحتوى أدناه هو الجزء {index} من {total} من المادة: اعتمد عليه وحده وغطِّ أفكاره دون تكرار'
+    if first and index == 1:
+        lines += f'\n- {first}'
+    if last and index == total:
+        lines += f'\n- {last}'
+    return lines
+
+
+def build_audio_prompt(content, options):
+    """Prompt for the audio overview script"""
+    style_map = {
+        'formal': 'رسمي',
+        'academic': 'أكاديمي',
+        'conversational': 'محادثة طبيعية'
+    }
+    length_map = {
+        'short': 'قصير (2-3 دقائق)',
+        'medium': 'متوسط (5-6 دقائق)',
+        'long': 'طويل (8-10 دقائق)'
+    }
+    
+    return f"""اكتب نصاً للقراءة الصوتية (Audio Overview) باللغة العربية يلخص المحتوى التالي.
 
 المتطلبات:
 - اكتب بأسلوب {style_map.get(options.get('style', 'conversational'), 'محادثة طبيعية')}
-- المستوى المستهدف: {level_map.get(options.get('level', 'intermediate'), 'متوسط')}
+- المستوى المستهدف: {LEVEL_MAP.get(options.get('level', 'intermediate'), 'متوسط')}
 - الطول: {length_map.get(options.get('length', 'medium'), 'متوسط (5-6 دقائق)')}
 - ابدأ بمقدمة جذابة
 - قسّم المحتوى إلى أقسام واضحة
@@ -177,61 +1177,30 @@ def generate_audio():
 
 اكتب النص المناسب للقراءة الصوتية:"""
 
-        model = get_genai_model(api_key)
-        response = model.generate_content(prompt)
-        script = response.text
-        
-        # Estimate duration
-        words = len(script.split())
-        minutes = max(1, round(words / 150))
-        
-        return jsonify({
-            'success': True,
-            'type': 'audio',
-            'data': {
-                'script': script,
-                'duration': f'~{minutes} دقيقة',
-                'note': 'النص جاهز للتحويل إلى صوت باستخدام خدمة TTS'
-            }
-        })
-        
-    except Exception as e:
-        logger.error(f"Audio generation error: {str(e)}")
-        return jsonify({'error': str(e) or 'خطأ في إنشاء الملخص الصوتي'}), 500
+
+def finish_audio(script):
+    """Wrap the audio script with a duration estimate"""
+    words = len(script.split())
+    minutes = max(1, round(words / 150))
+    
+    return {
+        'script': script,
+        'duration': f'~{minutes} دقيقة',
+        'note': 'النص جاهز للتحويل إلى صوت باستخدام خدمة TTS'
+    }
 
 
-@app.route('/api/studio/flashcards', methods=['POST'])
-def generate_flashcards():
-    """Generate flashcards"""
-    try:
-        data = request.json
-        api_key = request.headers.get('X-API-Key')
-        
-        if not api_key:
-            return jsonify({'error': 'مفتاح API مطلوب'}), 400
-        
-        content = data.get('content', '')
-        options = data.get('options', {})
-        
-        if not content:
-            return jsonify({'error': 'المحتوى مطلوب'}), 400
-        
-        count_map = {'short': 10, 'medium': 20, 'long': 30}
-        count = count_map.get(options.get('length', 'medium'), 20)
-        
-        level_map = {
-            'beginner': 'مبتدئ',
-            'intermediate': 'متوسط',
-            'advanced': 'متقدم'
-        }
-        
-        prompt = f"""أنشئ {count} بطاقة تعليمية (Flashcards) باللغة العربية من المحتوى التالي.
+def build_flashcards_prompt(content, options):
+    """Prompt for flashcards"""
+    count = item_count(options, FLASHCARD_COUNTS, 20)
+    
+    return f"""أنشئ {count} بطاقة تعليمية (Flashcards) باللغة العربية من المحتوى التالي.
 
 المتطلبات:
-- المستوى: {level_map.get(options.get('level', 'intermediate'), 'متوسط')}
+- المستوى: {LEVEL_MAP.get(options.get('level', 'intermediate'), 'متوسط')}
 - كل بطاقة تحتوي على سؤال وجواب
 - الأسئلة متنوعة (تعريفات، مفاهيم، تطبيقات)
-- الإجابات واضحة ومختصرة
+- الإجابات واضحة ومختصرة{shard_requirements(options)}
 
 المحتوى:
 {content}
@@ -239,53 +1208,18 @@ def generate_flashcards():
 أرجع النتيجة بصيغة JSON فقط (بدون أي نص إضافي):
 {{"flashcards": [{{"question": "السؤال", "answer": "الجواب"}}]}}"""
 
-        model = get_genai_model(api_key)
-        response = model.generate_content(prompt)
-        result = parse_json_response(response.text)
-        
-        return jsonify({
-            'success': True,
-            'type': 'flashcards',
-            'data': result.get('flashcards', [])
-        })
-        
-    except Exception as e:
-        logger.error(f"Flashcards generation error: {str(e)}")
-        return jsonify({'error': str(e) or 'خطأ في إنشاء البطاقات التعليمية'}), 500
-
 
-@app.route('/api/studio/quiz', methods=['POST'])
-def generate_quiz():
-    """Generate quiz"""
-    try:
-        data = request.json
-        api_key = request.headers.get('X-API-Key')
-        
-        if not api_key:
-            return jsonify({'error': 'مفتاح API مطلوب'}), 400
-        
-        content = data.get('content', '')
-        options = data.get('options', {})
-        
-        if not content:
-            return jsonify({'error': 'المحتوى مطلوب'}), 400
-        
-        count_map = {'short': 5, 'medium': 10, 'long': 15}
-        count = count_map.get(options.get('length', 'medium'), 10)
-        
-        level_map = {
-            'beginner': 'مبتدئ',
-            'intermediate': 'متوسط',
-            'advanced': 'متقدم'
-        }
-        
-        prompt = f"""أنشئ اختباراً من {count} أسئلة باللغة العربية من المحتوى التالي.
+def build_quiz_prompt(content, options):
+    """Prompt for a multiple-choice quiz"""
+    count = item_count(options, QUIZ_COUNTS, 10)
+    
+    return f"""أنشئ اختباراً من {count} أسئلة باللغة العربية من المحتوى التالي.
 
 المتطلبات:
-- المستوى: {level_map.get(options.get('level', 'intermediate'), 'متوسط')}
+- المستوى: {LEVEL_MAP.get(options.get('level', 'intermediate'), 'متوسط')}
 - أنواع الأسئلة: اختيار من متعدد (4 خيارات)
 - كل سؤال له إجابة صحيحة واحدة
-- أضف شرحاً للإجابة الصحيحة
+- أضف شرحاً للإجابة الصحيحة{shard_requirements(options)}
 
 المحتوى:
 {content}
@@ -293,37 +1227,10 @@ def generate_quiz():
 أرجع النتيجة بصيغة JSON فقط (بدون أي نص إضافي):
 {{"quiz": {{"title": "عنوان الاختبار", "questions": [{{"question": "نص السؤال", "options": ["خيار 1", "خيار 2", "خيار 3", "خيار 4"], "correctIndex": 0, "explanation": "شرح الإجابة"}}]}}}}"""
 
-        model = get_genai_model(api_key)
-        response = model.generate_content(prompt)
-        result = parse_json_response(response.text)
-        
-        return jsonify({
-            'success': True,
-            'type': 'quiz',
-            'data': result.get('quiz', {'title': '', 'questions': []})
-        })
-        
-    except Exception as e:
-        logger.error(f"Quiz generation error: {str(e)}")
-        return jsonify({'error': str(e) or 'خطأ في إنشاء الاختبار'}), 500
 
-
-@app.route('/api/studio/mindmap', methods=['POST'])
-def generate_mindmap():
-    """Generate mind map"""
-    try:
-        data = request.json
-        api_key = request.headers.get('X-API-Key')
-        
-        if not api_key:
-            return jsonify({'error': 'مفتاح API مطلوب'}), 400
-        
-        content = data.get('content', '')
-        
-        if not content:
-            return jsonify({'error': 'المحتوى مطلوب'}), 400
-        
-        prompt = f"""أنشئ خريطة ذهنية (Mind Map) باللغة العربية تلخص المحتوى التالي.
+def build_mindmap_prompt(content, options):
+    """Prompt for a mind map"""
+    return f"""أنشئ خريطة ذهنية (Mind Map) باللغة العربية تلخص المحتوى التالي.
 
 المتطلبات:
 - موضوع رئيسي واحد
@@ -337,58 +1244,25 @@ def generate_mindmap():
 أرجع النتيجة بصيغة JSON فقط (بدون أي نص إضافي):
 {{"mindmap": {{"title": "الموضوع الرئيسي", "branches": [{{"name": "الفرع الرئيسي", "children": [{{"name": "فرع فرعي 1"}}, {{"name": "فرع فرعي 2"}}]}}]}}}}"""
 
-        model = get_genai_model(api_key)
-        response = model.generate_content(prompt)
-        result = parse_json_response(response.text)
-        
-        return jsonify({
-            'success': True,
-            'type': 'mindmap',
-            'data': result.get('mindmap', {'title': '', 'branches': []})
-        })
-        
-    except Exception as e:
-        logger.error(f"Mind map generation error: {str(e)}")
-        return jsonify({'error': str(e) or 'خطأ في إنشاء الخريطة الذهنية'}), 500
-
 
-@app.route('/api/studio/report', methods=['POST'])
-def generate_report():
-    """Generate report"""
-    try:
-        data = request.json
-        api_key = request.headers.get('X-API-Key')
-        
-        if not api_key:
-            return jsonify({'error': 'مفتاح API مطلوب'}), 400
-        
-        content = data.get('content', '')
-        options = data.get('options', {})
-        
-        if not content:
-            return jsonify({'error': 'المحتوى مطلوب'}), 400
-        
-        style_map = {
-            'formal': 'رسمي',
-            'academic': 'أكاديمي',
-            'conversational': 'عام'
-        }
-        level_map = {
-            'beginner': 'مبتدئ',
-            'intermediate': 'متوسط',
-            'advanced': 'متقدم'
-        }
-        length_map = {
-            'short': 'قصير',
-            'medium': 'متوسط',
-            'long': 'طويل ومفصل'
-        }
-        
-        prompt = f"""اكتب تقريراً شاملاً باللغة العربية عن المحتوى التالي.
+def build_report_prompt(content, options):
+    """Prompt for a markdown report"""
+    style_map = {
+        'formal': 'رسمي',
+        'academic': 'أكاديمي',
+        'conversational': 'عام'
+    }
+    length_map = {
+        'short': 'قصير',
+        'medium': 'متوسط',
+        'long': 'طويل ومفصل'
+    }
+    
+    return f"""اكتب تقريراً شاملاً باللغة العربية عن المحتوى التالي.
 
 المتطلبات:
 - الأسلوب: {style_map.get(options.get('style', 'conversational'), 'عام')}
-- المستوى: {level_map.get(options.get('level', 'intermediate'), 'متوسط')}
+- المستوى: {LEVEL_MAP.get(options.get('level', 'intermediate'), 'متوسط')}
 - الطول: {length_map.get(options.get('length', 'medium'), 'متوسط')}
 
 الهيكل المطلوب:
@@ -403,51 +1277,20 @@ def generate_report():
 
 اكتب التقرير بصيغة Markdown:"""
 
-        model = get_genai_model(api_key)
-        response = model.generate_content(prompt)
-        
-        return jsonify({
-            'success': True,
-            'type': 'report',
-            'data': {'markdown': response.text}
-        })
-        
-    except Exception as e:
-        logger.error(f"Report generation error: {str(e)}")
-        return jsonify({'error': str(e) or 'خطأ في إنشاء التقرير'}), 500
 
-
-@app.route('/api/studio/slides', methods=['POST'])
-def generate_slides():
-    """Generate slide deck"""
-    try:
-        data = request.json
-        api_key = request.headers.get('X-API-Key')
-        
-        if not api_key:
-            return jsonify({'error': 'مفتاح API مطلوب'}), 400
-        
-        content = data.get('content', '')
-        options = data.get('options', {})
-        
-        if not content:
-            return jsonify({'error': 'المحتوى مطلوب'}), 400
-        
-        count_map = {'short': 8, 'medium': 12, 'long': 20}
-        slide_count = count_map.get(options.get('length', 'medium'), 12)
-        
-        level_map = {
-            'beginner': 'مبتدئ',
-            'intermediate': 'متوسط',
-            'advanced': 'متقدم'
-        }
-        
-        prompt = f"""أنشئ محتوى عرض تقديمي من {slide_count} شريحة باللغة العربية.
+def build_slides_prompt(content, options):
+    """Prompt for a slide deck"""
+    slide_count = item_count(options, SLIDE_COUNTS, 12)
+    shard_lines = shard_requirements(
+        options, first='ابدأ بشريحة تمهيدية تعرّف بموضوع العرض', last='اختم بشريحة خلاصة للعرض كله'
+    )
+    
+    return f"""أنشئ محتوى عرض تقديمي من {slide_count} شريحة باللغة العربية.
 
 المتطلبات:
-- المستوى: {level_map.get(options.get('level', 'intermediate'), 'متوسط')}
+- المستوى: {LEVEL_MAP.get(options.get('level', 'intermediate'), 'متوسط')}
 - نقاط مختصرة في كل شريحة (3-5 نقاط)
-- ملاحظات للمتحدث لكل شريحة
+- ملاحظات للمتحدث لكل شريحة{shard_lines}
 
 المحتوى:
 {content}
@@ -455,37 +1298,10 @@ def generate_slides():
 أرجع النتيجة بصيغة JSON فقط (بدون أي نص إضافي):
 {{"presentation": {{"title": "عنوان العرض", "slides": [{{"title": "عنوان الشريحة", "points": ["نقطة 1", "نقطة 2"], "speakerNotes": "ملاحظات للمتحدث"}}]}}}}"""
 
-        model = get_genai_model(api_key)
-        response = model.generate_content(prompt)
-        result = parse_json_response(response.text)
-        
-        return jsonify({
-            'success': True,
-            'type': 'slides',
-            'data': result.get('presentation', {'title': '', 'slides': []})
-        })
-        
-    except Exception as e:
-        logger.error(f"Slides generation error: {str(e)}")
-        return jsonify({'error': str(e) or 'خطأ في إنشاء العرض التقديمي'}), 500
-
 
-@app.route('/api/studio/infographic', methods=['POST'])
-def generate_infographic():
-    """Generate infographic content"""
-    try:
-        data = request.json
-        api_key = request.headers.get('X-API-Key')
-        
-        if not api_key:
-            return jsonify({'error': 'مفتاح API مطلوب'}), 400
-        
-        content = data.get('content', '')
-        
-        if not content:
-            return jsonify({'error': 'المحتوى مطلوب'}), 400
-        
-        prompt = f"""أنشئ محتوى إنفوجرافيك باللغة العربية يلخص المحتوى التالي.
+def build_infographic_prompt(content, options):
+    """Prompt for infographic content"""
+    return f"""أنشئ محتوى إنفوجرافيك باللغة العربية يلخص المحتوى التالي.
 
 المتطلبات:
 - عنوان جذاب
@@ -499,45 +1315,16 @@ def generate_infographic():
 أرجع النتيجة بصيغة JSON فقط (بدون أي نص إضافي):
 {{"infographic": {{"title": "العنوان", "subtitle": "العنوان الفرعي", "points": [{{"icon": "📌", "title": "النقطة", "description": "الوصف"}}], "stats": [{{"value": "85%", "label": "الوصف"}}], "conclusion": "الخلاصة"}}}}"""
 
-        model = get_genai_model(api_key)
-        response = model.generate_content(prompt)
-        result = parse_json_response(response.text)
-        
-        return jsonify({
-            'success': True,
-            'type': 'infographic',
-            'data': result.get('infographic', {'title': '', 'points': [], 'stats': [], 'conclusion': ''})
-        })
-        
-    except Exception as e:
-        logger.error(f"Infographic generation error: {str(e)}")
-        return jsonify({'error': str(e) or 'خطأ في إنشاء الإنفوجرافيك'}), 500
-
 
-@app.route('/api/studio/video', methods=['POST'])
-def generate_video():
-    """Generate video overview content"""
-    try:
-        data = request.json
-        api_key = request.headers.get('X-API-Key')
-        
-        if not api_key:
-            return jsonify({'error': 'مفتاح API مطلوب'}), 400
-        
-        content = data.get('content', '')
-        options = data.get('options', {})
-        
-        if not content:
-            return jsonify({'error': 'المحتوى مطلوب'}), 400
-        
-        # Generate script (similar to audio)
-        style_map = {
-            'formal': 'رسمي',
-            'academic': 'أكاديمي',
-            'conversational': 'محادثة طبيعية'
-        }
-        
-        prompt_script = f"""اكتب نصاً للقراءة الصوتية (Video Overview) باللغة العربية يلخص المحتوى التالي.
+def build_video_prompt(content, options):
+    """Prompt for the video overview script"""
+    style_map = {
+        'formal': 'رسمي',
+        'academic': 'أكاديمي',
+        'conversational': 'محادثة طبيعية'
+    }
+    
+    return f"""اكتب نصاً للقراءة الصوتية (Video Overview) باللغة العربية يلخص المحتوى التالي.
 
 المتطلبات:
 - اكتب بأسلوب {style_map.get(options.get('style', 'conversational'), 'محادثة طبيعية')}
@@ -550,146 +1337,1248 @@ def generate_video():
 
 اكتب النص:"""
 
-        model = get_genai_model(api_key)
-        script_response = model.generate_content(prompt_script)
-        script = script_response.text
+
+# Studio artifact registry. JSON artifacts name the key to pull out of the
+# parsed response and the empty value to fall back to; text artifacts provide
+# a ``finish`` function that shapes the raw model text and can be streamed,
+# with ``stream_field`` naming the field that carries the streamed text.
+# Count-based artifacts add ``shard``: their item counts per length, the list
+# holding the items (None: the artifact is the list) and the text compared
+# when removing near-duplicates across shards.
+STUDIO_ARTIFACTS = {
+    'audio': {
+        'prompt': build_audio_prompt,
+        'finish': finish_audio,
+        'stream_field': 'script',
+        'label': 'Audio generation',
+        'error': 'خطأ في إنشاء الملخص الصوتي'
+    },
+    'flashcards': {
+        'prompt': build_flashcards_prompt,
+        'result_key': 'flashcards',
+        'schema': ARTIFACT_SCHEMAS['flashcards'],
+        'default': [],
+        'shard': {
+            'counts': FLASHCARD_COUNTS,
+            'default_count': 20,
+            'items_key': None,
+            'item_text': lambda card: str(card.get('question', ''))
+        },
+        'label': 'Flashcards generation',
+        'error': 'خطأ في إنشاء البطاقات التعليمية'
+    },
+    'quiz': {
+        'prompt': build_quiz_prompt,
+        'result_key': 'quiz',
+        'schema': ARTIFACT_SCHEMAS['quiz'],
+        'default': {'title': '', 'questions': []},
+        'shard': {
+            'counts': QUIZ_COUNTS,
+            'default_count': 10,
+            'items_key': 'questions',
+            'item_text': lambda question: str(question.get('question', ''))
+        },
+        'label': 'Quiz generation',
+        'error': 'خطأ في إنشاء الاختبار'
+    },
+    'mindmap': {
+        'prompt': build_mindmap_prompt,
+        'result_key': 'mindmap',
+        'schema': ARTIFACT_SCHEMAS['mindmap'],
+        'default': {'title': '', 'branches': []},
+        'label': 'Mind map generation',
+        'error': 'خطأ في إنشاء الخريطة الذهنية'
+    },
+    'report': {
+        'prompt': build_report_prompt,
+        'finish': lambda text: {'markdown': text},
+        'stream_field': 'markdown',
+        'label': 'Report generation',
+        'error': 'خطأ في إنشاء التقرير'
+    },
+    'slides': {
+        'prompt': build_slides_prompt,
+        'result_key': 'presentation',
+        'schema': ARTIFACT_SCHEMAS['slides'],
+        'default': {'title': '', 'slides': []},
+        'shard': {
+            'counts': SLIDE_COUNTS,
+            'default_count': 12,
+            'items_key': 'slides',
+            'item_text': lambda slide: ' '.join(
+                [str(slide.get('title', ''))] + [str(point) for point in slide.get('points') or []]
+            )
+        },
+        'label': 'Slides generation',
+        'error': 'خطأ في إنشاء العرض التقديمي'
+    },
+    'infographic': {
+        'prompt': build_infographic_prompt,
+        'result_key': 'infographic',
+        'schema': ARTIFACT_SCHEMAS['infographic'],
+        'default': {'title': '', 'points': [], 'stats': [], 'conclusion': ''},
+        'label': 'Infographic generation',
+        'error': 'خطأ في إنشاء الإنفوجرافيك'
+    },
+    'video': {
+        'prompt': build_video_prompt,
+        'finish': lambda text: {'script': text, 'note': 'المحتوى جاهز للتحويل إلى فيديو'},
+        'stream_field': 'script',
+        'label': 'Video generation',
+        'error': 'خطأ في إنشاء محتوى الفيديو'
+    }
+}
+
+
+DIGEST_PROMPT = """لخّص الجزء التالي من مادة دراسية باللغة العربية تلخيصاً مركّزاً سيُستخدم لاحقاً لإنشاء تقارير واختبارات وبطاقات تعليمية.
+
+المتطلبات:
+- احتفظ بكل التعريفات والمفاهيم والمصطلحات الأساسية
+- احتفظ بالأرقام والتواريخ والأسماء والأمثلة المهمة
+- حافظ على ترتيب الأفكار وعناوين الأقسام
+- لا تضف معلومات من خارج النص
+- الطول: نحو خُمس طول النص الأصلي
+
+النص:
+{chunk}
+
+التلخيص:"""
+DIGEST_PROMPT_VERSION = hashlib.sha256(DIGEST_PROMPT.encode('utf-8')).hexdigest()[:16]
+
+
+def digest_chunk(api_key, chunk):
+    """Digest one chunk of oversized content, cached by the chunk's hash"""
+    cache_key = make_cache_key('digest', chunk, {'prompt': DIGEST_PROMPT_VERSION}, MODEL_NAME)
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    response = get_genai_model(api_key).generate_content(DIGEST_PROMPT.format(chunk=chunk))
+    digest = response.text.strip()
+    if digest:
+        result_cache.set(cache_key, digest)
+    return digest
+
+
+def prepare_content(api_key, content, options):
+    """Condense content over MAP_REDUCE_THRESHOLD into chunk digests before prompting"""
+    if len(content) <= MAP_REDUCE_THRESHOLD or not options.get('map_reduce', True):
+        return content
+    
+    with timed_stage('condense'):
+        text, _ = condense(
+            content,
+            lambda chunk: digest_chunk(api_key, chunk),
+            digest_executor,
+            SOURCE_SEPARATOR,
+            chunk_chars=MAP_CHUNK_CHARS,
+            max_chars=MAP_REDUCE_THRESHOLD
+        )
+    return text
+
+
+# Stands in for the content in studio prompts when it sits in a cached context
+CACHED_CONTENT_REFERENCE = '(المحتوى الدراسي الكامل مرفق في بداية هذه المحادثة)'
+
+
+def build_studio_prompt(api_key, spec, content, options):
+    """Return ``(cached_content, prompt)`` for a studio artifact.
+
+    Large content is placed in a provider-side cached context shared by every
+    artifact built from it, and the prompt only refers to it.
+    """
+    with timed_stage('prompt'):
+        cached_content = None
+        if options.get('context_cache', True):
+            cached_content = context_cache.get(api_key, None, content)
+        if cached_content:
+            return cached_content, spec['prompt'](CACHED_CONTENT_REFERENCE, options)
+        return None, spec['prompt'](content, options)
+
+
+def artifact_cache_key(artifact_type, content, options):
+    return make_cache_key(f'studio:{artifact_type}', content, options, MODEL_NAME)
+
+
+# JSON artifacts request schema-constrained output (response_schema)
+STRUCTURED_OUTPUT = os.environ.get('KORASTY_STRUCTURED_OUTPUT', 'true') != 'false'
+parse_stats = ParseStats()
+
+REASK_PROMPT = """الرد التالي كان يجب أن يكون JSON مطابقاً للمخطط المطلوب لكنه يحتوي على أخطاء.
+
+الأخطاء:
+{errors}
+
+المخطط:
+{schema}
+
+الرد السابق:
+{text}
+
+أعد كتابة الرد نفسه بصيغة JSON صحيحة ومكتملة تطابق المخطط، دون تغيير المحتوى ودون أي نص إضافي."""
+
+
+def artifact_generation_config(spec):
+    """Generation config asking for schema-constrained JSON, or None for text artifacts"""
+    if 'schema' not in spec or not STRUCTURED_OUTPUT:
+        return None
+    return {'response_mime_type': 'application/json', 'response_schema': spec['schema']}
+
+
+def build_reask_prompt(spec, text, errors):
+    """Targeted retry: fix the previous reply's JSON instead of regenerating from the content"""
+    return REASK_PROMPT.format(
+        errors='\n'.join(f'- {error}' for error in errors[:10]),
+        schema=json.dumps(spec['schema'], ensure_ascii=False),
+        text=text
+    )
+
+
+def generate_artifact(artifact_type, api_key, content, options, force_refresh=False):
+    """Generate a studio artifact, serving repeats from the result cache.
+
+    Returns ``(data, cache_status)`` where ``cache_status`` is ``HIT``, ``MISS``,
+    ``COALESCED`` (shared an identical in-flight generation) or ``BYPASS``
+    (``force_refresh`` requested).
+    """
+    cache_key = artifact_cache_key(artifact_type, content, options)
+    
+    if force_refresh:
+        return compute_artifact(artifact_type, api_key, content, options, cache_key), 'BYPASS'
+    
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        return cached, 'HIT'
+    
+    data, shared = single_flight.do(
+        cache_key,
+        lambda: compute_artifact(artifact_type, api_key, content, options, cache_key),
+        lookup=lambda: result_cache.get(cache_key, count=False)
+    )
+    return data, 'COALESCED' if shared else 'MISS'
+
+
+def compute_artifact(artifact_type, api_key, content, options, cache_key):
+    """Call the model for a studio artifact and cache a valid result"""
+    return run_model_calls(api_key, artifact_calls(artifact_type, api_key, content, options, cache_key))
+
+
+def artifact_calls(artifact_type, api_key, content, options, cache_key):
+    """``compute_artifact`` as a model-call generator (see ``ModelCall``)"""
+    content = prepare_content(api_key, content, options)
+    shards = plan_artifact_shards(artifact_type, content, options)
+    if len(shards) > 1:
+        data, errors = compute_sharded_artifact(artifact_type, api_key, shards, options)
+    else:
+        data, errors = yield from artifact_model_calls(artifact_type, api_key, content, options)
+    
+    # An invalid or partial response is returned as-is but not worth remembering
+    if not errors:
+        result_cache.set(cache_key, data)
+    
+    return data
+
+
+def run_artifact_model(artifact_type, api_key, content, options):
+    """One generation, re-asked once if its JSON is invalid; returns ``(data, errors)``"""
+    return run_model_calls(api_key, artifact_model_calls(artifact_type, api_key, content, options))
+
+
+def artifact_model_calls(artifact_type, api_key, content, options):
+    """``run_artifact_model`` as a model-call generator (see ``ModelCall``)"""
+    spec = STUDIO_ARTIFACTS[artifact_type]
+    config = artifact_generation_config(spec)
+    cached_content, prompt = build_studio_prompt(api_key, spec, content, options)
+    try:
+        response = yield ModelCall(cached_content, prompt, config)
+    except api_exceptions.NotFound:
+        if not cached_content:
+            raise
+        # The cached context is gone upstream; send the content inline
+        context_cache.invalidate(cached_content)
+        return (yield from artifact_model_calls(artifact_type, api_key, content, dict(options, context_cache=False)))
+    
+    data, errors = finish_artifact(artifact_type, response.text)
+    if errors and 'schema' in spec:
+        # The re-ask carries the reply and the schema, not the content, so it
+        # does not need (or depend on) the cached context
+        response = yield ModelCall(None, build_reask_prompt(spec, response.text, errors), config)
+        data, errors = finish_artifact(artifact_type, response.text, reask=True)
+    
+    return data, errors
+
+
+def plan_artifact_shards(artifact_type, content, options):
+    """``[(items, section)]`` for a sharded generation; a single entry means one call"""
+    shard = STUDIO_ARTIFACTS[artifact_type].get('shard')
+    if not shard or not SHARDING_ENABLED or not options.get('sharding', True):
+        return [(None, content)]
+    count = item_count(options, shard['counts'], shard['default_count'])
+    return plan_shards(count, content, SHARD_ITEMS, SHARD_MIN_CHARS)
+
+
+def compute_sharded_artifact(artifact_type, api_key, shards, options):
+    """Generate the shards in parallel and merge them; returns ``(data, errors)``.
+
+    A shard with invalid output is retried on its own; shards that still fail
+    are left out of the merged artifact and reported in ``errors``.
+    """
+    spec = STUDIO_ARTIFACTS[artifact_type]
+    
+    def generate_shard(index, items, section):
+        shard_options = dict(options, shard_items=items, shard_part=[index + 1, len(shards)])
+        data, errors = run_artifact_model(artifact_type, api_key, section, shard_options)
+        if errors:
+            raise ValueError(f"invalid output: {'; '.join(errors[:3])}")
+        return data
+    
+    # Shard calls run on pool threads, outside the request's timer
+    with timed_stage('shards'):
+        results, failures = generate_shards(shards, generate_shard, shard_executor, retries=SHARD_RETRIES)
+    if len(failures) == len(shards):
+        raise failures[0]
+    
+    data, removed = merge_shards(
+        results, spec['shard']['items_key'], spec['shard']['item_text'], SHARD_DEDUP_THRESHOLD
+    )
+    logger.info(
+        f"{spec['label']}: {len(shards)} shards, {removed} duplicates removed, {len(failures)} failed"
+    )
+    return data, [f'shard {index + 1}: {error}' for index, error in sorted(failures.items())]
+
+
+def finish_artifact(artifact_type, text, reask=False):
+    """Shape raw model text into artifact data; returns ``(data, errors)``.
+
+    For JSON artifacts ``errors`` lists schema violations and the outcome is
+    counted in ``parse_stats``; ``reask`` marks the answer to a re-ask.
+    """
+    spec = STUDIO_ARTIFACTS[artifact_type]
+    if 'result_key' not in spec:
+        return spec['finish'](text), [] if text else ['$: empty response']
+    
+    with timed_stage('parse'):
+        parsed, repaired = parse_json_response(text, spec['schema'])
+        if parsed is None:
+            errors = ['$: not valid JSON']
+        else:
+            errors = validate(parsed, spec['schema'])
+    
+    if errors:
+        parse_stats.record(artifact_type, 'failed' if reask else 'reasked')
+        logger.error(f"{spec['label']} JSON errors: {'; '.join(errors[:3])}")
+    else:
+        parse_stats.record(artifact_type, 'recovered' if reask else 'repaired' if repaired else 'valid')
+    
+    if not isinstance(parsed, dict):
+        return spec['default'], errors
+    return parsed.get(spec['result_key'], spec['default']), errors
+
+
+def stream_artifact(artifact_type, api_key, content, options, force_refresh=False, save=True):
+    """Stream a text artifact as SSE ``delta`` events.
+
+    The final ``done`` event carries the artifact's metadata (everything except
+    the streamed text, e.g. the duration estimate) plus timing, cache status
+    and the stored artifact's id.
+    """
+    spec = STUDIO_ARTIFACTS[artifact_type]
+    cache_key = artifact_cache_key(artifact_type, content, options)
+    started = time.perf_counter()
+    
+    cached_content = None
+    try:
+        if not force_refresh:
+            cached = result_cache.get(cache_key)
+            if cached is not None:
+                yield sse_event('delta', {'text': cached[spec['stream_field']]})
+                yield artifact_done_event(artifact_type, api_key, cached, 'HIT', save, started, 0)
+                return
+        
+        cached_content, prompt = artifact_stream_prompt(artifact_type, api_key, content, options)
+        chunks = get_genai_model(api_key, cached_content).generate_content(prompt, stream=True)
+        
+        parts = []
+        first_token_ms = None
+        for text in iter_response_text(chunks):
+            if first_token_ms is None:
+                first_token_ms = round((time.perf_counter() - started) * 1000)
+            parts.append(text)
+            yield sse_event('delta', {'text': text})
+        
+        result = finish_streamed_artifact(artifact_type, ''.join(parts), cache_key)
+        yield artifact_done_event(
+            artifact_type, api_key, result, 'BYPASS' if force_refresh else 'MISS', save, started, first_token_ms
+        )
         
-        return jsonify({
+    except Exception as e:
+        count_error(e)
+        yield artifact_stream_failed(artifact_type, e, cached_content)
+
+
+def artifact_stream_prompt(artifact_type, api_key, content, options):
+    """``(cached_content, prompt)`` for a streamed artifact"""
+    content = prepare_content(api_key, content, options)
+    return build_studio_prompt(api_key, STUDIO_ARTIFACTS[artifact_type], content, options)
+
+
+def finish_streamed_artifact(artifact_type, text, cache_key):
+    """Shape a fully streamed reply and cache it if valid; returns the artifact data"""
+    result, errors = finish_artifact(artifact_type, text)
+    if not errors:
+        result_cache.set(cache_key, result)
+    return result
+
+
+def artifact_done_event(artifact_type, api_key, result, cache_status, save, started, first_token_ms):
+    """The ``done`` event closing an artifact stream; stores the artifact"""
+    spec = STUDIO_ARTIFACTS[artifact_type]
+    metadata = {k: v for k, v in result.items() if k != spec['stream_field']}
+    return sse_event('done', {
+        'success': True,
+        'type': artifact_type,
+        'data': metadata,
+        'cache': cache_status,
+        'artifact_id': save_artifact(api_key, artifact_type, result, save),
+        'timing': {
+            'first_token_ms': first_token_ms,
+            'total_ms': round((time.perf_counter() - started) * 1000)
+        }
+    })
+
+
+def artifact_stream_failed(artifact_type, error, cached_content):
+    """Log a failed artifact stream and drop a cached context the provider lost; returns the ``error`` event"""
+    spec = STUDIO_ARTIFACTS[artifact_type]
+    if cached_content and isinstance(error, api_exceptions.NotFound):
+        context_cache.invalidate(cached_content)
+    logger.error(f"{spec['label']} stream error: {str(error)}")
+    return sse_event('error', {'error': str(error) or spec['error']})
+
+
+def artifact_title(result):
+    """A short title for the artifact list: the artifact's own title or first heading"""
+    if not isinstance(result, dict):
+        return ''
+    if result.get('title'):
+        return str(result['title'])[:200]
+    for line in (result.get('markdown') or result.get('script') or '').splitlines():
+        line = line.strip().lstrip('#').strip()
+        if line:
+            return line[:200]
+    return ''
+
+
+def save_artifact(api_key, artifact_type, result, save=True):
+    """Store a generated artifact for this key; returns its id (None if not stored)"""
+    if not save or not ARTIFACT_STORE_ENABLED:
+        return None
+    try:
+        return artifact_store.save(key_fingerprint(api_key), artifact_type, result, artifact_title(result))
+    except Exception as e:
+        # Storing is a convenience; the generated artifact is still returned
+        count_error(e)
+        logger.error(f"Artifact store error: {str(e)}")
+        return None
+
+
+def parse_studio_request(data, api_key):
+    """Validate a studio request; returns ``(content, options, force_refresh, save)`` or raises RequestError"""
+    if not api_key:
+        raise RequestError({'error': 'مفتاح API مطلوب'})
+    
+    content, missing = resolve_content(data)
+    
+    if missing:
+        raise missing_sources_error(missing)
+    
+    if not content:
+        raise RequestError({'error': 'المحتوى مطلوب'})
+    
+    return content, data.get('options', {}), bool(data.get('force_refresh')), data.get('save', True) is not False
+
+
+def studio_payload(api_key, artifact_type, result, save=True):
+    """The /api/studio/* success body; stores the artifact"""
+    return {
+        'success': True,
+        'type': artifact_type,
+        'data': result,
+        'artifact_id': save_artifact(api_key, artifact_type, result, save)
+    }
+
+
+def studio_response(artifact_type):
+    """Shared request handling for the /api/studio/* routes"""
+    spec = STUDIO_ARTIFACTS[artifact_type]
+    try:
+        data = request.json
+        api_key = request.headers.get('X-API-Key')
+        content, options, force_refresh, save = parse_studio_request(data, api_key)
+        
+        if wants_job(data):
+            def work(progress):
+                result, cache_status = generate_artifact(
+                    artifact_type, api_key, content, options, force_refresh
+                )
+                return dict(studio_payload(api_key, artifact_type, result, save), cache=cache_status)
+            
+            return job_response(f'studio:{artifact_type}', api_key, work)
+        
+        if 'stream_field' in spec and wants_stream(data):
+            return sse_response(stream_artifact(
+                artifact_type, api_key, content, options, force_refresh, save
+            ))
+        
+        result, cache_status = generate_artifact(
+            artifact_type, api_key, content, options, force_refresh
+        )
+        
+        response = jsonify(studio_payload(api_key, artifact_type, result, save))
+        response.headers['X-Cache'] = cache_status
+        return response
+        
+    except RequestError as e:
+        return jsonify(e.payload), e.status
+    except UpstreamBusyError as e:
+        count_error(e)
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        count_error(e)
+        logger.error(f"{spec['label']} error: {str(e)}")
+        return jsonify({'error': str(e) or spec['error']}), 500
+
+
+@app.route('/api/studio/audio', methods=['POST'])
+def generate_audio():
+    """Generate audio overview script"""
+    return studio_response('audio')
+
+
+@app.route('/api/studio/flashcards', methods=['POST'])
+def generate_flashcards():
+    """Generate flashcards"""
+    return studio_response('flashcards')
+
+
+@app.route('/api/studio/quiz', methods=['POST'])
+def generate_quiz():
+    """Generate quiz"""
+    return studio_response('quiz')
+
+
+@app.route('/api/studio/mindmap', methods=['POST'])
+def generate_mindmap():
+    """Generate mind map"""
+    return studio_response('mindmap')
+
+
+@app.route('/api/studio/report', methods=['POST'])
+def generate_report():
+    """Generate report"""
+    return studio_response('report')
+
+
+@app.route('/api/studio/slides', methods=['POST'])
+def generate_slides():
+    """Generate slide deck"""
+    return studio_response('slides')
+
+
+@app.route('/api/studio/infographic', methods=['POST'])
+def generate_infographic():
+    """Generate infographic content"""
+    return studio_response('infographic')
+
+
+@app.route('/api/studio/video', methods=['POST'])
+def generate_video():
+    """Generate video overview content"""
+    return studio_response('video')
+
+
+def parse_batch_request(data, api_key):
+    """Validate a batch request; returns ``(content, requested, force_refresh, save)`` or raises RequestError.
+
+    ``requested`` lists ``(artifact_type, options)`` pairs.
+    """
+    content, shared_options, force_refresh, save = parse_studio_request(data, api_key)
+    
+    # Each item is an artifact type or {"type": ..., "options": {...}}
+    requested = []
+    for item in data.get('artifacts', []):
+        if isinstance(item, str):
+            item = {'type': item}
+        artifact_type = item.get('type')
+        if artifact_type not in STUDIO_ARTIFACTS:
+            raise RequestError({'error': f'نوع غير مدعوم: {artifact_type}'})
+        requested.append((artifact_type, dict(shared_options, **item.get('options', {}))))
+    
+    if not requested:
+        raise RequestError({'error': 'قائمة الأنواع المطلوبة فارغة'})
+    
+    if len(requested) > STUDIO_BATCH_MAX_ARTIFACTS:
+        raise RequestError({'error': f'الحد الأقصى {STUDIO_BATCH_MAX_ARTIFACTS} عناصر في الطلب الواحد'})
+    
+    return content, requested, force_refresh, save
+
+
+def batch_results(api_key, requested, outcomes, save=True):
+    """One result per requested item from its ``(data, cache_status)`` or the exception it raised"""
+    results = []
+    for (artifact_type, _), outcome in zip(requested, outcomes):
+        if isinstance(outcome, Exception):
+            spec = STUDIO_ARTIFACTS[artifact_type]
+            logger.error(f"Batch {spec['label']} error: {str(outcome)}")
+            results.append({
+                'type': artifact_type,
+                'success': False,
+                'error': str(outcome) or spec['error']
+            })
+            continue
+        result, cache_status = outcome
+        results.append({
+            'type': artifact_type,
             'success': True,
-            'type': 'video',
-            'data': {
-                'script': script,
-                'note': 'المحتوى جاهز للتحويل إلى فيديو'
-            }
+            'data': result,
+            'cache': cache_status,
+            'artifact_id': save_artifact(api_key, artifact_type, result, save)
         })
-        
-    except Exception as e:
-        logger.error(f"Video generation error: {str(e)}")
-        return jsonify({'error': str(e) or 'خطأ في إنشاء محتوى الفيديو'}), 500
+    return results
 
 
-@app.route('/api/process/pdf', methods=['POST'])
-def process_pdf():
-    """Process PDF content using Gemini"""
+def batch_payload(results):
+    """``(body, status)`` for a batch: 500 only when every item failed"""
+    succeeded = any(r['success'] for r in results)
+    return {'success': succeeded, 'results': results}, 200 if succeeded else 500
+
+
+def run_batch(api_key, content, requested, force_refresh, save=True):
+    """Fan ``(artifact_type, options)`` pairs out on the studio pool; one result per item"""
+    futures = [
+        studio_executor.submit(generate_artifact, artifact_type, api_key, content, options, force_refresh)
+        for artifact_type, options in requested
+    ]
+    
+    outcomes = []
+    for future in futures:
+        try:
+            outcomes.append(future.result())
+        except Exception as e:
+            count_error(e)
+            outcomes.append(e)
+    
+    return batch_results(api_key, requested, outcomes, save)
+
+
+@app.route('/api/studio/batch', methods=['POST'])
+def generate_batch():
+    """Generate several studio artifacts for the same content concurrently"""
     try:
         data = request.json
         api_key = request.headers.get('X-API-Key')
-        
-        if not api_key:
-            return jsonify({'error': 'مفتاح API مطلوب'}), 400
-        
-        base64_content = data.get('content', '')
-        
-        if not base64_content:
-            return jsonify({'error': 'محتوى الملف مطلوب'}), 400
-        
-        model = get_genai_model(api_key)
-        
-        # Create content with PDF
+        content, requested, force_refresh, save = parse_batch_request(data, api_key)
+        
+        if wants_job(data):
+            def work(progress):
+                return batch_payload(run_batch(api_key, content, requested, force_refresh, save))[0]
+            
+            return job_response('studio:batch', api_key, work)
+        
+        body, status = batch_payload(run_batch(api_key, content, requested, force_refresh, save))
+        return jsonify(body), status
+        
+    except RequestError as e:
+        return jsonify(e.payload), e.status
+    except UpstreamBusyError as e:
+        count_error(e)
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        count_error(e)
+        logger.error(f"Batch generation error: {str(e)}")
+        return jsonify({'error': str(e) or 'خطأ في إنشاء المحتوى'}), 500
+
+
+# Server-side upload limits, mirroring CONFIG.MAX_FILE_SIZE in the frontend
+MAX_UPLOAD_BYTES = {
+    'pdf': int(os.environ.get('KORASTY_MAX_DOCUMENT_MB', '50')) * 1024 * 1024,
+    'image': int(os.environ.get('KORASTY_MAX_IMAGE_MB', '20')) * 1024 * 1024,
+    'audio': int(os.environ.get('KORASTY_MAX_AUDIO_MB', '100')) * 1024 * 1024
+}
+
+# Files above this size go through the Gemini File API instead of inline bytes
+INLINE_UPLOAD_LIMIT = int(os.environ.get('KORASTY_INLINE_UPLOAD_MB', '15')) * 1024 * 1024
+
+# Large PDFs are split locally into page ranges extracted in parallel
+PDF_PAGES_PER_CHUNK = int(os.environ.get('KORASTY_PDF_PAGES_PER_CHUNK', '10'))
+PDF_CHUNK_RETRIES = int(os.environ.get('KORASTY_PDF_CHUNK_RETRIES', '2'))
+extraction_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('KORASTY_EXTRACTION_WORKERS', '4')),
+    thread_name_prefix='extract'
+)
+
+# Long audio is split locally into overlapping segments transcribed in parallel
+AUDIO_SEGMENT_SECONDS = int(os.environ.get('KORASTY_AUDIO_SEGMENT_SECONDS', '300'))
+AUDIO_OVERLAP_SECONDS = int(os.environ.get('KORASTY_AUDIO_OVERLAP_SECONDS', '5'))
+AUDIO_SEGMENT_RETRIES = int(os.environ.get('KORASTY_AUDIO_SEGMENT_RETRIES', '2'))
+
+# Images are fitted within this many pixels and re-encoded before upload;
+# batches of them are extracted on their own bounded pool
+IMAGE_MAX_SIDE = int(os.environ.get('KORASTY_IMAGE_MAX_SIDE', '2048'))
+IMAGE_QUALITY = int(os.environ.get('KORASTY_IMAGE_QUALITY', '85'))
+IMAGE_BATCH_MAX = int(os.environ.get('KORASTY_IMAGE_BATCH_MAX', '32'))
+image_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('KORASTY_IMAGE_WORKERS', '8')),
+    thread_name_prefix='image'
+)
+
+PDF_EXTRACTION_PROMPT = 'استخرج كل النص من هذا الملف PDF. حافظ على هيكل المحتوى والعناوين والفقرات.'
+IMAGE_EXTRACTION_PROMPT = 'استخرج كل النص الموجود في هذه الصورة بالعربية أو بلغته الأصلية. إذا كانت الصورة تحتوي على رسوم بيانية أو جداول، صفها بوضوح.'
+AUDIO_TRANSCRIPTION_PROMPT = 'انسخ هذا الملف الصوتي إلى نص. إذا كان باللغة العربية، اكتب النص بالعربية. إذا كان بلغة أخرى، اكتب النص بلغته الأصلية ثم ترجمه إلى العربية.'
+AUDIO_SEGMENT_PROMPT = AUDIO_TRANSCRIPTION_PROMPT + ' هذا مقطع من تسجيل أطول: اكتب النص المنطوق فقط، دون مقدمة أو خاتمة أو عناوين.'
+
+# Bump when extraction output changes without a prompt change (e.g. PDF splitting)
+EXTRACTION_PIPELINE_VERSION = 3
+
+
+def extraction_cache_key(kind, file_hash, mime_type, prompt, options=None):
+    """Cache key for extracted text: file hash, mime type, prompt version and model"""
+    prompt_version = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:16]
+    payload = json.dumps(
+        [kind, file_hash, mime_type, prompt_version, EXTRACTION_PIPELINE_VERSION, MODEL_NAME, options or {}],
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def extract_from_file(api_key, fileobj, mime_type, size, prompt):
+    """Run one extraction prompt over an uploaded file"""
+    model = get_genai_model(api_key)
+    
+    if size <= INLINE_UPLOAD_LIMIT:
+        fileobj.seek(0)
         response = model.generate_content([
             {
-                'mime_type': 'application/pdf',
-                'data': base64_content
+                'mime_type': mime_type,
+                'data': fileobj.read()
             },
-            'استخرج كل النص من هذا الملف PDF. حافظ على هيكل المحتوى والعناوين والفقرات.'
+            prompt
         ])
+        return response.text
+    
+    file_client = model_pool.get_file_client(api_key)
+    uploaded = upload_to_file_api(file_client, fileobj, mime_type)
+    try:
+        response = model.generate_content([uploaded, prompt])
+        return response.text
+    finally:
+        delete_uploaded_file(file_client, uploaded)
+
+
+def extract_pdf_pages(api_key, fileobj, mime_type, size, options, progress=None):
+    """Extract a PDF by page ranges: local text layer first, model for the rest"""
+    if not pdf_support_available():
+        return extract_from_file(api_key, fileobj, mime_type, size, PDF_EXTRACTION_PROMPT), None
+    
+    def extract_range(pdf_bytes, first_page, last_page):
+        return extract_from_file(
+            api_key, io.BytesIO(pdf_bytes), 'application/pdf', len(pdf_bytes), PDF_EXTRACTION_PROMPT
+        )
+    
+    def on_progress(done, total):
+        if total:
+            logger.info(f"PDF extraction progress: {done}/{total} page ranges")
+        if progress:
+            progress({'done': done, 'total': total, 'unit': 'page_ranges'})
+    
+    use_text_layer = options.get('text_layer', 'true') != 'false'
+    try:
+        text, details = extract_pdf(
+            fileobj, extract_range, extraction_executor,
+            pages_per_chunk=PDF_PAGES_PER_CHUNK,
+            retries=PDF_CHUNK_RETRIES,
+            on_progress=on_progress,
+            use_text_layer=use_text_layer
+        )
+    except ValueError as e:
+        # Not parseable locally (e.g. damaged file): let the model try it whole
+        logger.info(f"PDF split skipped: {str(e)}")
+        return extract_from_file(api_key, fileobj, mime_type, size, PDF_EXTRACTION_PROMPT), None
+    
+    if not text and details['failed_ranges']:
+        raise RuntimeError(details['failed_ranges'][0]['error'])
+    
+    return text, details
+
+
+def extract_image_text(api_key, fileobj, mime_type, size, options, progress=None):
+    """Extract text from an image, downscaled and re-encoded locally first"""
+    IMAGE_BYTES.inc(size, stage='received')
+    if options.get('downscale', 'true') == 'false' or not image_support_available():
+        IMAGE_BYTES.inc(size, stage='sent')
+        return extract_from_file(api_key, fileobj, mime_type, size, IMAGE_EXTRACTION_PROMPT), None
+    
+    try:
+        image_bytes, image_mime, details = downscale_image(
+            fileobj, mime_type, size, max_side=IMAGE_MAX_SIDE, quality=IMAGE_QUALITY
+        )
+    except ValueError as e:
+        # Not decodable locally (e.g. HEIC without pillow-heif): send it as uploaded
+        logger.info(f"Image downscale skipped: {str(e)}")
+        IMAGE_BYTES.inc(size, stage='sent')
+        return extract_from_file(api_key, fileobj, mime_type, size, IMAGE_EXTRACTION_PROMPT), None
+    
+    IMAGE_BYTES.inc(len(image_bytes), stage='sent')
+    text = extract_from_file(
+        api_key, io.BytesIO(image_bytes), image_mime, len(image_bytes), IMAGE_EXTRACTION_PROMPT
+    )
+    return text, details
+
+
+def transcribe_audio_segments(api_key, fileobj, mime_type, size, options, progress=None):
+    """Transcribe long audio as overlapping segments in parallel; short audio in one call"""
+    def transcribe_whole():
+        return extract_from_file(api_key, fileobj, mime_type, size, AUDIO_TRANSCRIPTION_PROMPT), None
+    
+    if options.get('split', 'true') == 'false':
+        return transcribe_whole()
+    
+    try:
+        audio = AudioSplitter(fileobj, mime_type)
+    except ValueError as e:
+        # No ffmpeg for this format, or not readable locally: let the model take it whole
+        logger.info(f"Audio split skipped: {str(e)}")
+        return transcribe_whole()
+    
+    def transcribe_segment(audio_bytes, segment_mime, start, end):
+        return extract_from_file(
+            api_key, io.BytesIO(audio_bytes), segment_mime, len(audio_bytes), AUDIO_SEGMENT_PROMPT
+        )
+    
+    def on_progress(done, total):
+        if total:
+            logger.info(f"Audio transcription progress: {done}/{total} segments")
+        if progress:
+            progress({'done': done, 'total': total, 'unit': 'segments'})
+    
+    with audio:
+        if audio.duration <= AUDIO_SEGMENT_SECONDS + AUDIO_OVERLAP_SECONDS:
+            return transcribe_whole()
+        text, details = transcribe_audio(
+            audio, transcribe_segment, extraction_executor,
+            segment_seconds=AUDIO_SEGMENT_SECONDS,
+            overlap_seconds=AUDIO_OVERLAP_SECONDS,
+            retries=AUDIO_SEGMENT_RETRIES,
+            on_progress=on_progress
+        )
+    
+    if not text and details['failed_ranges']:
+        raise RuntimeError(details['failed_ranges'][0]['error'])
+    
+    return text, details
+
+
+def run_extraction(kind, api_key, fileobj, mime_type, size, prompt, extractor=None,
+                   options=None, force_refresh=False, progress=None):
+    """Extract text from an upload, serving repeats from the extraction cache.
+
+    ``extractor(api_key, fileobj, mime_type, size, options, progress)`` may
+    replace the default single-call extraction; it returns ``(text, details)``.
+    Returns ``(result, cache_status)``; identical uploads extracted at the
+    same time share one extraction (``COALESCED``).
+    """
+    cache_key = extraction_cache_key(kind, file_sha256(fileobj), mime_type, prompt, options)
+    compute = lambda: compute_extraction(
+        api_key, fileobj, mime_type, size, prompt, extractor, options, progress, cache_key
+    )
+    
+    if force_refresh:
+        return compute(), 'BYPASS'
+    
+    cached = extraction_cache.get(cache_key)
+    if cached is not None:
+        return cached, 'HIT'
+    
+    result, shared = single_flight.do(
+        f'extract-{cache_key}', compute, lookup=lambda: extraction_cache.get(cache_key, count=False)
+    )
+    return result, 'COALESCED' if shared else 'MISS'
+
+
+def compute_extraction(api_key, fileobj, mime_type, size, prompt, extractor, options, progress, cache_key):
+    """Run the extraction and cache a complete result"""
+    if extractor:
+        text, details = extractor(api_key, fileobj, mime_type, size, options or {}, progress)
+    else:
+        text, details = extract_from_file(api_key, fileobj, mime_type, size, prompt), None
+    
+    result = {
+        'success': True,
+        'text': text
+    }
+    if details:
+        result['details'] = details
+    
+    # Partial extractions are not cached so a retry can fill the gaps
+    if text and not (details and details.get('failed_ranges')):
+        extraction_cache.set(cache_key, result)
+    
+    return result
+
+
+def process_response(kind, default_mime, prompt, missing_error, label, error, extractor=None):
+    """Shared request handling for the /api/process/* routes"""
+    fileobj = None
+    try:
+        api_key = request.headers.get('X-API-Key')
         
-        return jsonify({
-            'success': True,
-            'text': response.text
-        })
+        if not api_key:
+            return jsonify({'error': 'مفتاح API مطلوب'}), 400
         
+        fileobj, mime_type, size = read_upload(request, MAX_UPLOAD_BYTES[kind], default_mime)
+        
+        if fileobj is None:
+            return jsonify({'error': missing_error}), 400
+        
+        force_refresh = request.args.get('force_refresh', 'false') == 'true'
+        options = None
+        if kind == 'pdf':
+            options = {'text_layer': request.args.get('text_layer', 'true')}
+        elif kind == 'image':
+            options = {'downscale': request.args.get('downscale', 'true')}
+        elif kind == 'audio':
+            options = {'split': request.args.get('split', 'true')}
+        
+        if wants_job():
+            # The spooled upload now belongs to the job
+            upload, fileobj = fileobj, None
+            
+            def work(progress):
+                try:
+                    result, cache_status = run_extraction(
+                        kind, api_key, upload, mime_type, size, prompt,
+                        extractor, options, force_refresh, progress
+                    )
+                    return dict(result, cache=cache_status)
+                finally:
+                    upload.close()
+            
+            return job_response(f'process:{kind}', api_key, work, release=upload.close)
+        
+        result, cache_status = run_extraction(
+            kind, api_key, fileobj, mime_type, size, prompt,
+            extractor, options, force_refresh
+        )
+        
+        response = jsonify(result)
+        response.headers['X-Cache'] = cache_status
+        return response
+        
+    except (UploadError, UpstreamBusyError) as e:
+        count_error(e)
+        return jsonify({'error': str(e)}), e.status
     except Exception as e:
-        logger.error(f"PDF processing error: {str(e)}")
-        return jsonify({'error': str(e) or 'خطأ في معالجة الملف'}), 500
+        count_error(e)
+        logger.error(f"{label} error: {str(e)}")
+        return jsonify({'error': str(e) or error}), 500
+    finally:
+        if fileobj is not None:
+            fileobj.close()
+
+
+@app.route('/api/process/pdf', methods=['POST'])
+def process_pdf():
+    """Process PDF content using Gemini"""
+    return process_response(
+        'pdf', 'application/pdf', PDF_EXTRACTION_PROMPT,
+        'محتوى الملف مطلوب', 'PDF processing', 'خطأ في معالجة الملف',
+        extractor=extract_pdf_pages
+    )
 
 
 @app.route('/api/process/image', methods=['POST'])
 def process_image():
     """Extract text from image using Gemini Vision"""
+    return process_response(
+        'image', 'image/jpeg', IMAGE_EXTRACTION_PROMPT,
+        'محتوى الصورة مطلوب', 'Image processing', 'خطأ في معالجة الصورة',
+        extractor=extract_image_text
+    )
+
+
+def run_image_batch(api_key, items, options, force_refresh, progress=None):
+    """Extract every readable image on the image pool; one result per item, in order"""
+    def extract(item):
+        try:
+            return run_extraction(
+                'image', api_key, item['fileobj'], item['mime_type'], item['size'], IMAGE_EXTRACTION_PROMPT,
+                extract_image_text, options, force_refresh
+            )
+        finally:
+            item['fileobj'].close()
+    
+    results = [
+        {'index': index, 'name': item['name'], 'success': False, 'error': item.get('error')}
+        for index, item in enumerate(items)
+    ]
+    futures = {
+        image_executor.submit(extract, item): index
+        for index, item in enumerate(items) if 'fileobj' in item
+    }
+    done = len(items) - len(futures)
+    for future in as_completed(futures):
+        index = futures[future]
+        try:
+            result, cache_status = future.result()
+            results[index] = dict(result, index=index, name=items[index]['name'], cache=cache_status)
+        except Exception as e:
+            count_error(e)
+            logger.error(f"Batch image {index} error: {str(e)}")
+            results[index]['error'] = str(e) or 'خطأ في معالجة الصورة'
+        done += 1
+        logger.info(f"Image batch progress: {done}/{len(items)} images")
+        if progress:
+            progress({'done': done, 'total': len(items), 'unit': 'images'})
+    
+    return results
+
+
+@app.route('/api/process/images', methods=['POST'])
+def process_images():
+    """Extract text from many images at once, concurrently"""
+    items = []
     try:
-        data = request.json
         api_key = request.headers.get('X-API-Key')
         
         if not api_key:
             return jsonify({'error': 'مفتاح API مطلوب'}), 400
         
-        base64_content = data.get('content', '')
-        mime_type = data.get('mimeType', 'image/jpeg')
+        items = read_uploads(request, MAX_UPLOAD_BYTES['image'], 'image/jpeg', IMAGE_BATCH_MAX)
         
-        if not base64_content:
+        if not items:
             return jsonify({'error': 'محتوى الصورة مطلوب'}), 400
         
-        model = get_genai_model(api_key)
-        
-        response = model.generate_content([
-            {
-                'mime_type': mime_type,
-                'data': base64_content
-            },
-            'استخرج كل النص الموجود في هذه الصورة بالعربية أو بلغته الأصلية. إذا كانت الصورة تحتوي على رسوم بيانية أو جداول، صفها بوضوح.'
-        ])
+        force_refresh = request.args.get('force_refresh', 'false') == 'true'
+        options = {'downscale': request.args.get('downscale', 'true')}
+        
+        if wants_job():
+            # The spooled uploads now belong to the job
+            uploads, items = items, []
+            
+            def work(progress):
+                results = run_image_batch(api_key, uploads, options, force_refresh, progress)
+                return {'success': any(r['success'] for r in results), 'results': results}
+            
+            def release():
+                for item in uploads:
+                    if 'fileobj' in item:
+                        item['fileobj'].close()
+            
+            return job_response('process:images', api_key, work, release=release)
+        
+        # run_image_batch closes the files it extracts
+        uploads, items = items, []
+        results = run_image_batch(api_key, uploads, options, force_refresh)
+        succeeded = sum(1 for r in results if r['success'])
         
         return jsonify({
-            'success': True,
-            'text': response.text
-        })
+            'success': succeeded > 0,
+            'results': results
+        }), 200 if succeeded else 500
         
+    except (UploadError, UpstreamBusyError) as e:
+        count_error(e)
+        return jsonify({'error': str(e)}), e.status
     except Exception as e:
-        logger.error(f"Image processing error: {str(e)}")
-        return jsonify({'error': str(e) or 'خطأ في معالجة الصورة'}), 500
+        count_error(e)
+        logger.error(f"Image batch error: {str(e)}")
+        return jsonify({'error': str(e) or 'خطأ في معالجة الصور'}), 500
+    finally:
+        for item in items:
+            if 'fileobj' in item:
+                item['fileobj'].close()
 
 
 @app.route('/api/process/audio', methods=['POST'])
 def process_audio():
     """Transcribe audio using Gemini"""
+    return process_response(
+        'audio', 'audio/mpeg', AUDIO_TRANSCRIPTION_PROMPT,
+        'محتوى الصوت مطلوب', 'Audio processing', 'خطأ في معالجة الصوت',
+        extractor=transcribe_audio_segments
+    )
+
+
+@app.route('/api/chat/sessions/<session_id>', methods=['DELETE'])
+def delete_chat_session(session_id):
+    """Forget a chat session's server-side memory"""
+    api_key = request.headers.get('X-API-Key')
+    
+    if not api_key:
+        return jsonify({'error': 'مفتاح API مطلوب'}), 400
+    
+    chat_memory.delete(session_id, key_fingerprint(api_key))
+    return jsonify({'success': True})
+
+
+def cached_representation(body, etag, encoding=None):
+    """Response for a stored representation, revalidated with If-None-Match on every use"""
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.headers['ETag'] = f'W/"{etag}"'
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@app.route('/api/artifacts', methods=['GET'])
+def list_artifacts():
+    """This key's stored artifacts, newest first (``?limit=`` and ``?cursor=`` to page)"""
+    api_key = request.headers.get('X-API-Key')
+    
+    if not api_key:
+        return jsonify({'error': 'مفتاح API مطلوب'}), 400
+    
     try:
-        data = request.json
-        api_key = request.headers.get('X-API-Key')
-        
-        if not api_key:
-            return jsonify({'error': 'مفتاح API مطلوب'}), 400
-        
-        base64_content = data.get('content', '')
-        mime_type = data.get('mimeType', 'audio/mpeg')
-        
-        if not base64_content:
-            return jsonify({'error': 'محتوى الصوت مطلوب'}), 400
-        
-        model = get_genai_model(api_key)
-        
-        response = model.generate_content([
-            {
-                'mime_type': mime_type,
-                'data': base64_content
-            },
-            'انسخ هذا الملف الصوتي إلى نص. إذا كان باللغة العربية، اكتب النص بالعربية. إذا كان بلغة أخرى، اكتب النص بلغته الأصلية ثم ترجمه إلى العربية.'
-        ])
-        
-        return jsonify({
-            'success': True,
-            'text': response.text
-        })
-        
-    except Exception as e:
-        logger.error(f"Audio processing error: {str(e)}")
-        return jsonify({'error': str(e) or 'خطأ في معالجة الصوت'}), 500
+        limit = min(100, max(1, int(request.args.get('limit', '20'))))
+        items, next_cursor = artifact_store.list(key_fingerprint(api_key), limit, request.args.get('cursor'))
+    except ValueError:
+        return jsonify({'error': 'معاملات الصفحة غير صالحة'}), 400
+    
+    body = json.dumps({
+        'success': True,
+        'artifacts': items,
+        'next_cursor': next_cursor
+    }, ensure_ascii=False).encode('utf-8')
+    etag = hashlib.sha256(body).hexdigest()[:32]
+    body, encoding = compress(body, accepted_encodings(request.headers.get('Accept-Encoding')))
+    return cached_representation(body, etag, encoding)
+
+
+@app.route('/api/artifacts/<artifact_id>', methods=['GET'])
+def get_artifact(artifact_id):
+    """A stored artifact; answers 304 when the client's ETag is current"""
+    api_key = request.headers.get('X-API-Key')
+    
+    if not api_key:
+        return jsonify({'error': 'مفتاح API مطلوب'}), 400
+    
+    owner = key_fingerprint(api_key)
+    etag = artifact_store.etag(artifact_id, owner)
+    if etag is None:
+        return jsonify({'error': 'العنصر غير موجود', 'artifact_id': artifact_id}), 404
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        return cached_representation(b'', etag)
+    
+    stored = artifact_store.get(artifact_id, owner, accepted_encodings(request.headers.get('Accept-Encoding')))
+    if stored is None:
+        return jsonify({'error': 'العنصر غير موجود', 'artifact_id': artifact_id}), 404
+    
+    etag, body, encoding = stored
+    return cached_representation(body, etag, encoding)
+
+
+@app.route('/api/artifacts/<artifact_id>', methods=['DELETE'])
+def delete_artifact(artifact_id):
+    """Remove a stored artifact"""
+    api_key = request.headers.get('X-API-Key')
+    
+    if not api_key:
+        return jsonify({'error': 'مفتاح API مطلوب'}), 400
+    
+    if not artifact_store.delete(artifact_id, key_fingerprint(api_key)):
+        return jsonify({'error': 'العنصر غير موجود', 'artifact_id': artifact_id}), 404
+    
+    return jsonify({'success': True, 'artifact_id': artifact_id})
 
 
-def parse_json_response(text):
-    """Parse JSON from AI response"""
-    import json
-    import re
+@app.route('/api/jobs', methods=['GET'])
+def job_stats():
+    """Background queue depth, limits and job counts"""
+    return jsonify(job_queue.stats())
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Status of a background job, with its result once done"""
+    api_key = request.headers.get('X-API-Key')
+    
+    if not api_key:
+        return jsonify({'error': 'مفتاح API مطلوب'}), 400
+    
+    job = job_queue.get(job_id, key_fingerprint(api_key))
+    if job is None:
+        return jsonify({'error': 'المهمة غير موجودة أو انتهت صلاحيتها'}), 404
+    
+    return jsonify(job)
+
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Subscribe to a background job: ``status`` events until ``done`` or ``error``"""
+    api_key = request.headers.get('X-API-Key')
+    
+    if not api_key:
+        return jsonify({'error': 'مفتاح API مطلوب'}), 400
+    
+    owner = key_fingerprint(api_key)
+    job = job_queue.get(job_id, owner)
+    if job is None:
+        return jsonify({'error': 'المهمة غير موجودة أو انتهت صلاحيتها'}), 404
     
+    return sse_response(iter_job_events(job_id, owner, job))
+
+
+# Seconds between a job subscription's checks for changes
+JOB_EVENTS_POLL = 1.0
+
+
+def job_event_stream(job):
+    """SSE for job changes, starting from the job's current state.
+
+    Yields event strings, and None where it needs the job's state after up
+    to JOB_EVENTS_POLL more seconds (sent back in; None once the job is gone).
+    """
+    last = None
+    idle = 0.0
+    while job is not None:
+        state = (job['status'], job['progress'])
+        if job['status'] == 'done':
+            yield sse_event('done', job)
+            return
+        if job['status'] == 'failed':
+            yield sse_event('error', job)
+            return
+        if state != last:
+            yield sse_event('status', job)
+            last = state
+            idle = 0.0
+        elif idle >= 15:
+            # Keep proxies from closing an idle stream
+            yield ': keep-alive\n\n'
+            idle = 0.0
+        job = yield None
+        idle += JOB_EVENTS_POLL
+    yield sse_event('error', {'error': 'المهمة غير موجودة أو انتهت صلاحيتها'})
+
+
+def iter_job_events(job_id, owner, job):
+    """Yield SSE for job changes; the caller passes the job's current state"""
+    events = job_event_stream(job)
     try:
-        # Try to find JSON in the response
-        json_match = re.search(r'\{[\s\S]*\}', text)
-        if json_match:
-            return json.loads(json_match.group())
-    except json.JSONDecodeError as e:
-        logger.error(f"JSON parsing error: {str(e)}")
-    
-    return {}
+        event = next(events)
+        while True:
+            if event is None:
+                event = events.send(job_queue.wait(job_id, owner, JOB_EVENTS_POLL))
+            else:
+                yield event
+                event = next(events)
+    except StopIteration:
+        return
 
 
 # Error handlers
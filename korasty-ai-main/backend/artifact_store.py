@@ -0,0 +1,256 @@
+# Korasty AI - Artifact Store
+# Studio outputs saved server-side under an id, so an artifact can be reopened
+# on any device with a local read instead of a new generation. Each record is
+# kept as its ready-to-send JSON body, gzip-compressed, with a content ETag.
+
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+
+# Reads refresh a record's retention at most this often (avoids a write per read)
+TOUCH_INTERVAL = 3600
+
+# Brotli is encoded inside request handlers, where the maximum quality (11) is
+# far slower for only slightly smaller JSON
+BROTLI_QUALITY = 5
+
+
+def accepted_encodings(header):
+    """Codings from an Accept-Encoding header that we can produce, preferred first"""
+    offered = {}
+    for part in (header or '').split(','):
+        coding, _, params = part.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        offered[coding] = quality
+    available = ('br', 'gzip') if brotli is not None else ('gzip',)
+    return [coding for coding in available if offered.get(coding, offered.get('*', 0)) > 0]
+
+
+def etag_matches(header, etag):
+    """Weak comparison of an If-None-Match header against ``etag`` (unquoted)"""
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    tags = [tag.strip() for tag in header.split(',')]
+    return any(tag.removeprefix('W/').strip('"') == etag for tag in tags)
+
+
+def compress(body, encodings, min_bytes=1024, level=6):
+    """Return ``(body, encoding)``: ``body`` compressed with the first usable coding"""
+    if len(body) < min_bytes or not encodings:
+        return body, None
+    if encodings[0] == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY), 'br'
+    return gzip.compress(body, level, mtime=0), 'gzip'
+
+
+def _isoformat(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+class ArtifactStore:
+    """SQLite store of generated studio artifacts, per owner (API key fingerprint).
+
+    ``save`` returns the artifact id; saving the same data again for the same
+    owner returns the existing id. Records are kept ``ttl`` seconds after they
+    were last read, and at most ``max_per_owner`` per owner (oldest dropped
+    first). Bodies are stored gzip-compressed, so gzip responses are served
+    as stored; a brotli copy is made on first request when the ``brotli``
+    package is installed.
+    """
+
+    def __init__(self, db_path, ttl=90 * 24 * 3600, max_per_owner=500, compress_level=6):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_per_owner = max_per_owner
+        self.compress_level = compress_level
+
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+        self._counters = {'saved': 0, 'deduplicated': 0, 'reads': 0, 'brotli_encoded': 0}
+
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS artifacts ('
+            ' id TEXT PRIMARY KEY,'
+            ' owner TEXT NOT NULL,'
+            ' digest TEXT NOT NULL,'
+            ' type TEXT NOT NULL,'
+            ' title TEXT NOT NULL,'
+            ' etag TEXT NOT NULL,'
+            ' size INTEGER NOT NULL,'
+            ' gzip BLOB NOT NULL,'
+            ' br BLOB,'
+            ' created_at REAL NOT NULL,'
+            ' accessed_at REAL NOT NULL,'
+            ' UNIQUE (owner, digest))'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS artifacts_owner ON artifacts (owner, created_at)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS artifacts_accessed ON artifacts (accessed_at)')
+        self._db.commit()
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def save(self, owner, artifact_type, data, title=''):
+        """Store an artifact and return its id"""
+        payload = json.dumps([artifact_type, data], sort_keys=True, ensure_ascii=False)
+        digest = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+        with self._lock:
+            row = self._db.execute(
+                'SELECT id FROM artifacts WHERE owner = ? AND digest = ?', (owner, digest)
+            ).fetchone()
+        if row is not None:
+            self._count('deduplicated')
+            return row[0]
+
+        # Serialize and compress outside the lock
+        artifact_id = uuid.uuid4().hex
+        now = time.time()
+        body = json.dumps({
+            'success': True,
+            'artifact': {
+                'id': artifact_id,
+                'type': artifact_type,
+                'title': title,
+                'created_at': _isoformat(now),
+                'data': data
+            }
+        }, ensure_ascii=False).encode('utf-8')
+        etag = hashlib.sha256(body).hexdigest()[:32]
+        compressed = gzip.compress(body, self.compress_level, mtime=0)
+
+        with self._lock:
+            self._purge(now)
+            self._db.execute(
+                'INSERT OR IGNORE INTO artifacts '
+                '(id, owner, digest, type, title, etag, size, gzip, br, created_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, NULL, ?, ?)',
+                (artifact_id, owner, digest, artifact_type, title, etag, len(body), compressed, now, now)
+            )
+            # A concurrent save of the same data may have won the insert
+            stored_id = self._db.execute(
+                'SELECT id FROM artifacts WHERE owner = ? AND digest = ?', (owner, digest)
+            ).fetchone()[0]
+            self._db.execute(
+                'DELETE FROM artifacts WHERE id IN ('
+                ' SELECT id FROM artifacts WHERE owner = ? ORDER BY created_at DESC LIMIT -1 OFFSET ?)',
+                (owner, self.max_per_owner)
+            )
+            self._db.commit()
+            self._counters['saved' if stored_id == artifact_id else 'deduplicated'] += 1
+        return stored_id
+
+    def etag(self, artifact_id, owner):
+        """The artifact's ETag (unquoted), or None if unknown"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT etag FROM artifacts WHERE id = ? AND owner = ?', (artifact_id, owner)
+            ).fetchone()
+        return row[0] if row else None
+
+    def get(self, artifact_id, owner, encodings=()):
+        """Return ``(etag, body, encoding)`` with the body in the first of ``encodings``
+        we can serve (``'br'``, ``'gzip'``; None: identity), or None if unknown"""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                'SELECT etag, gzip, br, accessed_at FROM artifacts WHERE id = ? AND owner = ?',
+                (artifact_id, owner)
+            ).fetchone()
+            if row is not None and now - row[3] > TOUCH_INTERVAL:
+                self._db.execute('UPDATE artifacts SET accessed_at = ? WHERE id = ?', (now, artifact_id))
+                self._db.commit()
+        if row is None:
+            return None
+        self._count('reads')
+
+        etag, compressed, encoded_br, _ = row
+        if 'br' in encodings and brotli is not None:
+            if encoded_br is None:
+                encoded_br = brotli.compress(gzip.decompress(compressed), quality=BROTLI_QUALITY)
+                with self._lock:
+                    self._db.execute('UPDATE artifacts SET br = ? WHERE id = ?', (encoded_br, artifact_id))
+                    self._db.commit()
+                self._count('brotli_encoded')
+            return etag, encoded_br, 'br'
+        if 'gzip' in encodings:
+            return etag, compressed, 'gzip'
+        return etag, gzip.decompress(compressed), None
+
+    def list(self, owner, limit=20, cursor=None):
+        """One page of an owner's artifacts, newest first: ``(items, next_cursor)``.
+
+        ``cursor`` is the ``next_cursor`` of the previous page (None: first page).
+        """
+        query = 'SELECT id, type, title, etag, size, created_at FROM artifacts WHERE owner = ?'
+        params = [owner]
+        if cursor:
+            created_at, _, last_id = cursor.partition('_')
+            query += ' AND (created_at < ? OR (created_at = ? AND id < ?))'
+            params += [float(created_at), float(created_at), last_id]
+        query += ' ORDER BY created_at DESC, id DESC LIMIT ?'
+        params.append(limit + 1)
+
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+
+        items = [
+            {'id': row[0], 'type': row[1], 'title': row[2], 'etag': row[3], 'size': row[4],
+             'created_at': _isoformat(row[5])}
+            for row in rows[:limit]
+        ]
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = f'{last[5]!r}_{last[0]}'
+        return items, next_cursor
+
+    def delete(self, artifact_id, owner):
+        with self._lock:
+            deleted = self._db.execute(
+                'DELETE FROM artifacts WHERE id = ? AND owner = ?', (artifact_id, owner)
+            ).rowcount
+            self._db.commit()
+        return deleted > 0
+
+    def _purge(self, now):
+        """Drop artifacts unread for ``ttl`` seconds (at most once a minute)"""
+        if now - self._last_purge < 60:
+            return
+        self._last_purge = now
+        self._db.execute('DELETE FROM artifacts WHERE accessed_at < ?', (now - self.ttl,))
+
+    def stats(self):
+        with self._lock:
+            entries, raw_bytes, stored_bytes = self._db.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0),'
+                ' COALESCE(SUM(LENGTH(gzip) + COALESCE(LENGTH(br), 0)), 0) FROM artifacts'
+            ).fetchone()
+            return dict(self._counters, entries=entries, raw_bytes=raw_bytes, stored_bytes=stored_bytes)
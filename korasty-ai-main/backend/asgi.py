@@ -0,0 +1,665 @@
+# Korasty AI - ASGI Entry Point (asyncio serving mode)
+# Serves the same API as app.py, but chat and studio generations await the
+# Gemini async client instead of blocking a worker thread, so one process can
+# hold hundreds of in-flight generations.
+#
+#   uvicorn asgi:application --host 0.0.0.0 --port 5000
+#
+# The native handlers reuse app.py's request parsing and generation logic:
+# app.py writes its model-calling steps as generators of ModelCall, which run
+# here on the thread pool while only the model calls are awaited. Routes
+# without a native async handler (health, sources, file processing, background
+# job submission, profiled requests and CORS preflights) are delegated to the
+# Flask app on a bounded thread pool, with streamed bodies forwarded as they
+# are produced.
+
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import app as backend
+from app import (
+    ERRORS,
+    HTTP_IN_FLIGHT,
+    HTTP_LATENCY,
+    HTTP_REQUEST_BYTES,
+    HTTP_RESPONSE_BYTES,
+    HTTP_RESPONSES,
+    JOB_EVENTS_POLL,
+    SERVER_TIMING_ENABLED,
+    STUDIO_ARTIFACTS,
+    RequestError,
+    advance_model_calls,
+    artifact_cache_key,
+    artifact_calls,
+    artifact_done_event,
+    artifact_stream_failed,
+    artifact_stream_prompt,
+    batch_payload,
+    batch_results,
+    chat_done_event,
+    chat_payload,
+    chat_stream_failed,
+    chat_turn_calls,
+    finish_streamed_artifact,
+    get_async_genai_model,
+    job_event_stream,
+    job_queue,
+    key_fingerprint,
+    log_request_timing,
+    logger,
+    parse_batch_request,
+    parse_chat_request,
+    parse_studio_request,
+    prepare_chat_turn,
+    profile_requested,
+    remember_chat_turn,
+    result_cache,
+    single_flight,
+    sse_event,
+    studio_payload,
+)
+from request_timing import start_timer, stop_timer, timed_stage
+from upstream import UpstreamBusyError
+
+
+# Upper bound on concurrent upstream generations; extra requests wait for a
+# slot (up to ASYNC_QUEUE_TIMEOUT seconds) instead of growing memory unbounded
+ASYNC_MAX_INFLIGHT = int(os.environ.get('KORASTY_ASYNC_MAX_INFLIGHT', '512'))
+ASYNC_QUEUE_TIMEOUT = float(os.environ.get('KORASTY_ASYNC_QUEUE_TIMEOUT', '30'))
+# Large enough for a base64-encoded 100 MB audio upload; bodies are spooled to
+# a temp file past 1 MB so they do not sit in memory
+MAX_BODY_BYTES = int(os.environ.get('KORASTY_MAX_BODY_MB', '140')) * 1024 * 1024
+
+# Threads used for routes delegated to the WSGI app and for the blocking steps
+# of native handlers
+wsgi_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('KORASTY_ASGI_WSGI_THREADS', '16')),
+    thread_name_prefix='wsgi'
+)
+
+# Body chunks of a delegated response buffered ahead of the client
+WSGI_STREAM_BUFFER = 8
+
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-expose-headers', b'X-Cache, Server-Timing, X-Profile-Id'),
+]
+
+_upstream_slots = None
+
+
+class _RequestMetrics:
+    """Wraps ``send`` to record HTTP metrics and stage timings for natively handled routes.
+
+    Delegated routes (including every profiled request, since a profiler on
+    the event loop would capture all concurrent requests) are measured by the
+    Flask app's own request hooks.
+    """
+
+    def __init__(self, send, route, method, body_size):
+        self.send = send
+        self.route = route
+        self.method = method
+        self.started = time.perf_counter()
+        self.body_bytes = 0
+        self.streamed = False
+        self.done = False
+        self.status = 500
+        HTTP_IN_FLIGHT.inc(route=route)
+        if body_size:
+            HTTP_REQUEST_BYTES.observe(body_size, route=route)
+        self.timer = start_timer() if SERVER_TIMING_ENABLED else None
+
+    async def __call__(self, message):
+        if message['type'] == 'http.response.start':
+            self.status = message['status']
+            HTTP_RESPONSES.inc(route=self.route, method=self.method, status=message['status'])
+            # Streams are timed up to their headers
+            if self.timer is not None:
+                message = dict(message, headers=[
+                    *message.get('headers', []), (b'server-timing', self.timer.server_timing().encode())
+                ])
+        elif message['type'] == 'http.response.body':
+            self.body_bytes += len(message.get('body', b''))
+            self.streamed = self.streamed or message.get('more_body', False)
+        await self.send(message)
+
+    def finish(self, record=True):
+        if self.done:
+            return
+        self.done = True
+        HTTP_IN_FLIGHT.dec(route=self.route)
+        if self.timer is not None:
+            stop_timer()
+            if record:
+                log_request_timing(self.route, self.method, self.status, self.timer)
+        if record:
+            HTTP_LATENCY.observe(time.perf_counter() - self.started, route=self.route, method=self.method)
+            if not self.streamed:
+                HTTP_RESPONSE_BYTES.observe(self.body_bytes, route=self.route)
+
+
+def count_error(route, error):
+    """Count an exception a handler turned into an error response (as app.count_error)"""
+    ERRORS.inc(route=route, type=type(error).__name__)
+
+
+async def run_blocking(func, *args):
+    """Run a blocking call (source store, SQLite caches, artifact store) off the event loop.
+
+    The call keeps the request's context, so its stage timings are recorded.
+    """
+    call = functools.partial(contextvars.copy_context().run, func, *args)
+    return await asyncio.get_running_loop().run_in_executor(wsgi_executor, call)
+
+
+def upstream_slots():
+    """Semaphore bounding in-flight generations (created on the running loop)"""
+    global _upstream_slots
+    if _upstream_slots is None:
+        _upstream_slots = asyncio.Semaphore(ASYNC_MAX_INFLIGHT)
+    return _upstream_slots
+
+
+class _UpstreamSlot:
+    async def __aenter__(self):
+        try:
+            await asyncio.wait_for(upstream_slots().acquire(), ASYNC_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise RequestError({'error': 'الخادم مشغول حالياً، حاول مرة أخرى بعد قليل'}, 503)
+
+    async def __aexit__(self, *exc):
+        upstream_slots().release()
+
+
+async def run_model_calls_async(api_key, calls):
+    """Async counterpart of app.run_model_calls.
+
+    The generator's own steps (preprocessing, prompt and cached-context
+    building, parsing, cache writes) run on the thread pool; only the model
+    calls are awaited on the event loop.
+    """
+    response = error = None
+    while True:
+        done, value = await run_blocking(advance_model_calls, calls, response, error)
+        if done:
+            return value
+        response = error = None
+        try:
+            async with _UpstreamSlot():
+                response = await value.run_async(api_key)
+        except RequestError:
+            raise
+        except Exception as e:
+            error = e
+
+
+async def read_body(receive):
+    """Spool the request body; returns ``(fileobj, size)``"""
+    body_file = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    size = 0
+    while True:
+        message = await receive()
+        body = message.get('body', b'')
+        size += len(body)
+        if size > MAX_BODY_BYTES:
+            body_file.close()
+            raise RequestError({'error': 'حجم الطلب أكبر من المسموح'}, 413)
+        body_file.write(body)
+        if not message.get('more_body'):
+            body_file.seek(0)
+            return body_file, size
+
+
+async def send_json(send, payload, status=200, headers=()):
+    with timed_stage('serialize'):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+            *CORS_HEADERS,
+            *headers,
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_sse(send, events):
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+            *CORS_HEADERS,
+        ],
+    })
+    async for event in events:
+        await send({'type': 'http.response.body', 'body': event.encode('utf-8'), 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+def wants_stream(data, headers):
+    return bool(data.get('stream')) or 'text/event-stream' in headers.get('accept', '')
+
+
+async def iter_response_text(chunks):
+    async for chunk in chunks:
+        try:
+            text = chunk.text
+        except ValueError:
+            continue
+        if text:
+            yield text
+
+
+# ---------------------------------------------------------------------------
+# Native async handlers
+# ---------------------------------------------------------------------------
+
+async def generate_artifact_async(artifact_type, api_key, content, options, force_refresh=False):
+    """Async counterpart of app.generate_artifact"""
+    cache_key = artifact_cache_key(artifact_type, content, options)
+
+    def compute():
+        return run_model_calls_async(api_key, artifact_calls(artifact_type, api_key, content, options, cache_key))
+
+    if force_refresh:
+        return await compute(), 'BYPASS'
+
+    cached = await run_blocking(result_cache.get, cache_key)
+    if cached is not None:
+        return cached, 'HIT'
+
+    data, shared = await single_flight.do_async(
+        cache_key,
+        compute,
+        lookup=lambda: run_blocking(result_cache.get, cache_key, False)
+    )
+    return data, 'COALESCED' if shared else 'MISS'
+
+
+async def stream_artifact_async(artifact_type, api_key, content, options, force_refresh=False, save=True):
+    """Async counterpart of app.stream_artifact"""
+    spec = STUDIO_ARTIFACTS[artifact_type]
+    cache_key = artifact_cache_key(artifact_type, content, options)
+    started = time.perf_counter()
+
+    cached_content = None
+    try:
+        if not force_refresh:
+            cached = await run_blocking(result_cache.get, cache_key)
+            if cached is not None:
+                yield sse_event('delta', {'text': cached[spec['stream_field']]})
+                yield await run_blocking(artifact_done_event, artifact_type, api_key, cached, 'HIT', save, started, 0)
+                return
+
+        cached_content, prompt = await run_blocking(artifact_stream_prompt, artifact_type, api_key, content, options)
+        model = get_async_genai_model(api_key, cached_content)
+        parts = []
+        first_token_ms = None
+        async with _UpstreamSlot():
+            chunks = await model.generate_content_async(prompt, stream=True)
+            async for text in iter_response_text(chunks):
+                if first_token_ms is None:
+                    first_token_ms = round((time.perf_counter() - started) * 1000)
+                parts.append(text)
+                yield sse_event('delta', {'text': text})
+
+        result = await run_blocking(finish_streamed_artifact, artifact_type, ''.join(parts), cache_key)
+        yield await run_blocking(
+            artifact_done_event, artifact_type, api_key, result,
+            'BYPASS' if force_refresh else 'MISS', save, started, first_token_ms
+        )
+
+    except Exception as e:
+        count_error(f'/api/studio/{artifact_type}', e)
+        yield await run_blocking(artifact_stream_failed, artifact_type, e, cached_content)
+
+
+async def handle_studio(send, artifact_type, data, headers):
+    spec = STUDIO_ARTIFACTS[artifact_type]
+    api_key = headers.get('x-api-key')
+    # Sources may be read back from disk and preprocessed
+    content, options, force_refresh, save = await run_blocking(parse_studio_request, data, api_key)
+
+    if 'stream_field' in spec and wants_stream(data, headers):
+        return await send_sse(send, stream_artifact_async(
+            artifact_type, api_key, content, options, force_refresh, save
+        ))
+
+    try:
+        result, cache_status = await generate_artifact_async(
+            artifact_type, api_key, content, options, force_refresh
+        )
+    except RequestError:
+        raise
+    except UpstreamBusyError as e:
+        count_error(f'/api/studio/{artifact_type}', e)
+        raise RequestError({'error': str(e)}, e.status)
+    except Exception as e:
+        count_error(f'/api/studio/{artifact_type}', e)
+        logger.error(f"{spec['label']} error: {str(e)}")
+        raise RequestError({'error': str(e) or spec['error']}, 500)
+
+    await send_json(
+        send,
+        await run_blocking(studio_payload, api_key, artifact_type, result, save),
+        headers=[(b'x-cache', cache_status.encode())]
+    )
+
+
+async def handle_batch(send, data, headers):
+    api_key = headers.get('x-api-key')
+    content, requested, force_refresh, save = await run_blocking(parse_batch_request, data, api_key)
+
+    outcomes = await asyncio.gather(*[
+        generate_artifact_async(artifact_type, api_key, content, options, force_refresh)
+        for artifact_type, options in requested
+    ], return_exceptions=True)
+    for outcome in outcomes:
+        if isinstance(outcome, Exception):
+            count_error('/api/studio/batch', outcome)
+
+    results = await run_blocking(batch_results, api_key, requested, outcomes, save)
+    body, status = batch_payload(results)
+    await send_json(send, body, status)
+
+
+async def stream_chat_async(chat_session, prompt, session_id=None, on_complete=None, cached_content=None):
+    """Async counterpart of app.stream_chat"""
+    started = time.perf_counter()
+    first_token_ms = None
+    try:
+        parts = []
+        async with _UpstreamSlot():
+            chunks = await chat_session.send_message_async(prompt, stream=True)
+            async for text in iter_response_text(chunks):
+                if first_token_ms is None:
+                    first_token_ms = round((time.perf_counter() - started) * 1000)
+                parts.append(text)
+                yield sse_event('delta', {'text': text})
+
+        if on_complete:
+            await on_complete(''.join(parts))
+
+        yield chat_done_event(session_id, started, first_token_ms)
+    except Exception as e:
+        count_error('/api/chat', e)
+        yield await run_blocking(chat_stream_failed, e, cached_content)
+
+
+async def handle_chat(send, data, headers):
+    api_key = headers.get('x-api-key')
+    message, sources = await run_blocking(parse_chat_request, data, api_key)
+
+    # Indexing a large new source and the session lookup block; keep them off the event loop
+    turn = await run_blocking(prepare_chat_turn, api_key, data, message, sources)
+
+    if wants_stream(data, headers):
+        session_id, cached_content, chat_history, prompt = turn
+
+        async def remember(reply):
+            await run_blocking(remember_chat_turn, api_key, data, session_id, message, reply)
+
+        chat = get_async_genai_model(api_key, cached_content).start_chat(history=chat_history)
+        return await send_sse(send, stream_chat_async(chat, prompt, session_id, remember, cached_content))
+
+    try:
+        reply = await run_model_calls_async(api_key, chat_turn_calls(api_key, data, message, sources, turn))
+    except RequestError:
+        raise
+    except UpstreamBusyError as e:
+        count_error('/api/chat', e)
+        raise RequestError({'error': str(e)}, e.status)
+    except Exception as e:
+        count_error('/api/chat', e)
+        logger.error(f"Chat error: {str(e)}")
+        raise RequestError({
+            'error': str(e) or 'خطأ في المحادثة',
+            'suggestion': 'تأكد من صحة مفتاح API وحاول مرة أخرى'
+        }, 500)
+
+    await send_json(send, chat_payload(turn[0], reply))
+
+
+async def handle_job_events(send, job_id, headers):
+    """Async counterpart of app.job_events; polls the job queue off the loop"""
+    api_key = headers.get('x-api-key')
+    if not api_key:
+        raise RequestError({'error': 'مفتاح API مطلوب'})
+
+    owner = key_fingerprint(api_key)
+    job = await run_blocking(job_queue.get, job_id, owner)
+    if job is None:
+        raise RequestError({'error': 'المهمة غير موجودة أو انتهت صلاحيتها'}, 404)
+
+    async def events():
+        stream = job_event_stream(job)
+        try:
+            event = next(stream)
+            while True:
+                if event is None:
+                    # Poll rather than park a thread per subscriber in job_queue.wait()
+                    await asyncio.sleep(JOB_EVENTS_POLL)
+                    event = stream.send(await run_blocking(job_queue.get, job_id, owner))
+                else:
+                    yield event
+                    event = next(stream)
+        except StopIteration:
+            return
+
+    await send_sse(send, events())
+
+
+# ---------------------------------------------------------------------------
+# WSGI delegation for everything else
+# ---------------------------------------------------------------------------
+
+def wsgi_environ(scope, body_file, body_size):
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': (scope.get('server') or ('localhost', 80))[0],
+        'SERVER_PORT': str((scope.get('server') or ('localhost', 80))[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'CONTENT_LENGTH': str(body_size),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body_file,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        key = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if key == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif key != 'CONTENT_LENGTH':
+            environ[f'HTTP_{key}'] = value
+    return environ
+
+
+class _ClientGone(Exception):
+    pass
+
+
+async def delegate_to_wsgi(scope, send, body_file, body_size):
+    """Run the Flask app for one request on the thread pool, forwarding its body as it is produced.
+
+    The worker thread hands the response start and each body chunk to the
+    event loop through a small bounded queue, so SSE from delegated routes
+    (job events, process routes) streams and large bodies are not buffered
+    whole.
+    """
+    loop = asyncio.get_running_loop()
+    messages = asyncio.Queue(maxsize=WSGI_STREAM_BUFFER)
+    abandoned = threading.Event()
+
+    def put(message):
+        if abandoned.is_set():
+            raise _ClientGone()
+        asyncio.run_coroutine_threadsafe(messages.put(message), loop).result()
+
+    def start_response(status, headers, exc_info=None):
+        put({
+            'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers],
+        })
+
+    def run():
+        # Ends with None, or the exception that stopped the app
+        try:
+            result = backend.app(wsgi_environ(scope, body_file, body_size), start_response)
+            try:
+                for chunk in result:
+                    if chunk:
+                        put({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        except _ClientGone:
+            return
+        except Exception as e:
+            put(e)
+            return
+        put(None)
+
+    worker = loop.run_in_executor(wsgi_executor, run)
+    started = False
+    try:
+        while True:
+            message = await messages.get()
+            if isinstance(message, Exception):
+                if not started:
+                    raise message
+                # The headers are already out; end the body where the app stopped
+                logger.error(f"Delegated response error: {str(message)}")
+                message = None
+            if message is None:
+                await send({'type': 'http.response.body', 'body': b''})
+                break
+            started = started or message['type'] == 'http.response.start'
+            await send(message)
+    finally:
+        if not worker.done():
+            # The client may have gone: unblock the worker so it can close the response
+            abandoned.set()
+            while not worker.done():
+                while not messages.empty():
+                    messages.get_nowait()
+                await asyncio.wait([worker], timeout=0.05)
+
+
+# ---------------------------------------------------------------------------
+# ASGI application
+# ---------------------------------------------------------------------------
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    if scope['type'] != 'http':
+        return
+
+    method = scope['method']
+    path = scope['path']
+
+    response_started = False
+    client_send = send
+
+    async def send(message):
+        nonlocal response_started
+        response_started = response_started or message['type'] == 'http.response.start'
+        await client_send(message)
+
+    body_file = None
+    observed = None
+    try:
+        body_file, body_size = await read_body(receive)
+
+        headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope.get('headers', [])}
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+
+        # A profile of the event loop thread would mix in every concurrent
+        # request, so profiled requests run alone on a Flask worker thread
+        if profile_requested(headers.get('x-debug-profile')):
+            return await delegate_to_wsgi(scope, send, body_file, body_size)
+
+        if method == 'GET' and path.startswith('/api/jobs/') and path.endswith('/events'):
+            send = observed = _RequestMetrics(send, '/api/jobs/<job_id>/events', method, body_size)
+            return await handle_job_events(send, path[len('/api/jobs/'):-len('/events')], headers)
+
+        native = method == 'POST' and (path == '/api/chat' or path.startswith('/api/studio/'))
+        if not native or query.get('async') == ['true']:
+            return await delegate_to_wsgi(scope, send, body_file, body_size)
+
+        unwrapped_send = send
+        send = observed = _RequestMetrics(send, path, method, body_size)
+
+        try:
+            with timed_stage('json'):
+                data = json.loads(body_file.read() or b'{}')
+        except ValueError:
+            raise RequestError({'error': 'جسم الطلب ليس JSON صالحاً'})
+
+        if data.get('async') and path != '/api/chat':
+            # Job submission is quick; the job itself runs on the app's job pool
+            observed.finish(record=False)
+            body_file.seek(0)
+            return await delegate_to_wsgi(scope, unwrapped_send, body_file, body_size)
+
+        if path == '/api/chat':
+            return await handle_chat(send, data, headers)
+        if path == '/api/studio/batch':
+            return await handle_batch(send, data, headers)
+
+        artifact_type = path[len('/api/studio/'):]
+        if artifact_type in STUDIO_ARTIFACTS:
+            return await handle_studio(send, artifact_type, data, headers)
+
+        # Unknown studio path (or a route added to app.py only): let Flask answer
+        observed.finish(record=False)
+        body_file.seek(0)
+        return await delegate_to_wsgi(scope, unwrapped_send, body_file, body_size)
+
+    except RequestError as e:
+        await send_json(send, e.payload, e.status)
+    except Exception as e:
+        if response_started:
+            # Usually the client went away mid-body; a second response can't be sent
+            logger.warning(f"ASGI response aborted: {str(e)}")
+            return
+        ERRORS.inc(route=observed.route if observed else path, type=type(e).__name__)
+        logger.error(f"ASGI error: {str(e)}")
+        await send_json(send, {'error': 'خطأ في الخادم'}, 500)
+    finally:
+        if observed is not None:
+            observed.finish()
+        if body_file is not None:
+            body_file.close()
@@ -0,0 +1,245 @@
+# Korasty AI - Audio Transcription
+# Splits long recordings locally into fixed-length segments with a small
+# overlap, transcribes them concurrently, and stitches the transcripts back in
+# order with the text repeated in each overlap removed. Any format is cut with
+# ffmpeg when it is installed; without it, PCM WAV is cut with the stdlib.
+
+import io
+import logging
+import math
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import unicodedata
+import wave
+from concurrent.futures import as_completed
+
+from upstream import with_retries
+
+
+logger = logging.getLogger(__name__)
+
+# The repeated passage must end the previous transcript and start the next
+# one: it is at most as many words as the overlap can hold (fast speech rate),
+# at least MIN_OVERLAP_WORDS long, and may skip up to EDGE_SLACK_WORDS words
+# clipped at either cut. Without such a match both transcripts are kept whole
+MAX_WORDS_PER_SECOND = 4
+MIN_OVERLAP_WORDS = 3
+EDGE_SLACK_WORDS = 2
+
+# Segments cut with ffmpeg are re-encoded small: speech-grade mono MP3
+FFMPEG_OUTPUT_ARGS = ['-vn', '-ac', '1', '-ar', '16000', '-b:a', '32k', '-f', 'mp3']
+
+
+def ffmpeg_available():
+    return shutil.which('ffmpeg') is not None and shutil.which('ffprobe') is not None
+
+
+def _is_wav(fileobj):
+    fileobj.seek(0)
+    header = fileobj.read(12)
+    fileobj.seek(0)
+    return header[:4] == b'RIFF' and header[8:12] == b'WAVE'
+
+
+class AudioSplitter:
+    """Cuts time ranges out of an uploaded recording; close it when done.
+
+    Raises ``ValueError`` if the recording cannot be split here (no ffmpeg
+    and not PCM WAV, or unreadable).
+    """
+
+    def __init__(self, fileobj, mime_type):
+        self.fileobj = fileobj
+        self.mime_type = mime_type
+        self._lock = threading.Lock()
+        self._path = None
+        self._wav = None
+
+        if ffmpeg_available():
+            self._open_ffmpeg()
+        elif _is_wav(fileobj):
+            self._open_wav()
+        else:
+            raise ValueError('Splitting this format needs ffmpeg')
+
+    def _open_ffmpeg(self):
+        # ffmpeg seeks in the input, so it needs a real file
+        with tempfile.NamedTemporaryFile(prefix='korasty-audio-', delete=False) as copy:
+            self._path = copy.name
+            self.fileobj.seek(0)
+            shutil.copyfileobj(self.fileobj, copy, 1024 * 1024)
+        try:
+            probe = subprocess.run(
+                ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', self._path],
+                capture_output=True, text=True, timeout=60
+            )
+            self.duration = float(probe.stdout.strip())
+        except (ValueError, subprocess.SubprocessError) as e:
+            self.close()
+            raise ValueError(f'Unreadable audio: {e}')
+
+    def _open_wav(self):
+        self.fileobj.seek(0)
+        try:
+            self._wav = wave.open(self.fileobj, 'rb')
+        except (wave.Error, EOFError) as e:
+            raise ValueError(f'Unreadable WAV: {e}')
+        self.duration = self._wav.getnframes() / self._wav.getframerate()
+
+    def segment(self, start, end):
+        """Return ``(audio_bytes, mime_type)`` for ``[start, end)`` seconds"""
+        if self._path:
+            result = subprocess.run(
+                ['ffmpeg', '-v', 'error', '-ss', f'{start:.3f}', '-t', f'{end - start:.3f}',
+                 '-i', self._path] + FFMPEG_OUTPUT_ARGS + ['pipe:1'],
+                capture_output=True, timeout=600
+            )
+            if result.returncode != 0 or not result.stdout:
+                raise RuntimeError(f'ffmpeg failed: {result.stderr.decode("utf-8", "replace")[-200:]}')
+            return result.stdout, 'audio/mp3'
+
+        rate = self._wav.getframerate()
+        # The wave reader shares the upload's file object
+        with self._lock:
+            self._wav.setpos(int(start * rate))
+            frames = self._wav.readframes(int((end - start) * rate))
+            params = self._wav.getparams()
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as out:
+            out.setparams(params)
+            out.writeframes(frames)
+        return buffer.getvalue(), 'audio/wav'
+
+    def close(self):
+        if self._path:
+            os.unlink(self._path)
+            self._path = None
+        if self._wav:
+            self._wav.close()
+            self._wav = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def plan_segments(duration, segment_seconds, overlap_seconds):
+    """``(start, end)`` ranges of ``segment_seconds`` plus ``overlap_seconds`` into
+    the next; a short tail is folded into the last segment"""
+    segments = []
+    start = 0.0
+    while start < duration:
+        end = start + segment_seconds + overlap_seconds
+        if duration - end < segment_seconds / 4:
+            end = duration
+        segments.append((start, min(end, duration)))
+        start += segment_seconds
+        if end >= duration:
+            break
+    return segments
+
+
+def _normalize_word(word):
+    # Compare words without diacritics, tatweel or punctuation
+    word = unicodedata.normalize('NFKC', word).replace('ـ', '')
+    return ''.join(ch for ch in word if unicodedata.category(ch)[0] in 'LN').lower()
+
+
+def merge_overlap(previous, current, overlap_seconds, min_words=MIN_OVERLAP_WORDS, slack=EDGE_SLACK_WORDS):
+    """Join two consecutive transcripts, dropping the passage both contain.
+
+    The overlap is the longest run of words that is a suffix of ``previous``
+    and a prefix of ``current`` (give or take ``slack`` clipped words at
+    either cut), no longer than ``overlap_seconds`` of speech. With no such
+    run the transcripts are concatenated: repeating a few words is better
+    than losing text to a phrase that merely recurs in the lecture.
+    """
+    if not previous:
+        return current
+    if not current:
+        return previous
+
+    max_words = math.ceil(overlap_seconds * MAX_WORDS_PER_SECOND)
+    tail = list(re.finditer(r'\S+', previous))[-(max_words + slack):]
+    head = list(re.finditer(r'\S+', current))[:max_words + slack]
+    tail_words = [_normalize_word(m.group()) for m in tail]
+    head_words = [_normalize_word(m.group()) for m in head]
+
+    best = None
+    for size in range(min(max_words, len(tail), len(head)), min_words - 1, -1):
+        for tail_skip in range(min(slack, len(tail) - size) + 1):
+            end = len(tail) - tail_skip
+            for head_skip in range(min(slack, len(head) - size) + 1):
+                if tail_words[end - size:end] == head_words[head_skip:head_skip + size]:
+                    best = (end, head_skip + size)
+                    break
+            if best:
+                break
+        if best:
+            break
+    if best is None:
+        return f'{previous}\n\n{current}'
+
+    previous_end, current_start = tail[best[0] - 1].end(), head[best[1] - 1].end()
+    return previous[:previous_end] + current[current_start:]
+
+
+def transcribe_audio(audio, transcribe_segment, executor, segment_seconds=300, overlap_seconds=5,
+                     retries=2, backoff=1.0, on_progress=None):
+    """Transcribe an AudioSplitter's recording segment by segment.
+
+    ``transcribe_segment(audio_bytes, mime_type, start, end)`` performs the
+    model call for one segment and returns its text. Segments run on
+    ``executor`` and are retried individually; ``on_progress(done, total)``
+    is called as each one finishes. Returns ``(text, details)`` where
+    ``details`` reports the duration, the segments and any that failed.
+    """
+    segments = plan_segments(audio.duration, segment_seconds, overlap_seconds)
+    total = len(segments)
+    done = 0
+    transcripts = {}
+    failed = []
+
+    if on_progress:
+        on_progress(0, total)
+
+    def run(start, end):
+        data, mime_type = audio.segment(start, end)
+        return with_retries(lambda: transcribe_segment(data, mime_type, start, end), retries, backoff)
+
+    futures = {executor.submit(run, start, end): (start, end) for start, end in segments}
+    for future in as_completed(futures):
+        start, end = futures[future]
+        try:
+            transcripts[start] = future.result().strip()
+        except Exception as e:
+            logger.error(f"Audio {start:.0f}-{end:.0f}s transcription error: {str(e)}")
+            failed.append({'seconds': [round(start, 1), round(end, 1)], 'error': str(e)})
+        done += 1
+        if on_progress:
+            on_progress(done, total)
+
+    text = ''
+    previous_start = None
+    for start, _ in segments:
+        if start not in transcripts:
+            previous_start = None
+            continue
+        if previous_start is None:
+            # First segment, or the one before it failed: nothing to de-duplicate
+            text = f'{text}\n\n{transcripts[start]}' if text else transcripts[start]
+        else:
+            text = merge_overlap(text, transcripts[start], overlap_seconds)
+        previous_start = start
+
+    return text, {
+        'duration': round(audio.duration, 1),
+        'segments': [[round(start, 1), round(end, 1)] for start, end in segments],
+        'failed_ranges': sorted(failed, key=lambda item: item['seconds'])
+    }
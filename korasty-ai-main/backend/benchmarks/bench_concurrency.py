@@ -0,0 +1,148 @@
+# Korasty AI - Concurrency benchmark: WSGI (threads) vs ASGI (asyncio)
+# Drives /api/studio/report with a simulated upstream latency and compares
+# throughput and latency between the thread-per-request Flask path (sized
+# like a gunicorn deployment) and the asyncio serving mode in asgi.py.
+#
+# Usage (from the backend directory):
+#   python benchmarks/bench_concurrency.py --requests 400 --concurrency 200 --latency 1.0
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('KORASTY_DATA_DIR', tempfile.mkdtemp(prefix='korasty-bench-'))
+
+import app as backend  # noqa: E402
+import asgi  # noqa: E402
+
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModel:
+    """Stands in for Gemini: waits ``latency`` seconds, then answers"""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def generate_content(self, prompt, **kwargs):
+        time.sleep(self.latency)
+        return _FakeResponse('# تقرير\n\nنص التقرير.')
+
+    async def generate_content_async(self, prompt, **kwargs):
+        await asyncio.sleep(self.latency)
+        return _FakeResponse('# تقرير\n\nنص التقرير.')
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def payload(mode, i):
+    # Unique content per request so the result cache never answers
+    return {'content': f'محتوى الدرس رقم {i} ({mode}) ' * 50, 'options': {'length': 'short'}}
+
+
+def run_wsgi(args):
+    """Concurrent clients against a server with ``wsgi_threads`` worker slots"""
+    client = backend.app.test_client()
+    worker_slots = threading.Semaphore(args.wsgi_threads)
+    latencies = []
+
+    def one(i):
+        start = time.perf_counter()
+        with worker_slots:
+            response = client.post('/api/studio/report', json=payload('wsgi', i),
+                                   headers={'X-API-Key': 'bench'})
+        assert response.status_code == 200, response.get_data(as_text=True)
+        latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as clients:
+        list(clients.map(one, range(args.requests)))
+    return time.perf_counter() - started, latencies
+
+
+async def asgi_request(i):
+    body = json.dumps(payload('asgi', i)).encode('utf-8')
+    scope = {
+        'type': 'http',
+        'method': 'POST',
+        'path': '/api/studio/report',
+        'headers': [(b'content-type', b'application/json'), (b'x-api-key', b'bench')],
+    }
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        sent.append(message)
+
+    await asgi.application(scope, receive, send)
+    assert sent[0]['status'] == 200, sent
+
+
+async def run_asgi(args):
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            await asgi_request(i)
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(args.requests)])
+    return time.perf_counter() - started, latencies
+
+
+def report(name, elapsed, latencies, requests):
+    print(f'{name:<28} {requests / elapsed:8.1f} req/s   '
+          f'p50 {statistics.median(latencies):6.2f}s   '
+          f'p95 {percentile(latencies, 95):6.2f}s   '
+          f'p99 {percentile(latencies, 99):6.2f}s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='WSGI vs ASGI concurrency benchmark')
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=200, help='Concurrent clients')
+    parser.add_argument('--latency', type=float, default=1.0, help='Simulated upstream seconds')
+    parser.add_argument('--wsgi-threads', type=int, default=8,
+                        help='Worker threads for the WSGI path (gunicorn workers x threads)')
+    args = parser.parse_args()
+
+    fake = FakeModel(args.latency)
+    # Both serving modes build their models through these (see app.ModelCall)
+    backend.get_genai_model = lambda api_key, cached_content=None: fake
+    backend.get_async_genai_model = lambda api_key, cached_content=None: fake
+
+    print(f'{args.requests} requests, {args.concurrency} concurrent clients, '
+          f'{args.latency:.2f}s simulated upstream latency')
+
+    elapsed, latencies = run_wsgi(args)
+    report(f'WSGI ({args.wsgi_threads} threads)', elapsed, latencies, args.requests)
+
+    elapsed, latencies = asyncio.run(run_asgi(args))
+    report('ASGI (asyncio)', elapsed, latencies, args.requests)
+
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f'peak RSS: {peak_kb / 1024:.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
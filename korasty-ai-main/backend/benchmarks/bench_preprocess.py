@@ -0,0 +1,95 @@
+# Korasty AI - Preprocessing benchmark
+# Measures the compression ratio and time of source preprocessing on a
+# paginated corpus, and checks that content which only looks like boilerplate
+# (number tables, exponents, fractions, formulas, repeated headings and short
+# answers) survives. Exits non-zero
+# when a check fails.
+#
+# Usage (from the backend directory):
+#   python benchmarks/bench_preprocess.py --pages 200
+#   python benchmarks/bench_preprocess.py --corpus book.txt
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from preprocess import preprocess_text  # noqa: E402
+
+
+WORDS = [
+    'الطاقة', 'الحركية', 'تعتمد', 'على', 'الكتلة', 'والسرعة', 'وتقاس', 'بوحدة', 'الجول',
+    'في', 'النظام', 'الدولي', 'ويمكن', 'حسابها', 'بالقانون', 'الشغل', 'القوة', 'المسافة'
+]
+
+# (name, text, substrings that must survive preprocessing)
+CHECKS = [
+    ('number table', 'السنة والقيمة\n2019\n120\n2020\n135\n2021\n150\n', ['2019', '120', '2020', '135', '2021', '150']),
+    ('exponents', 'مساحة الدائرة = ط نق²\nالتسارع 10⁻³ م/ث²', ['نق²', '10⁻³', 'ث²']),
+    ('fractions', 'نصف الكمية ½ وربعها ¼', ['½', '¼']),
+    ('formulas', 'يتكون الماء H₂O من الهيدروجين والأكسجين', ['H₂O']),
+    ('presentation forms', 'ﺍﻟﻄﺎﻗﺔ ﻻ ﺗﻔﻨﻰ', ['الطاقة لا تفنى']),
+    ('exercise headings', ''.join(
+        f'التمرين {n}: أكمل الفراغات التالية\nالطاقة لا تفنى ولا ...\nالقوة تساوي الكتلة في ...\n\n' for n in (1, 2, 3)
+    ) + '\f' + 'نهاية الوحدة', [f'التمرين {n}:' for n in (1, 2, 3)]),
+    ('steps', 'Step 1: Multiply both sides by x\nStep 2: Multiply both sides by x\nStep 3: Multiply both sides by x',
+     ['Step 1', 'Step 2', 'Step 3']),
+    ('short answers', '1) الأرض كروية\n\nصح\n\n2) الماء يغلي عند 100\n\nصح\n\n3) الشمس كوكب\n\nخطأ\n\nصح',
+     ['صح\n\n2)', 'صح\n\n3)', 'خطأ\n\nصح']),
+]
+
+
+def synthetic_corpus(pages, seed=7):
+    """Pages with a repeated header, tatweel, a page-number footer and a repeated paragraph"""
+    rng = random.Random(seed)
+    repeated = ' '.join(rng.choice(WORDS) for _ in range(40))
+    out = []
+    for page in range(1, pages + 1):
+        lines = ['جامعة القاهرة - كلية العلوم - قسم الفيزياء', '']
+        for _ in range(4):
+            lines.append(' '.join(rng.choice(WORDS) for _ in range(40)).replace('الطاقة', 'الطـــاقة'))
+            lines.append('')
+        if page % 5 == 0:
+            lines += [repeated, '']
+        lines.append(f'- {page} -')
+        out.append('\n'.join(lines))
+    return '\f'.join(out)
+
+
+def run_checks():
+    failed = 0
+    for name, text, expected in CHECKS:
+        cleaned, report = preprocess_text(text)
+        missing = [s for s in expected if s not in cleaned]
+        status = 'ok' if not missing else f'FAILED (lost {missing})'
+        print(f'check {name}: {status}')
+        failed += bool(missing)
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Source preprocessing benchmark')
+    parser.add_argument('--corpus', help='UTF-8 text file to use instead of the synthetic corpus')
+    parser.add_argument('--pages', type=int, default=200)
+    args = parser.parse_args()
+
+    if args.corpus:
+        with open(args.corpus, 'r', encoding='utf-8') as f:
+            corpus = f.read()
+    else:
+        corpus = synthetic_corpus(args.pages)
+
+    start = time.perf_counter()
+    _, report = preprocess_text(corpus)
+    elapsed = time.perf_counter() - start
+    print(f'corpus: {len(corpus):,} chars, preprocessed in {elapsed * 1000:.1f} ms')
+    print(f'report: {report}')
+
+    sys.exit(1 if run_checks() else 0)
+
+
+if __name__ == '__main__':
+    main()
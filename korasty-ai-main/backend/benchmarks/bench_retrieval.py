@@ -0,0 +1,130 @@
+# Korasty AI - Retrieval benchmark
+# Compares chat prompt size and latency between the full-context path and the
+# BM25 retrieval path.
+#
+# Usage (from the backend directory):
+#   python benchmarks/bench_retrieval.py --paragraphs 2000
+#   python benchmarks/bench_retrieval.py --corpus book.txt --api-key YOUR_KEY
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from retrieval import RetrievalIndex  # noqa: E402
+
+
+TOPICS = {
+    'التمثيل الضوئي': ['النبات', 'الضوء', 'الكلوروفيل', 'ثاني أكسيد الكربون', 'الأكسجين', 'الجلوكوز'],
+    'الخلية': ['النواة', 'الغشاء', 'الميتوكوندريا', 'السيتوبلازم', 'الانقسام', 'الكروموسومات'],
+    'الجاذبية': ['نيوتن', 'الكتلة', 'التسارع', 'القوة', 'المدار', 'الكواكب'],
+    'الدولة العباسية': ['بغداد', 'الخليفة', 'الترجمة', 'بيت الحكمة', 'العلماء', 'التجارة'],
+    'الكسور': ['البسط', 'المقام', 'الجمع', 'التبسيط', 'العدد', 'القسمة'],
+    'المياه': ['التبخر', 'التكاثف', 'الأمطار', 'الأنهار', 'المحيطات', 'الدورة']
+}
+FILLER = ['يعتبر', 'حيث', 'كما', 'بالإضافة إلى', 'ويؤدي', 'إلى', 'دوراً', 'مهماً', 'في', 'عملية', 'دراسة']
+
+QUESTIONS = [
+    'ما هو دور الكلوروفيل في التمثيل الضوئي؟',
+    'اشرح وظيفة الميتوكوندريا في الخلية',
+    'كيف فسر نيوتن الجاذبية والتسارع؟',
+    'ما أهمية بيت الحكمة في الدولة العباسية؟',
+    'كيف نبسط الكسور ونجمعها؟',
+    'اشرح دورة المياه والتبخر والتكاثف'
+]
+
+
+def synthetic_corpus(paragraphs, seed=7):
+    """Build an Arabic-looking corpus of topic paragraphs"""
+    rng = random.Random(seed)
+    topics = list(TOPICS)
+    out = []
+    for i in range(paragraphs):
+        topic = topics[i % len(topics)]
+        words = [topic]
+        for _ in range(60):
+            pool = TOPICS[topic] if rng.random() < 0.4 else FILLER
+            words.append(rng.choice(pool))
+        out.append(' '.join(words) + '.')
+    return '\n\n'.join(out)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def call_model(api_key, prompt):
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    model = genai.GenerativeModel('gemini-2.5-flash')
+    start = time.perf_counter()
+    model.generate_content(prompt)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Chat retrieval benchmark')
+    parser.add_argument('--corpus', help='UTF-8 text file to use instead of the synthetic corpus')
+    parser.add_argument('--paragraphs', type=int, default=2000)
+    parser.add_argument('--top-k', type=int, default=8)
+    parser.add_argument('--char-budget', type=int, default=12000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--api-key', help='Also measure end-to-end Gemini latency for both paths')
+    args = parser.parse_args()
+
+    if args.corpus:
+        with open(args.corpus, 'r', encoding='utf-8') as f:
+            corpus = f.read()
+    else:
+        corpus = synthetic_corpus(args.paragraphs)
+
+    print(f'corpus: {len(corpus):,} chars')
+
+    # Full-context path: the whole corpus goes into every prompt
+    full_times = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        full_prompt = f'المحتوى المتاح للرجوع إليه:\n{corpus}\n\nسؤال المستخدم: {QUESTIONS[0]}'
+        full_times.append(time.perf_counter() - start)
+
+    # Retrieval path
+    index = RetrievalIndex()
+    start = time.perf_counter()
+    index.add_source('bench', corpus)
+    build_time = time.perf_counter() - start
+
+    query_times = []
+    retrieval_sizes = []
+    retrieval_prompts = []
+    for i in range(args.repeat):
+        question = QUESTIONS[i % len(QUESTIONS)]
+        start = time.perf_counter()
+        context = index.select_context(question, ['bench'], args.top_k, args.char_budget)
+        prompt = f'المحتوى المتاح للرجوع إليه:\n{context}\n\nسؤال المستخدم: {question}'
+        query_times.append(time.perf_counter() - start)
+        retrieval_sizes.append(len(prompt))
+        retrieval_prompts.append(prompt)
+
+    print(f'index: {index.stats()} built in {build_time * 1000:.1f} ms')
+    print(f'full-context prompt: {len(full_prompt):,} chars, '
+          f'build p50 {statistics.median(full_times) * 1000:.3f} ms')
+    print(f'retrieval prompt:    {int(statistics.mean(retrieval_sizes)):,} chars avg, '
+          f'select p50 {statistics.median(query_times) * 1000:.3f} ms, '
+          f'p95 {percentile(query_times, 95) * 1000:.3f} ms')
+    print(f'prompt size reduction: {len(full_prompt) / statistics.mean(retrieval_sizes):.1f}x')
+
+    if args.api_key:
+        full_latency = [call_model(args.api_key, full_prompt) for _ in range(3)]
+        retrieval_latency = [call_model(args.api_key, p) for p in retrieval_prompts[:3]]
+        print(f'end-to-end full-context p50: {statistics.median(full_latency):.2f} s')
+        print(f'end-to-end retrieval p50:    {statistics.median(retrieval_latency):.2f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+# Korasty AI - Route load test (offline)
+# Drives every API route against the stub model provider, so runs cost no API
+# quota and do not depend on the network, and reports throughput, latency
+# percentiles, error rate and peak RSS per route. Thresholds make it fail
+# (exit code 1) on regressions, e.g. in CI. Each client uses its own API key
+# and the per-key upstream scheduler limits are raised, so the run measures
+# the serving path rather than the rate limiter.
+#
+# Usage (from the backend directory):
+#   python benchmarks/bench_routes.py --requests 50 --concurrency 16
+#   python benchmarks/bench_routes.py --mode asgi --routes chat,studio/report --latency lognormal:0.5,0.4
+#   python benchmarks/bench_routes.py --json report.json --max-p95 2.0 --max-rss-mb 400
+
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STUDIO_TYPES = ['audio', 'flashcards', 'quiz', 'mindmap', 'report', 'slides', 'infographic', 'video']
+ROUTES = (
+    ['chat', 'chat/stream']
+    + [f'studio/{t}' for t in STUDIO_TYPES]
+    + ['studio/report/stream', 'studio/batch', 'process/pdf', 'process/image', 'process/audio']
+)
+PARAGRAPH = 'يتناول هذا الدرس مفهوم التمثيل الضوئي ودور الكلوروفيل في تحويل الطاقة الضوئية إلى طاقة كيميائية. '
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def text_content(args, i):
+    # Unique per request so the result cache never answers
+    return f'[{i}:{time.time_ns()}] ' + (PARAGRAPH * (args.content_chars // len(PARAGRAPH) + 1))[:args.content_chars]
+
+
+def blank_pdf(pages, i):
+    """A scanned-looking PDF (no text layer), unique per request"""
+    try:
+        from pypdf import PdfWriter
+    except ImportError:
+        return b'%PDF-1.4\n' + os.urandom(1024)
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=595, height=842)
+    writer.add_metadata({'/Title': f'bench {i} {time.time_ns()}'})
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def build_request(route, args, i):
+    """Return ``(path, content_type, body)`` for one request to ``route``"""
+    if route.startswith('process/'):
+        kind = route.split('/')[1]
+        if kind == 'pdf':
+            return '/api/process/pdf', 'application/pdf', blank_pdf(args.pdf_pages, i)
+        mime = 'image/png' if kind == 'image' else 'audio/mpeg'
+        return f'/api/{route}', mime, os.urandom(args.file_kb * 1024)
+
+    stream = route.endswith('/stream')
+    route = route[:-len('/stream')] if stream else route
+    if route == 'chat':
+        data = {'message': f'اشرح الفكرة الرئيسية ({i})', 'context': text_content(args, i)}
+    elif route == 'studio/batch':
+        data = {'content': text_content(args, i), 'artifacts': ['flashcards', 'quiz', 'report']}
+    else:
+        data = {'content': text_content(args, i), 'options': {}}
+    if stream:
+        data['stream'] = True
+    return f'/api/{route}', 'application/json', json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+
+def run_wsgi(backend, route, args):
+    client = backend.app.test_client()
+    worker_slots = threading.Semaphore(args.wsgi_threads)
+    results = []
+
+    def one(i):
+        path, content_type, body = build_request(route, args, i)
+        start = time.perf_counter()
+        with worker_slots:
+            response = client.post(path, data=body, content_type=content_type,
+                                   headers={'X-API-Key': f'bench-{i % args.keys}'})
+            response.get_data()  # drain streamed responses
+        results.append((time.perf_counter() - start, response.status_code))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as clients:
+        list(clients.map(one, range(args.requests)))
+    return time.perf_counter() - started, results
+
+
+async def run_asgi(asgi, route, args):
+    semaphore = asyncio.Semaphore(args.concurrency)
+    results = []
+
+    async def one(i):
+        path, content_type, body = build_request(route, args, i)
+        scope = {
+            'type': 'http',
+            'method': 'POST',
+            'path': path,
+            'query_string': b'',
+            'headers': [(b'content-type', content_type.encode()), (b'x-api-key', f'bench-{i % args.keys}'.encode()),
+                        (b'content-length', str(len(body)).encode())],
+        }
+        status = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+
+        async with semaphore:
+            start = time.perf_counter()
+            await asgi.application(scope, receive, send)
+            results.append((time.perf_counter() - start, status[0] if status else 0))
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(args.requests)])
+    return time.perf_counter() - started, results
+
+
+def summarize(elapsed, results):
+    latencies = [latency for latency, _ in results]
+    errors = sum(1 for _, status in results if status >= 400 or status == 0)
+    return {
+        'requests': len(results),
+        'errors': errors,
+        'error_rate': round(errors / len(results), 4),
+        'throughput': round(len(results) / elapsed, 2),
+        'p50': round(statistics.median(latencies), 4),
+        'p95': round(percentile(latencies, 95), 4),
+        'p99': round(percentile(latencies, 99), 4),
+        'peak_rss_mb': round(peak_rss_mb(), 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline per-route load test against the stub model')
+    parser.add_argument('--routes', default=','.join(ROUTES), help='Comma-separated, e.g. chat,studio/quiz')
+    parser.add_argument('--mode', choices=['wsgi', 'asgi'], default='wsgi')
+    parser.add_argument('--requests', type=int, default=50, help='Requests per route')
+    parser.add_argument('--concurrency', type=int, default=16, help='Concurrent clients')
+    parser.add_argument('--keys', type=int, help='Distinct API keys the clients rotate through (default: one per client)')
+    parser.add_argument('--upstream-rate', type=float, default=1000.0,
+                        help='Per-key upstream scheduler rate (calls/s); the server default is 5')
+    parser.add_argument('--upstream-burst', type=int, default=1000,
+                        help='Per-key upstream scheduler burst; the server default is 10')
+    parser.add_argument('--upstream-concurrency', type=int, default=1000,
+                        help='Per-key upstream scheduler concurrency; the server default is 8')
+    parser.add_argument('--wsgi-threads', type=int, default=8,
+                        help='Worker threads for the WSGI path (gunicorn workers x threads)')
+    parser.add_argument('--content-chars', type=int, default=8000, help='Source text size for chat/studio')
+    parser.add_argument('--file-kb', type=int, default=256, help='Upload size for image/audio')
+    parser.add_argument('--pdf-pages', type=int, default=12, help='Pages in the generated PDF')
+    parser.add_argument('--latency', default='lognormal:0.2,0.3',
+                        help='Stub latency: 0.05, fixed:0.05, uniform:LOW,HIGH, normal:MEAN,SD or lognormal:MEDIAN,SIGMA')
+    parser.add_argument('--first-token', default='lognormal:0.08,0.3', help='Stub time to first streamed chunk')
+    parser.add_argument('--chunk-interval', type=float, default=0.02, help='Stub seconds between streamed chunks')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of stub calls that fail')
+    parser.add_argument('--key-rps', type=float, default=0, help='Stub per-key quota (calls/s) before 429s')
+    parser.add_argument('--output-chars', type=int, default=2000, help='Stub text reply size')
+    parser.add_argument('--json', help='Also write the report to this file')
+    parser.add_argument('--max-p95', type=float, help='Fail if any route p95 exceeds this many seconds')
+    parser.add_argument('--max-error-rate', type=float, help='Fail if any route error rate exceeds this')
+    parser.add_argument('--max-rss-mb', type=float, help='Fail if peak RSS exceeds this many MB')
+    args = parser.parse_args()
+    if args.keys is None:
+        args.keys = args.concurrency
+
+    # The app reads its provider and scheduler settings at import time
+    os.environ.setdefault('KORASTY_DATA_DIR', tempfile.mkdtemp(prefix='korasty-bench-'))
+    os.environ['KORASTY_MODEL_PROVIDER'] = 'stub'
+    os.environ['KORASTY_STUB_LATENCY'] = args.latency
+    os.environ['KORASTY_STUB_FIRST_TOKEN'] = args.first_token
+    os.environ['KORASTY_STUB_CHUNK_INTERVAL'] = str(args.chunk_interval)
+    os.environ['KORASTY_STUB_ERROR_RATE'] = str(args.error_rate)
+    os.environ['KORASTY_STUB_OUTPUT_CHARS'] = str(args.output_chars)
+    os.environ['KORASTY_STUB_KEY_RPS'] = str(args.key_rps)
+    os.environ.setdefault('KORASTY_STUB_SEED', '0')
+    os.environ['KORASTY_UPSTREAM_RATE'] = str(args.upstream_rate)
+    os.environ['KORASTY_UPSTREAM_BURST'] = str(args.upstream_burst)
+    os.environ['KORASTY_UPSTREAM_CONCURRENCY'] = str(args.upstream_concurrency)
+
+    import app as backend
+    import asgi
+
+    # Per-request progress logs would dominate the output (errors still show)
+    logging.getLogger('app').setLevel(logging.WARNING)
+    logging.getLogger('korasty.timing').setLevel(logging.WARNING)
+
+    routes = [r.strip() for r in args.routes.split(',') if r.strip()]
+    unknown = set(routes) - set(ROUTES)
+    if unknown:
+        parser.error(f'unknown routes: {", ".join(sorted(unknown))}')
+
+    print(f'{args.mode.upper()}: {args.requests} requests/route, {args.concurrency} concurrent clients, '
+          f'stub latency {args.latency}, error rate {args.error_rate}')
+    print(f'{args.keys} API keys; upstream scheduler per key: rate {args.upstream_rate:g}/s, '
+          f'burst {args.upstream_burst}, concurrency {args.upstream_concurrency}; '
+          f'stub key quota {args.key_rps:g}/s' + (' (off)' if not args.key_rps else ''))
+    print(f'{"route":<24} {"req/s":>8} {"p50":>8} {"p95":>8} {"p99":>8} {"errors":>7} {"peak RSS":>10}')
+
+    report = {'config': vars(args), 'routes': {}}
+    for route in routes:
+        if args.mode == 'wsgi':
+            elapsed, results = run_wsgi(backend, route, args)
+        else:
+            elapsed, results = asyncio.run(run_asgi(asgi, route, args))
+        summary = report['routes'][route] = summarize(elapsed, results)
+        print(f'{route:<24} {summary["throughput"]:8.1f} {summary["p50"]:7.3f}s {summary["p95"]:7.3f}s '
+              f'{summary["p99"]:7.3f}s {summary["errors"]:7d} {summary["peak_rss_mb"]:8.1f}MB')
+
+    report['peak_rss_mb'] = round(peak_rss_mb(), 1)
+    print(f'peak RSS: {report["peak_rss_mb"]:.1f} MB')
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    failures = []
+    for route, summary in report['routes'].items():
+        if args.max_p95 is not None and summary['p95'] > args.max_p95:
+            failures.append(f'{route}: p95 {summary["p95"]}s > {args.max_p95}s')
+        if args.max_error_rate is not None and summary['error_rate'] > args.max_error_rate:
+            failures.append(f'{route}: error rate {summary["error_rate"]} > {args.max_error_rate}')
+    if args.max_rss_mb is not None and report['peak_rss_mb'] > args.max_rss_mb:
+        failures.append(f'peak RSS {report["peak_rss_mb"]} MB > {args.max_rss_mb} MB')
+    for failure in failures:
+        print(f'FAIL {failure}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
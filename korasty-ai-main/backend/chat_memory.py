@@ -0,0 +1,143 @@
+# Korasty AI - Chat Session Memory
+# Server-side conversation state: the most recent turns are kept verbatim and
+# older ones are folded into a running summary, so the prompt sent upstream
+# stays bounded however long a tutoring session runs.
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+# A fold not applied within this many seconds is assumed lost (e.g. the
+# worker restarted) and may be retried
+FOLD_TIMEOUT = 120
+
+
+class ChatMemory:
+    """SQLite-backed chat sessions with a rolling summary.
+
+    ``append`` returns the oldest turns once a session exceeds
+    ``recent_messages`` messages or ``recent_chars`` characters; the caller
+    summarizes them and hands the result to ``apply_summary``. Only one fold
+    per session is in flight at a time.
+    """
+
+    def __init__(self, db_path, recent_messages=6, recent_chars=6000, summary_chars=2000,
+                 ttl=7 * 24 * 3600):
+        self.db_path = db_path
+        self.recent_messages = recent_messages
+        self.recent_chars = recent_chars
+        self.summary_chars = summary_chars
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS sessions ('
+            ' id TEXT NOT NULL,'
+            ' owner TEXT NOT NULL,'
+            ' summary TEXT NOT NULL,'
+            ' turns TEXT NOT NULL,'
+            ' folding_since REAL NOT NULL,'
+            ' updated_at REAL NOT NULL,'
+            ' PRIMARY KEY (id, owner))'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated_at)')
+        self._db.commit()
+
+    def _row(self, session_id, owner):
+        row = self._db.execute(
+            'SELECT summary, turns, folding_since FROM sessions WHERE id = ? AND owner = ? AND updated_at > ?',
+            (session_id, owner, time.time() - self.ttl)
+        ).fetchone()
+        if row is None:
+            return None
+        return {'summary': row[0], 'turns': json.loads(row[1]), 'folding_since': row[2]}
+
+    def load(self, session_id, owner):
+        """Return ``{'summary', 'turns'}`` for a session, or None if unknown or expired"""
+        with self._lock:
+            session = self._row(session_id, owner)
+        if session is None:
+            return None
+        return {'summary': session['summary'], 'turns': self.recent(session['turns'])}
+
+    def recent(self, turns):
+        """The newest turns within the message and character budgets, starting with a user turn"""
+        kept = []
+        size = 0
+        for turn in reversed(turns):
+            size += len(turn['content'])
+            if kept and (len(kept) >= self.recent_messages or size > self.recent_chars):
+                break
+            kept.append(turn)
+        kept.reverse()
+        while kept and kept[0]['role'] != 'user':
+            kept.pop(0)
+        return kept
+
+    def append(self, session_id, owner, turns, seed=None):
+        """Record new turns; returns ``(summary, turns_to_fold)`` when a fold is due, else None.
+
+        ``seed`` (the client's own history) initialises a session the server
+        does not know yet, e.g. after it expired.
+        """
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            session = self._row(session_id, owner)
+            if session is None:
+                session = {'summary': '', 'turns': list(seed or []), 'folding_since': 0}
+            stored = session['turns'] + turns
+            folding_since = session['folding_since']
+
+            fold = None
+            if now - folding_since > FOLD_TIMEOUT:
+                keep = len(self.recent(stored))
+                if keep < len(stored):
+                    fold = (session['summary'], stored[:len(stored) - keep])
+                    folding_since = now
+
+            self._db.execute(
+                'INSERT OR REPLACE INTO sessions (id, owner, summary, turns, folding_since, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (session_id, owner, session['summary'], json.dumps(stored, ensure_ascii=False),
+                 folding_since, now)
+            )
+            self._db.commit()
+            return fold
+
+    def apply_summary(self, session_id, owner, summary, folded_count):
+        """Replace the summary and drop the ``folded_count`` oldest turns it now covers"""
+        with self._lock:
+            session = self._row(session_id, owner)
+            if session is None:
+                return
+            if summary is None:
+                # The fold failed; leave the turns for the next attempt
+                summary, folded_count = session['summary'], 0
+            self._db.execute(
+                'UPDATE sessions SET summary = ?, turns = ?, folding_since = 0 WHERE id = ? AND owner = ?',
+                (summary[:self.summary_chars],
+                 json.dumps(session['turns'][folded_count:], ensure_ascii=False),
+                 session_id, owner)
+            )
+            self._db.commit()
+
+    def delete(self, session_id, owner):
+        with self._lock:
+            self._db.execute('DELETE FROM sessions WHERE id = ? AND owner = ?', (session_id, owner))
+            self._db.commit()
+
+    def _purge(self, now):
+        """Drop expired sessions (at most once a minute)"""
+        if now - self._last_purge < 60:
+            return
+        self._last_purge = now
+        self._db.execute('DELETE FROM sessions WHERE updated_at <= ?', (now - self.ttl,))
@@ -0,0 +1,254 @@
+# Korasty AI - Provider Context Cache
+# Large context that repeats across calls (the teacher prompt plus a class's
+# sources, or the content behind several studio artifacts) is uploaded once as
+# a provider-side cached context, keyed by its hash, so follow-up calls send
+# only the new question. The registry is shared by all workers through SQLite.
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from google.api_core import exceptions as api_exceptions
+
+
+logger = logging.getLogger(__name__)
+
+# The model or provider cannot cache at all: stop trying for a while
+_UNSUPPORTED_ERRORS = (
+    api_exceptions.MethodNotImplemented,
+    NotImplementedError,
+    AttributeError
+)
+# This context cannot be cached (too small or too large for the model, ...)
+_REJECTED_ERRORS = (
+    api_exceptions.InvalidArgument,
+    api_exceptions.FailedPrecondition,
+    api_exceptions.PermissionDenied,
+    api_exceptions.NotFound
+)
+
+
+def context_digest(model_name, system_instruction, content):
+    payload = json.dumps([model_name, system_instruction or '', content], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ContextCache:
+    """Create, reuse, refresh and evict provider-side cached contexts.
+
+    ``get`` returns the name of a live cached context holding
+    ``system_instruction`` + ``content`` for this key, creating it once the
+    content has been seen ``min_uses`` times within ``ttl`` (a one-off call
+    would only pay for the upload), or None when the call should send
+    everything inline: the content is shorter than ``min_chars`` or longer
+    than ``max_chars``, not used often enough yet, the provider rejected it,
+    or caching is unsupported. A context used within
+    ``refresh_margin`` seconds of expiring gets its TTL extended by ``ttl``;
+    past ``max_per_owner`` contexts per key the least recently used one is
+    deleted upstream. Creation is coalesced through ``flight`` (SingleFlight).
+    """
+
+    def __init__(self, db_path, provider, model_name, enabled=True, ttl=3600, refresh_margin=300,
+                 min_chars=16000, max_chars=1_000_000, min_uses=2, max_per_owner=16, retry_after=3600,
+                 flight=None):
+        self.provider = provider
+        self.model_name = model_name
+        self.enabled = enabled
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.min_uses = min_uses
+        self.max_per_owner = max_per_owner
+        self.retry_after = retry_after
+        self.flight = flight
+
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+        self._unsupported_until = 0.0
+        self._counters = {
+            'hits': 0, 'created': 0, 'refreshed': 0, 'evicted': 0,
+            'invalidated': 0, 'rejected': 0, 'fallbacks': 0, 'first_uses': 0
+        }
+
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS contexts ('
+            ' owner TEXT NOT NULL,'
+            ' digest TEXT NOT NULL,'
+            ' name TEXT,'  # '': seen, not cached yet; NULL: the provider rejected it
+            ' uses INTEGER NOT NULL,'
+            ' expires_at REAL NOT NULL,'
+            ' last_used REAL NOT NULL,'
+            ' PRIMARY KEY (owner, digest))'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS contexts_expires ON contexts (expires_at)')
+        self._db.commit()
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def cacheable(self, content):
+        """Whether ``get`` may cache this content (cheap; no I/O)"""
+        return (
+            self.enabled
+            and self.min_chars <= len(content) <= self.max_chars
+            and time.monotonic() >= self._unsupported_until
+        )
+
+    def get(self, api_key, system_instruction, content):
+        """Name of a live cached context for this key and content, or None to send it inline"""
+        if not self.cacheable(content):
+            return None
+
+        owner = hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+        digest = context_digest(self.model_name, system_instruction, content)
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            row = self._db.execute(
+                'SELECT name, uses, expires_at FROM contexts WHERE owner = ? AND digest = ? AND expires_at > ?',
+                (owner, digest, now)
+            ).fetchone()
+            name, uses, expires_at = row or ('', 0, now + self.ttl)
+            if name is not None:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO contexts (owner, digest, name, uses, expires_at, last_used) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (owner, digest, name, uses + 1, expires_at, now)
+                )
+                self._db.commit()
+
+        if name is None:
+            self._count('fallbacks')
+            return None
+        if not name and uses + 1 < self.min_uses:
+            self._count('first_uses')
+            return None
+        if name:
+            if expires_at - now > self.refresh_margin or self._refresh(api_key, owner, digest, name):
+                self._count('hits')
+                return name
+
+        if self.flight is None:
+            return self._create(api_key, owner, digest, system_instruction, content)
+        name, _ = self.flight.do(
+            f'ctx-{owner[:16]}-{digest}',
+            lambda: self._create(api_key, owner, digest, system_instruction, content),
+            lookup=lambda: self._live(owner, digest)
+        )
+        return name
+
+    def _live(self, owner, digest):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT name FROM contexts WHERE owner = ? AND digest = ? AND expires_at > ?',
+                (owner, digest, time.time() + self.refresh_margin)
+            ).fetchone()
+        return (row[0] or None) if row else None
+
+    def _refresh(self, api_key, owner, digest, name):
+        """Extend a context close to expiry; False if it is gone upstream"""
+        try:
+            expires_at = self.provider.refresh_cached_content(api_key, name, self.ttl)
+        except Exception as e:
+            logger.warning(f"Context cache refresh failed ({type(e).__name__}): {str(e)}")
+            # Gone upstream: back to "seen", so the caller creates it again
+            self._store(owner, digest, '', time.time() + self.ttl)
+            return False
+        with self._lock:
+            self._db.execute(
+                'UPDATE contexts SET expires_at = ? WHERE owner = ? AND digest = ?', (expires_at, owner, digest)
+            )
+            self._db.commit()
+        self._count('refreshed')
+        return True
+
+    def _create(self, api_key, owner, digest, system_instruction, content):
+        try:
+            name, expires_at = self.provider.create_cached_content(
+                api_key, self.model_name, system_instruction, [content], self.ttl
+            )
+        except _UNSUPPORTED_ERRORS as e:
+            logger.warning(f"Context caching unsupported, sending context inline: {str(e)}")
+            self._unsupported_until = time.monotonic() + self.retry_after
+            self._count('fallbacks')
+            return None
+        except _REJECTED_ERRORS as e:
+            # Remember the refusal so this content is not re-uploaded on every call
+            logger.warning(f"Context cache rejected ({type(e).__name__}): {str(e)}")
+            self._store(owner, digest, None, time.time() + self.retry_after)
+            self._count('rejected')
+            return None
+        except Exception as e:
+            # Transient (throttled, unavailable): inline this time, retry on the next call
+            logger.warning(f"Context cache creation failed ({type(e).__name__}): {str(e)}")
+            self._count('fallbacks')
+            return None
+
+        self._store(owner, digest, name, expires_at)
+        self._count('created')
+        self._evict(api_key, owner)
+        return name
+
+    def _store(self, owner, digest, name, expires_at):
+        with self._lock:
+            self._db.execute(
+                'UPDATE contexts SET name = ?, expires_at = ?, last_used = ? WHERE owner = ? AND digest = ?',
+                (name, expires_at, time.time(), owner, digest)
+            )
+            self._db.commit()
+
+    def _evict(self, api_key, owner):
+        """Delete this key's least recently used contexts beyond ``max_per_owner``"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT digest, name FROM contexts WHERE owner = ? AND name != '' AND expires_at > ? "
+                'ORDER BY last_used DESC LIMIT -1 OFFSET ?',
+                (owner, time.time(), self.max_per_owner)
+            ).fetchall()
+            self._db.executemany(
+                'DELETE FROM contexts WHERE owner = ? AND digest = ?', [(owner, digest) for digest, _ in rows]
+            )
+            self._db.commit()
+        for _, name in rows:
+            try:
+                self.provider.delete_cached_content(api_key, name)
+            except Exception as e:
+                # It still expires upstream at the end of its TTL
+                logger.warning(f"Context cache delete failed ({type(e).__name__}): {str(e)}")
+            self._count('evicted')
+
+    def invalidate(self, name):
+        """Drop a context the provider no longer knows (the caller got a NotFound)"""
+        with self._lock:
+            self._db.execute('DELETE FROM contexts WHERE name = ?', (name,))
+            self._db.commit()
+        self._count('invalidated')
+
+    def _purge(self, now):
+        """Drop expired rows (at most once a minute); the provider expires the contexts itself"""
+        if now - self._last_purge < 60:
+            return
+        self._last_purge = now
+        self._db.execute('DELETE FROM contexts WHERE expires_at <= ?', (now,))
+        self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            live = self._db.execute(
+                "SELECT COUNT(*) FROM contexts WHERE name != '' AND expires_at > ?", (time.time(),)
+            ).fetchone()[0]
+            return dict(
+                self._counters,
+                enabled=self.enabled,
+                supported=time.monotonic() >= self._unsupported_until,
+                live_contexts=live
+            )
@@ -0,0 +1,71 @@
+# Korasty AI - Image Preparation
+# Phone photos are far larger than OCR needs. Before upload they are decoded
+# locally (at reduced scale where the codec allows it), bounded to a maximum
+# side and re-encoded as JPEG, so far fewer bytes go upstream.
+
+import io
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - optional dependency
+    Image = ImageOps = None
+
+try:
+    # HEIC/HEIF (iPhone photos) when the plugin is installed
+    from pillow_heif import register_heif_opener
+except ImportError:  # pragma: no cover - optional dependency
+    register_heif_opener = None
+
+if Image is not None and register_heif_opener is not None:
+    register_heif_opener()
+
+
+def image_support_available():
+    return Image is not None
+
+
+def _flatten(image):
+    """RGB or grayscale; transparency goes onto white, as on paper"""
+    if image.mode in ('RGB', 'L'):
+        return image
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def downscale_image(fileobj, mime_type, size, max_side=2048, quality=85):
+    """Return ``(image_bytes, mime_type, details)`` ready to send upstream.
+
+    The image is turned upright (EXIF orientation), fitted within
+    ``max_side`` pixels and re-encoded as JPEG at ``quality``. The original
+    is kept when it already fits and re-encoding would not make it smaller.
+    Raises ``ValueError`` if the image cannot be decoded locally.
+    """
+    fileobj.seek(0)
+    try:
+        image = Image.open(fileobj)
+        original_size = image.size
+        # JPEG decodes straight to a smaller scale (much faster on 12MP photos)
+        image.draft('RGB', (max_side, max_side))
+        image = ImageOps.exif_transpose(image)
+        image = _flatten(image)
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        out = io.BytesIO()
+        image.save(out, 'JPEG', quality=quality)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise ValueError(f'Unreadable image: {e}')
+
+    encoded = out.getvalue()
+    details = {
+        'original_bytes': size,
+        'original_size': list(original_size),
+        'size': list(image.size),
+        'downscaled': True
+    }
+    if len(encoded) >= size and max(original_size) <= max_side:
+        fileobj.seek(0)
+        return fileobj.read(), mime_type, dict(details, size=list(original_size), sent_bytes=size, downscaled=False)
+    return encoded, 'image/jpeg', dict(details, sent_bytes=len(encoded))
@@ -0,0 +1,196 @@
+# Korasty AI - Background Jobs
+# Runs long generations off the request: submit returns a job id at once, a
+# bounded local worker pool does the work and job state and results are kept
+# in SQLite, so any worker process can report status and serve results later.
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class QueueFullError(Exception):
+    """Raised when this process already holds ``max_pending`` unfinished jobs"""
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _isoformat(timestamp):
+    return datetime.utcfromtimestamp(timestamp).isoformat() if timestamp else None
+
+
+class JobQueue:
+    """In-process job queue backed by SQLite.
+
+    ``submit(kind, owner, work)`` schedules ``work(progress)`` on the worker
+    pool; ``work`` returns a JSON-serializable result and may call
+    ``progress(dict)`` to publish intermediate state. Finished jobs are kept
+    for ``retention_seconds``.
+    """
+
+    def __init__(self, db_path, workers=4, max_pending=100, retention_seconds=24 * 3600):
+        self.db_path = db_path
+        self.workers = workers
+        self.max_pending = max_pending
+        self.retention_seconds = retention_seconds
+
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._pending = 0
+        self._last_purge = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            ' id TEXT PRIMARY KEY,'
+            ' owner TEXT NOT NULL,'
+            ' kind TEXT NOT NULL,'
+            ' status TEXT NOT NULL,'
+            ' pid INTEGER NOT NULL,'
+            ' progress TEXT,'
+            ' result TEXT,'
+            ' error TEXT,'
+            ' created_at REAL NOT NULL,'
+            ' started_at REAL,'
+            ' finished_at REAL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished_at)')
+        self._fail_orphans()
+        self._db.commit()
+
+    def _fail_orphans(self):
+        """Jobs left unfinished by a process that no longer exists never complete"""
+        now = time.time()
+        rows = self._db.execute(
+            'SELECT id, pid FROM jobs WHERE status IN (?, ?)', (QUEUED, RUNNING)
+        ).fetchall()
+        for job_id, pid in rows:
+            if pid != os.getpid() and not _pid_alive(pid):
+                self._db.execute(
+                    'UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?',
+                    (FAILED, 'توقف الخادم قبل اكتمال المهمة', now, job_id)
+                )
+
+    def submit(self, kind, owner, work):
+        """Queue ``work`` and return the new job id"""
+        now = time.time()
+        job_id = uuid.uuid4().hex
+
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFullError(kind)
+            self._pending += 1
+            self._purge(now)
+            self._db.execute(
+                'INSERT INTO jobs (id, owner, kind, status, pid, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, owner, kind, QUEUED, os.getpid(), now)
+            )
+            self._db.commit()
+
+        self._executor.submit(self._run, job_id, kind, work)
+        return job_id
+
+    def _run(self, job_id, kind, work):
+        self._update(job_id, status=RUNNING, started_at=time.time())
+        try:
+            result = work(lambda payload: self._update(job_id, progress=json.dumps(payload, ensure_ascii=False)))
+            self._update(
+                job_id, status=DONE, finished_at=time.time(),
+                result=json.dumps(result, ensure_ascii=False)
+            )
+        except Exception as e:
+            logger.error(f"Job {kind} error: {str(e)}")
+            self._update(job_id, status=FAILED, finished_at=time.time(), error=str(e) or 'خطأ في تنفيذ المهمة')
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _update(self, job_id, **fields):
+        columns = ', '.join(f'{name} = ?' for name in fields)
+        with self._lock:
+            self._db.execute(f'UPDATE jobs SET {columns} WHERE id = ?', (*fields.values(), job_id))
+            self._db.commit()
+            self._changed.notify_all()
+
+    def get(self, job_id, owner):
+        """Return the job as a dict, or None if unknown, expired or not the owner's"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT id, kind, status, progress, result, error, created_at, started_at, finished_at'
+                ' FROM jobs WHERE id = ? AND owner = ?'
+                ' AND (finished_at IS NULL OR finished_at >= ?)',
+                (job_id, owner, time.time() - self.retention_seconds)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        job = {
+            'id': row[0],
+            'kind': row[1],
+            'status': row[2],
+            'progress': json.loads(row[3]) if row[3] else None,
+            'created_at': _isoformat(row[6]),
+            'started_at': _isoformat(row[7]),
+            'finished_at': _isoformat(row[8])
+        }
+        if row[2] == DONE:
+            job['result'] = json.loads(row[4])
+        elif row[2] == FAILED:
+            job['error'] = row[5]
+        return job
+
+    def wait(self, job_id, owner, timeout):
+        """Block until the job changes in this process (or ``timeout``), then return it.
+
+        Jobs running in another worker process are picked up on the next
+        call, so callers should wait in a loop with a short timeout.
+        """
+        with self._lock:
+            self._changed.wait(timeout)
+        return self.get(job_id, owner)
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._db.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+            return {
+                'pending': self._pending,
+                'max_pending': self.max_pending,
+                'workers': self.workers,
+                'retention_seconds': self.retention_seconds,
+                'jobs': {status: counts.get(status, 0) for status in (QUEUED, RUNNING, DONE, FAILED)}
+            }
+
+    def _purge(self, now):
+        """Drop finished jobs past retention (at most once a minute)"""
+        if now - self._last_purge < 60:
+            return
+        self._last_purge = now
+        self._db.execute(
+            'DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?',
+            (now - self.retention_seconds,)
+        )
@@ -0,0 +1,58 @@
+# Korasty AI - Map-Reduce Condensing
+# Content too large for one studio prompt is chunked per source section, each
+# chunk is digested in parallel (digests are cached by chunk hash, so editing
+# one source only recomputes its own chunks) and the artifact is then built
+# from the joined digests, digesting again if they are still too large.
+
+import logging
+from concurrent.futures import as_completed
+
+from retrieval import chunk_text
+
+
+logger = logging.getLogger(__name__)
+
+
+def plan_chunks(content, separator, chunk_chars):
+    """Chunk each ``separator``-joined section on its own so boundaries stay stable"""
+    chunks = []
+    for section in content.split(separator):
+        chunks.extend(chunk_text(section, chunk_chars=chunk_chars, overlap_chars=0))
+    return chunks
+
+
+def condense(content, digest_chunk, executor, separator, chunk_chars=16000,
+             max_chars=100000, max_levels=3):
+    """Reduce ``content`` to at most ``max_chars`` by digesting chunks in parallel.
+
+    ``digest_chunk(text)`` returns the digest of one chunk (and is expected to
+    do its own caching). Returns ``(text, details)``; ``text`` is ``content``
+    unchanged when it already fits.
+    """
+    details = {'input_chars': len(content), 'levels': 0, 'chunks': 0}
+    text = content
+
+    while len(text) > max_chars and details['levels'] < max_levels:
+        if details['levels'] == 0:
+            chunks = plan_chunks(text, separator, chunk_chars)
+        else:
+            # Later levels pack several digests into each chunk
+            chunks = chunk_text(text, chunk_chars=chunk_chars, overlap_chars=0)
+        futures = {executor.submit(digest_chunk, chunk): index for index, chunk in enumerate(chunks)}
+
+        digests = [None] * len(chunks)
+        for future in as_completed(futures):
+            index = futures[future]
+            digests[index] = future.result()
+
+        text = separator.join(d for d in digests if d)
+        details['levels'] += 1
+        details['chunks'] += len(chunks)
+
+    details['output_chars'] = len(text)
+    if details['levels']:
+        logger.info(
+            f"Condensed {details['input_chars']} chars to {details['output_chars']} "
+            f"({details['chunks']} chunks, {details['levels']} levels)"
+        )
+    return text, details
@@ -0,0 +1,279 @@
+# Korasty AI - Model Client Pool
+# Keeps Gemini clients per API key so requests reuse their transport (and its
+# TLS session) instead of reconfiguring the SDK's process-global client.
+# Builds on SDK internals (CachedContent request helpers, the client classes,
+# model._client), hence the google-generativeai 0.8.x pin in requirements.txt.
+
+import datetime
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from google.ai import generativelanguage as glm
+import google.generativeai as genai
+from google.generativeai.caching import CachedContent
+from google.generativeai.client import FileServiceClient
+from google.protobuf import field_mask_pb2
+
+
+class _ObservedClient:
+    """Proxy for a generative client that reports each generation call.
+
+    ``observer(method, seconds, response, error)`` is called once per call;
+    for streams, when the stream ends, with the final chunk (which carries
+    the usage metadata).
+    """
+
+    def __init__(self, client, observer):
+        self._client = client
+        self._observer = observer
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def generate_content(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self._client.generate_content(*args, **kwargs)
+        except Exception as e:
+            self._observer('generate_content', time.perf_counter() - started, None, e)
+            raise
+        self._observer('generate_content', time.perf_counter() - started, response, None)
+        return response
+
+    def stream_generate_content(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            iterator = self._client.stream_generate_content(*args, **kwargs)
+        except Exception as e:
+            self._observer('stream_generate_content', time.perf_counter() - started, None, e)
+            raise
+        return self._observe_stream(iterator, started)
+
+    def _observe_stream(self, iterator, started):
+        last = None
+        try:
+            for chunk in iterator:
+                last = chunk
+                yield chunk
+        except Exception as e:
+            self._observer('stream_generate_content', time.perf_counter() - started, None, e)
+            raise
+        self._observer('stream_generate_content', time.perf_counter() - started, last, None)
+
+
+class _ObservedAsyncClient(_ObservedClient):
+    """Async counterpart of _ObservedClient"""
+
+    async def generate_content(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await self._client.generate_content(*args, **kwargs)
+        except Exception as e:
+            self._observer('generate_content', time.perf_counter() - started, None, e)
+            raise
+        self._observer('generate_content', time.perf_counter() - started, response, None)
+        return response
+
+    async def stream_generate_content(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            iterator = await self._client.stream_generate_content(*args, **kwargs)
+        except Exception as e:
+            self._observer('stream_generate_content', time.perf_counter() - started, None, e)
+            raise
+        return self._observe_stream(iterator, started)
+
+    async def _observe_stream(self, iterator, started):
+        last = None
+        try:
+            async for chunk in iterator:
+                last = chunk
+                yield chunk
+        except Exception as e:
+            self._observer('stream_generate_content', time.perf_counter() - started, None, e)
+            raise
+        self._observer('stream_generate_content', time.perf_counter() - started, last, None)
+
+
+class _PoolEntry:
+    def __init__(self, api_key, transport, async_transport, observer=None):
+        self.api_key = api_key
+        self.async_transport = async_transport
+        self.observer = observer
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+        self.client = self._make(glm.GenerativeServiceClient, transport)
+        if observer:
+            self.client = _ObservedClient(self.client, observer)
+        self.async_client = None
+        self.file_client = None
+        self.cache_client = None
+        self.models = {}
+
+    def _make(self, cls, transport):
+        kwargs = {'client_options': {'api_key': self.api_key}}
+        if transport:
+            kwargs['transport'] = transport
+        return cls(**kwargs)
+
+    def model(self, model_name):
+        with self.lock:
+            model = self.models.get(model_name)
+            if model is None:
+                model = genai.GenerativeModel(model_name)
+                # Bind this key's client so the SDK never falls back to the
+                # global client configured by genai.configure()
+                model._client = self.client
+                model._async_client = self.async_client
+                self.models[model_name] = model
+            return model
+
+    def async_model(self, model_name):
+        self._ensure_async_client()
+        return self.model(model_name)
+
+    def _ensure_async_client(self):
+        with self.lock:
+            # Created lazily: only the ASGI serving mode needs it
+            if self.async_client is None:
+                self.async_client = self._make(glm.GenerativeServiceAsyncClient, self.async_transport)
+                if self.observer:
+                    self.async_client = _ObservedAsyncClient(self.async_client, self.observer)
+                for model in self.models.values():
+                    model._async_client = self.async_client
+
+    def cached_model(self, model_name, cached_content, use_async=False):
+        """A model that prefixes every call with a provider-side cached context.
+
+        Not memoized: each cached context gets its own (cheap) model object.
+        """
+        if use_async:
+            self._ensure_async_client()
+        model = genai.GenerativeModel(model_name)
+        model._cached_content = cached_content
+        model._client = self.client
+        model._async_client = self.async_client
+        return model
+
+    def caches(self):
+        with self.lock:
+            if self.cache_client is None:
+                self.cache_client = self._make(glm.CacheServiceClient, None)
+            return self.cache_client
+
+    def files(self):
+        with self.lock:
+            # The SDK's File API client; uploads always go over REST
+            if self.file_client is None:
+                self.file_client = self._make(FileServiceClient, None)
+            return self.file_client
+
+
+class ModelPool:
+    """Bounded, thread-safe pool of per-API-key Gemini clients.
+
+    Entries are evicted least recently used first when more than ``max_keys``
+    keys are active, and once they have been idle for ``idle_seconds``.
+    Evicted clients are simply dropped; in-flight calls keep their reference.
+    ``observer`` (see _ObservedClient) is told about every generation call.
+    """
+
+    def __init__(self, max_keys=128, idle_seconds=900, transport=None,
+                 async_transport='grpc_asyncio', observer=None):
+        self.max_keys = max_keys
+        self.observer = observer
+        self.idle_seconds = idle_seconds
+        self.transport = transport
+        self.async_transport = async_transport
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key fingerprint -> _PoolEntry
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def _entry(self, api_key):
+        fingerprint = hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+        now = time.monotonic()
+
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._entries.get(fingerprint)
+            if entry is not None:
+                entry.last_used = now
+                self._entries.move_to_end(fingerprint)
+                self._counters['hits'] += 1
+                return entry
+
+        # Build the client outside the pool lock
+        entry = _PoolEntry(api_key, self.transport, self.async_transport, self.observer)
+
+        with self._lock:
+            existing = self._entries.get(fingerprint)
+            if existing is not None:
+                existing.last_used = now
+                self._counters['hits'] += 1
+                return existing
+
+            self._entries[fingerprint] = entry
+            self._counters['misses'] += 1
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+            return entry
+
+    def _evict_idle(self, now):
+        while self._entries:
+            fingerprint, entry = next(iter(self._entries.items()))
+            if now - entry.last_used < self.idle_seconds:
+                break
+            del self._entries[fingerprint]
+            self._counters['evictions'] += 1
+
+    def get_model(self, api_key, model_name, cached_content=None):
+        """Return a GenerativeModel bound to this key's pooled client.
+
+        ``cached_content`` names a context created with create_cached_content.
+        """
+        entry = self._entry(api_key)
+        if cached_content:
+            return entry.cached_model(model_name, cached_content)
+        return entry.model(model_name)
+
+    def get_async_model(self, api_key, model_name, cached_content=None):
+        """Return a GenerativeModel whose async client is bound to this key"""
+        entry = self._entry(api_key)
+        if cached_content:
+            return entry.cached_model(model_name, cached_content, use_async=True)
+        return entry.async_model(model_name)
+
+    def create_cached_content(self, api_key, model_name, system_instruction, contents, ttl):
+        """Upload a context to the provider's cache; returns ``(name, expires_at)``"""
+        request = CachedContent._prepare_create_request(
+            model=model_name,
+            system_instruction=system_instruction or None,
+            contents=contents,
+            ttl=datetime.timedelta(seconds=ttl)
+        )
+        cached = self._entry(api_key).caches().create_cached_content(request)
+        return cached.name, cached.expire_time.timestamp()
+
+    def refresh_cached_content(self, api_key, name, ttl):
+        """Extend a cached context's TTL; returns the new ``expires_at``"""
+        request = glm.UpdateCachedContentRequest(
+            cached_content=glm.CachedContent(name=name, ttl=datetime.timedelta(seconds=ttl)),
+            update_mask=field_mask_pb2.FieldMask(paths=['ttl'])
+        )
+        cached = self._entry(api_key).caches().update_cached_content(request)
+        return cached.expire_time.timestamp()
+
+    def delete_cached_content(self, api_key, name):
+        self._entry(api_key).caches().delete_cached_content(name=name)
+
+    def get_file_client(self, api_key):
+        """Return this key's File API client (for uploads too large to inline)"""
+        return self._entry(api_key).files()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, keys=len(self._entries))
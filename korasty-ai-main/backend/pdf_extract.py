@@ -0,0 +1,126 @@
+# Korasty AI - PDF Extraction
+# Splits PDFs locally into page ranges: pages with a usable text layer are read
+# without any model call, and the remaining (scanned) ranges are extracted
+# concurrently, retried individually and merged back in page order.
+
+import io
+import logging
+import threading
+from concurrent.futures import as_completed
+
+from preprocess import fold_presentation_forms
+from upstream import with_retries
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:  # pragma: no cover - optional dependency
+    PdfReader = PdfWriter = None
+
+
+logger = logging.getLogger(__name__)
+
+# A page needs at least this many non-space characters to count as having a
+# text layer; scanned pages usually yield nothing or a few stray glyphs
+MIN_TEXT_LAYER_CHARS = 40
+
+
+def pdf_support_available():
+    return PdfReader is not None
+
+
+def _text_layer(page):
+    try:
+        text = page.extract_text() or ''
+    except Exception:
+        return ''
+    if len(''.join(text.split())) < MIN_TEXT_LAYER_CHARS:
+        return ''
+    # Fold Arabic presentation forms (common in PDF text layers) to base letters
+    return fold_presentation_forms(text).strip()
+
+
+def _page_ranges(pages, pages_per_chunk):
+    """Group sorted page indexes into consecutive ranges of bounded length"""
+    ranges = []
+    for page in pages:
+        if ranges and page == ranges[-1][1] + 1 and page - ranges[-1][0] < pages_per_chunk:
+            ranges[-1][1] = page
+        else:
+            ranges.append([page, page])
+    return [tuple(r) for r in ranges]
+
+
+def _range_pdf(reader, first, last):
+    writer = PdfWriter()
+    for index in range(first, last + 1):
+        writer.add_page(reader.pages[index])
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def extract_pdf(fileobj, extract_range, executor, pages_per_chunk=10, retries=2,
+                backoff=1.0, on_progress=None, use_text_layer=True):
+    """Extract a PDF's text page range by page range.
+
+    ``extract_range(pdf_bytes, first_page, last_page)`` performs the model call
+    for one range (pages are 1-based) and returns its text. Returns
+    ``(text, details)`` where ``details`` reports page counts, how many pages
+    were read locally, the ranges sent to the model and any that failed.
+    With ``use_text_layer=False`` every page goes to the model.
+    Raises ``ValueError`` if the file cannot be parsed as a PDF.
+    """
+    fileobj.seek(0)
+    try:
+        reader = PdfReader(fileobj)
+        if reader.is_encrypted:
+            reader.decrypt('')
+        page_count = len(reader.pages)
+    except Exception as e:
+        raise ValueError(f'Unreadable PDF: {e}')
+
+    segments = {}
+    needs_model = []
+    for index, page in enumerate(reader.pages):
+        text = _text_layer(page) if use_text_layer else ''
+        if text:
+            segments[(index, index)] = text
+        else:
+            needs_model.append(index)
+
+    ranges = _page_ranges(needs_model, pages_per_chunk)
+    total = len(ranges)
+    done = 0
+    failed = []
+
+    if on_progress:
+        on_progress(0, total)
+
+    # pypdf reads lazily from the shared file object, so page copying is serialized
+    reader_lock = threading.Lock()
+
+    def run(first, last):
+        with reader_lock:
+            data = _range_pdf(reader, first, last)
+        return with_retries(lambda: extract_range(data, first + 1, last + 1), retries, backoff)
+
+    futures = {executor.submit(run, first, last): (first, last) for first, last in ranges}
+    for future in as_completed(futures):
+        first, last = futures[future]
+        try:
+            segments[(first, last)] = future.result().strip()
+        except Exception as e:
+            logger.error(f"PDF pages {first + 1}-{last + 1} extraction error: {str(e)}")
+            failed.append({'pages': [first + 1, last + 1], 'error': str(e)})
+        done += 1
+        if on_progress:
+            on_progress(done, total)
+
+    text = '\n\n'.join(segments[key] for key in sorted(segments) if segments[key])
+
+    return text, {
+        'pages': page_count,
+        'local_pages': page_count - len(needs_model),
+        'model_ranges': [[first + 1, last + 1] for first, last in ranges],
+        'failed_ranges': sorted(failed, key=lambda item: item['pages'])
+    }
@@ -0,0 +1,296 @@
+# Korasty AI - Source Preprocessing
+# Extracted text carries a lot that costs tokens without informing the model:
+# page headers/footers and page numbers repeated on every page, tatweel,
+# invisible format characters, whitespace runs and duplicated paragraphs.
+# Each source is cleaned once before it is used in any prompt.
+
+import hashlib
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+
+TATWEEL = 'ـ'
+PAGE_BREAK = '\f'
+
+# Arabic presentation forms (Arabic Presentation Forms-A and -B), common in PDF
+# text layers; only these are folded so superscripts, subscripts and
+# fractions ("نق²", "H₂O", "½") keep their meaning
+PRESENTATION_FORMS = re.compile('[\ufb50-\ufdff\ufe70-\ufeff]+')
+
+# A line that is only a page number: "12", "- 12 -", "صفحة ١٢", "Page 3 of 40"
+PAGE_NUMBER_LINE = re.compile(
+    r'^[\s\-–—|•.()\[\]]*(?:(?:الصفحة|صفحة|ص|page|p)\.?\s*)?(?P<page>[0-9٠-٩]+)'
+    r'(?:\s*(?:/|من|of)\s*[0-9٠-٩]+)?[\s\-–—|•.()\[\]]*$',
+    re.IGNORECASE
+)
+INNER_WHITESPACE = re.compile(r'(?<=\S)[^\S\n]+')
+DIGITS = re.compile(r'[0-9٠-٩]+')
+
+# Repeated lines count as headers/footers only when short, long enough not to
+# be a structural label ("الحل:"), within PAGE_EDGE_LINES lines of a page edge
+# (a page break or a page number) and seen there at least this many times
+BOILERPLATE_MIN_REPEATS = 3
+BOILERPLATE_MIN_CHARS = 15
+BOILERPLATE_MAX_CHARS = 120
+
+# A number-only line is a page number only with positional evidence: it sits
+# within PAGE_EDGE_LINES lines of a page break, or belongs to a run of at least
+# BOILERPLATE_MIN_REPEATS consecutive numbers at least PAGE_MIN_LINES lines
+# apart whose spacing varies by no more than PAGE_GAP_RATIO
+PAGE_EDGE_LINES = 2
+PAGE_MIN_LINES = 10
+PAGE_GAP_RATIO = 4
+
+# Only paragraphs of at least this many words are deduplicated (short answers
+# such as "صح" legitimately repeat); they are compared by word 3-shingles and
+# those sharing ``NEAR_DUPLICATE_THRESHOLD`` of their shingles are dropped
+DUPLICATE_MIN_WORDS = 8
+NEAR_DUPLICATE_THRESHOLD = 0.9
+SKETCH_SIZE = 4
+
+
+def comparison_key(text):
+    """Spelling-insensitive form of ``text`` for comparisons (never sent upstream)"""
+    text = unicodedata.normalize('NFKC', text).replace(TATWEEL, '')
+    # Alef/yaa/taa marbuta variants are spelled inconsistently in OCR and model output
+    text = re.sub('[إأآ]', 'ا', text).replace('ى', 'ي').replace('ة', 'ه')
+    # Diacritics are dropped; punctuation and symbols separate words
+    text = ''.join(
+        ch if unicodedata.category(ch)[0] in 'LN' else ' '
+        for ch in text.lower() if unicodedata.category(ch)[0] != 'M'
+    )
+    return ' '.join(text.split())
+
+
+def _is_junk(ch):
+    if ch in '\n\t' + PAGE_BREAK:
+        return False
+    # Controls, format characters (bidi marks, zero-width joiners, BOM, soft
+    # hyphen), private use, surrogates and unassigned code points
+    return unicodedata.category(ch) in ('Cc', 'Cf', 'Co', 'Cs', 'Cn') or ch == '�'
+
+
+def fold_presentation_forms(text):
+    """Arabic presentation forms to base letters; everything else is left as is"""
+    return PRESENTATION_FORMS.sub(lambda m: unicodedata.normalize('NFKC', m.group()), text)
+
+
+def normalize_text(text):
+    """Presentation forms folded, no tatweel or junk characters; page breaks are kept"""
+    text = fold_presentation_forms(text.replace('\r\n', '\n').replace('\r', '\n'))
+    return ''.join(ch for ch in text.replace(TATWEEL, '') if not _is_junk(ch))
+
+
+def _near_page_break(lines, index, step, edges=frozenset()):
+    """True if a page break (or the text's edge) is within PAGE_EDGE_LINES lines of ``index``.
+
+    Indexes in ``edges`` (page-number lines) count as page breaks.
+    """
+    between = 0
+    index += step
+    while 0 <= index < len(lines):
+        if lines[index] == PAGE_BREAK or index in edges:
+            return True
+        if lines[index].strip():
+            between += 1
+            if between >= PAGE_EDGE_LINES:
+                return False
+        index += step
+    return True
+
+
+def page_number_lines(lines):
+    """Indexes of the number-only lines that are page numbers by position"""
+    candidates = []
+    for index, line in enumerate(lines):
+        match = PAGE_NUMBER_LINE.match(line.strip())
+        if match:
+            candidates.append((index, int(match.group('page'))))
+
+    pages = set()
+    if PAGE_BREAK in lines:
+        pages.update(
+            index for index, _ in candidates
+            if _near_page_break(lines, index, -1) or _near_page_break(lines, index, 1)
+        )
+
+    # Runs of consecutive numbers with page-like spacing, keyed by the next number
+    runs = []
+    waiting = {}
+    for index, page in candidates:
+        run = waiting.pop(page, None)
+        if run is None or index - run[-1] < PAGE_MIN_LINES:
+            if run is not None:
+                waiting[page] = run
+            run = [index]
+            runs.append(run)
+        else:
+            run.append(index)
+        waiting[page + 1] = run
+    for run in runs:
+        if len(run) < BOILERPLATE_MIN_REPEATS:
+            continue
+        gaps = [b - a for a, b in zip(run, run[1:])]
+        if max(gaps) <= PAGE_GAP_RATIO * min(gaps):
+            pages.update(run)
+    return pages
+
+
+def header_footer_lines(lines, signatures, pages):
+    """Indexes of the lines that repeat at a page edge, where headers and footers sit"""
+    if not pages and PAGE_BREAK not in lines:
+        # Nothing marks where pages end, so no line is known to be at one
+        return set()
+    counts = Counter(
+        signature for signature in signatures
+        if BOILERPLATE_MIN_CHARS <= len(signature) <= BOILERPLATE_MAX_CHARS
+    )
+    at_edge = [
+        index for index, signature in enumerate(signatures)
+        if counts[signature] >= BOILERPLATE_MIN_REPEATS
+        and (_near_page_break(lines, index, -1, pages) or _near_page_break(lines, index, 1, pages))
+    ]
+    edge_counts = Counter(signatures[index] for index in at_edge)
+    return {index for index in at_edge if edge_counts[signatures[index]] >= BOILERPLATE_MIN_REPEATS}
+
+
+def remove_boilerplate(lines):
+    """Drop page-number lines and all but the first copy of repeated header/footer lines.
+
+    Only lines next to a page edge are considered, so repeated headings and
+    steps in the body ("التمرين 2: ...") are kept. Page breaks become blank
+    lines. Returns ``(lines, removed)``.
+    """
+    signatures = [DIGITS.sub('#', comparison_key(line)) for line in lines]
+    pages = page_number_lines(lines)
+    headers = header_footer_lines(lines, signatures, pages)
+
+    kept = []
+    seen = set()
+    removed = 0
+    for index, (line, signature) in enumerate(zip(lines, signatures)):
+        if line == PAGE_BREAK:
+            kept.append('')
+            continue
+        if index in pages:
+            removed += 1
+            continue
+        if index in headers:
+            if signature in seen:
+                removed += 1
+                continue
+            seen.add(signature)
+        kept.append(line)
+    return kept, removed
+
+
+def _shingles(key):
+    words = key.split()
+    return {' '.join(words[i:i + 3]) for i in range(len(words) - 2)}
+
+
+def _sketch(shingles):
+    """The few smallest shingle hashes: near-duplicates very likely share one"""
+    hashes = sorted(
+        int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'big') for s in shingles
+    )
+    return hashes[:SKETCH_SIZE]
+
+
+def dedupe_paragraphs(paragraphs):
+    """Drop exact (ignoring spelling/punctuation) and near-identical repeats of earlier paragraphs.
+
+    Paragraphs under DUPLICATE_MIN_WORDS words are always kept. Returns
+    ``(paragraphs, removed)``.
+    """
+    kept = []
+    exact = set()
+    kept_shingles = []
+    buckets = {}
+    removed = 0
+    for paragraph in paragraphs:
+        key = comparison_key(paragraph)
+        if len(key.split()) < DUPLICATE_MIN_WORDS:
+            kept.append(paragraph)
+            continue
+        if key in exact:
+            removed += 1
+            continue
+
+        shingles = _shingles(key)
+        sketch = _sketch(shingles)
+        candidates = {index for h in sketch for index in buckets.get(h, ())}
+        if any(
+            len(shingles & kept_shingles[i]) / len(shingles | kept_shingles[i]) >= NEAR_DUPLICATE_THRESHOLD
+            for i in candidates
+        ):
+            removed += 1
+            continue
+        for h in sketch:
+            buckets.setdefault(h, []).append(len(kept_shingles))
+        kept_shingles.append(shingles)
+
+        exact.add(key)
+        kept.append(paragraph)
+    return kept, removed
+
+
+def preprocess_text(text):
+    """Clean one source for prompting; returns ``(text, report)``.
+
+    ``report`` has the character counts, ``compression_ratio`` (input/output)
+    and how many boilerplate lines and duplicate paragraphs were removed.
+    """
+    # Page breaks get lines of their own
+    normalized = normalize_text(text).replace(PAGE_BREAK, '\n' + PAGE_BREAK + '\n')
+    # Collapse runs of spaces inside lines; leading indentation is kept
+    lines = [
+        line if line == PAGE_BREAK else INNER_WHITESPACE.sub(' ', line).rstrip()
+        for line in normalized.split('\n')
+    ]
+    lines, boilerplate = remove_boilerplate(lines)
+
+    paragraphs = []
+    current = []
+    for line in lines + ['']:
+        if line.strip():
+            current.append(line)
+        elif current:
+            paragraphs.append('\n'.join(current))
+            current = []
+    paragraphs, duplicates = dedupe_paragraphs(paragraphs)
+
+    cleaned = '\n\n'.join(paragraphs)
+    return cleaned, {
+        'input_chars': len(text),
+        'output_chars': len(cleaned),
+        'compression_ratio': round(len(text) / len(cleaned), 3) if cleaned else 0.0,
+        'boilerplate_lines': boilerplate,
+        'duplicate_paragraphs': duplicates
+    }
+
+
+class PreprocessStats:
+    """Thread-safe totals over the sources preprocessed by this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = Counter()
+
+    def record(self, report):
+        with self._lock:
+            self._totals['sources'] += 1
+            for name in ('input_chars', 'output_chars', 'boilerplate_lines', 'duplicate_paragraphs'):
+                self._totals[name] += report[name]
+
+    def stats(self):
+        with self._lock:
+            totals = dict.fromkeys(
+                ('sources', 'input_chars', 'output_chars', 'boilerplate_lines', 'duplicate_paragraphs'), 0
+            )
+            totals.update(self._totals)
+        output = totals['output_chars']
+        totals['compression_ratio'] = round(totals['input_chars'] / output, 3) if output else 0.0
+        return totals
@@ -0,0 +1,184 @@
+# Korasty AI - Request Timing
+# Per-request stage timings (body parsing, base64 decoding, prompt building,
+# upstream calls, JSON parsing, serialization) for the Server-Timing header and
+# a structured log line, plus an opt-in cProfile capture of a single request.
+# Without an active timer a stage costs one context variable lookup.
+
+import contextvars
+import cProfile
+import io
+import os
+import pstats
+import re
+import threading
+import time
+import uuid
+
+
+_current = contextvars.ContextVar('korasty_request_timer', default=None)
+
+PROFILE_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+class RequestTimer:
+    """Stage durations of one request; stages may be recorded from any thread"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def add(self, name, seconds):
+        with self._lock:
+            total, count = self._stages.get(name, (0.0, 0))
+            self._stages[name] = (total + seconds, count + 1)
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        """``Server-Timing`` header value: one metric per stage plus ``total``"""
+        with self._lock:
+            stages = list(self._stages.items())
+        metrics = [
+            f'{name};dur={total * 1000:.1f}' + (f';desc="x{count}"' if count > 1 else '')
+            for name, (total, count) in stages
+        ]
+        metrics.append(f'total;dur={self.elapsed() * 1000:.1f}')
+        return ', '.join(metrics)
+
+    def summary(self):
+        """``{'total_ms', 'stages': {name: {'ms', 'count'}}}`` for structured logs"""
+        with self._lock:
+            stages = {
+                name: {'ms': round(total * 1000, 1), 'count': count}
+                for name, (total, count) in self._stages.items()
+            }
+        return {'total_ms': round(self.elapsed() * 1000, 1), 'stages': stages}
+
+
+class _Stage:
+    __slots__ = ('timer', 'name', 'started')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.add(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class _NoStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_STAGE = _NoStage()
+
+
+def start_timer():
+    """Begin timing the request running in the current context"""
+    timer = RequestTimer()
+    _current.set(timer)
+    return timer
+
+
+def stop_timer():
+    _current.set(None)
+
+
+def timed_stage(name):
+    """Context manager adding the block's duration to stage ``name`` of the current request"""
+    timer = _current.get()
+    if timer is None:
+        return _NO_STAGE
+    return _Stage(timer, name)
+
+
+def record_stage(name, seconds):
+    """Add an already measured duration to stage ``name`` of the current request"""
+    timer = _current.get()
+    if timer is not None:
+        timer.add(name, seconds)
+
+
+class ProfileStore:
+    """cProfile captures of single requests, saved as ``<id>.prof`` under ``directory``.
+
+    One capture runs at a time (a second request asking for one is served
+    unprofiled) and only the newest ``keep`` captures are kept.
+    """
+
+    def __init__(self, directory, keep=20):
+        self.directory = directory
+        self.keep = keep
+        self._busy = threading.Lock()
+
+    def start(self):
+        """Return a running profiler, or None while another capture is in progress"""
+        if not self._busy.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except Exception:
+            self._busy.release()
+            raise
+        return profiler
+
+    def cancel(self, profiler):
+        """Stop ``profiler`` without saving anything"""
+        try:
+            profiler.disable()
+        finally:
+            self._busy.release()
+
+    def finish(self, profiler):
+        """Stop ``profiler``, save the capture and return its id"""
+        self.cancel(profiler)
+        profile_id = uuid.uuid4().hex
+        os.makedirs(self.directory, exist_ok=True)
+        profiler.dump_stats(self.path(profile_id))
+        self._prune()
+        return profile_id
+
+    def path(self, profile_id):
+        return os.path.join(self.directory, f'{profile_id}.prof')
+
+    def exists(self, profile_id):
+        return bool(PROFILE_ID.match(profile_id)) and os.path.exists(self.path(profile_id))
+
+    def report(self, profile_id, limit=40, sort='cumulative'):
+        """Text table of the capture's top ``limit`` functions, or None if unknown"""
+        if not self.exists(profile_id):
+            return None
+        out = io.StringIO()
+        stats = pstats.Stats(self.path(profile_id), stream=out)
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def _prune(self):
+        try:
+            names = [name for name in os.listdir(self.directory) if name.endswith('.prof')]
+        except OSError:
+            return
+        if len(names) <= self.keep:
+            return
+        paths = sorted(
+            (os.path.join(self.directory, name) for name in names), key=os.path.getmtime, reverse=True
+        )
+        for path in paths[self.keep:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,158 @@
+# Korasty AI - Result Cache
+# Content-addressed cache for generated results: a small in-memory LRU tier in
+# front of a persistent SQLite tier, with TTLs and size-based eviction.
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_content(content):
+    """Collapse whitespace so cosmetic differences map to the same key"""
+    return ' '.join(content.split())
+
+
+def make_cache_key(namespace, content, options=None, model_name=''):
+    """Build a cache key from the endpoint, content hash, options and model"""
+    content_hash = hashlib.sha256(normalize_content(content).encode('utf-8')).hexdigest()
+    payload = json.dumps(
+        [namespace, content_hash, options or {}, model_name],
+        sort_keys=True,
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """Two-tier cache for JSON-serializable results.
+
+    Values returned from ``get`` are shared with the memory tier and must be
+    treated as read-only by callers.
+    """
+
+    def __init__(self, db_path, max_memory_entries=256, max_disk_bytes=256 * 1024 * 1024,
+                 default_ttl=7 * 24 * 3600):
+        self.db_path = db_path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.default_ttl = default_ttl
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (expires_at, value)
+        self._counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'sets': 0, 'evictions': 0}
+
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            ' key TEXT PRIMARY KEY,'
+            ' value TEXT NOT NULL,'
+            ' size INTEGER NOT NULL,'
+            ' expires_at REAL NOT NULL,'
+            ' accessed_at REAL NOT NULL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed_at)')
+        self._db.commit()
+
+    def get(self, key, count=True):
+        """Return a cached value or None on a miss or expiry.
+
+        ``count=False`` leaves the hit/miss counters alone, for callers that
+        poll for a value another worker is producing.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    if count:
+                        self._counters['memory_hits'] += 1
+                    return entry[1]
+                del self._memory[key]
+
+            row = self._db.execute(
+                'SELECT value, expires_at FROM results WHERE key = ?', (key,)
+            ).fetchone()
+
+            if row is None or row[1] <= now:
+                if row is not None:
+                    self._db.execute('DELETE FROM results WHERE key = ?', (key,))
+                    self._db.commit()
+                if count:
+                    self._counters['misses'] += 1
+                return None
+
+            self._db.execute('UPDATE results SET accessed_at = ? WHERE key = ?', (now, key))
+            self._db.commit()
+            value = json.loads(row[0])
+            self._remember(key, row[1], value)
+            if count:
+                self._counters['disk_hits'] += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store a value in both tiers"""
+        now = time.time()
+        expires_at = now + (ttl if ttl is not None else self.default_ttl)
+        encoded = json.dumps(value, ensure_ascii=False)
+
+        with self._lock:
+            self._remember(key, expires_at, value)
+            self._db.execute(
+                'INSERT OR REPLACE INTO results (key, value, size, expires_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (key, encoded, len(encoded.encode('utf-8')), expires_at, now)
+            )
+            self._counters['sets'] += 1
+            self._evict_disk(now)
+            self._db.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._memory.pop(key, None)
+            self._db.execute('DELETE FROM results WHERE key = ?', (key,))
+            self._db.commit()
+
+    def stats(self):
+        """Return hit/miss counters and tier occupancy"""
+        with self._lock:
+            entries, size = self._db.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results'
+            ).fetchone()
+            lookups = self._counters['memory_hits'] + self._counters['disk_hits'] + self._counters['misses']
+            hits = self._counters['memory_hits'] + self._counters['disk_hits']
+            return dict(
+                self._counters,
+                hit_ratio=round(hits / lookups, 4) if lookups else 0.0,
+                memory_entries=len(self._memory),
+                disk_entries=entries,
+                disk_bytes=size
+            )
+
+    def _remember(self, key, expires_at, value):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self, now):
+        """Drop expired rows, then least recently used rows over the size budget"""
+        self._db.execute('DELETE FROM results WHERE expires_at <= ?', (now,))
+        total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if total <= self.max_disk_bytes:
+            return
+
+        rows = self._db.execute('SELECT key, size FROM results ORDER BY accessed_at').fetchall()
+        for key, size in rows:
+            if total <= self.max_disk_bytes:
+                break
+            self._db.execute('DELETE FROM results WHERE key = ?', (key,))
+            self._memory.pop(key, None)
+            total -= size
+            self._counters['evictions'] += 1
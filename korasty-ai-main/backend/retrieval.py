@@ -0,0 +1,272 @@
+# Korasty AI - Retrieval Index
+# Splits sources into chunks and ranks them with BM25 so chat prompts only
+# carry the passages relevant to the current question.
+
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+
+
+# Harakat, tanween, shadda, sukun, superscript alef and Quranic marks
+ARABIC_DIACRITICS = re.compile(r'[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed]')
+TATWEEL = '\u0640'
+ALEF_VARIANTS = re.compile(r'[\u0622\u0623\u0625\u0671]')
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+ARABIC_LETTERS = re.compile(r'^[\u0621-\u064a]+$')
+
+# Checked longest first; a stem must keep at least two letters
+ARABIC_PREFIXES = ('وال', 'بال', 'كال', 'فال', 'لل', 'ال', 'و')
+ARABIC_SUFFIXES = ('ها', 'ان', 'ات', 'ون', 'ين', 'يه', 'ه', 'ي')
+
+ARABIC_STOPWORDS = {
+    'في', 'من', 'علي', 'الي', 'عن', 'مع', 'هذا', 'هذه', 'ذلك', 'تلك', 'التي',
+    'الذي', 'الذين', 'ما', 'ماذا', 'لماذا', 'كيف', 'هل', 'او', 'ام', 'ثم', 'لا',
+    'لم', 'لن', 'قد', 'كان', 'كانت', 'ان', 'انه', 'انها', 'هو', 'هي', 'هم',
+    'نحن', 'انا', 'انت', 'كل', 'بعض', 'عند', 'بين', 'حتي', 'اذا', 'لي', 'له', 'لها'
+}
+ENGLISH_STOPWORDS = {
+    'the', 'a', 'an', 'of', 'to', 'in', 'and', 'or', 'is', 'are', 'was', 'were',
+    'for', 'on', 'with', 'as', 'by', 'at', 'it', 'this', 'that', 'what', 'how'
+}
+
+
+def normalize_arabic(text):
+    """Strip tashkeel and tatweel and unify alef, yaa and taa marbuta forms"""
+    text = ARABIC_DIACRITICS.sub('', text)
+    text = text.replace(TATWEEL, '')
+    text = ALEF_VARIANTS.sub('ا', text)
+    text = text.replace('ى', 'ي')  # alef maqsura -> yaa
+    text = text.replace('ة', 'ه')  # taa marbuta -> haa
+    return text.lower()
+
+
+def light_stem(token):
+    """Remove common Arabic prefixes and suffixes (light stemming)"""
+    if not ARABIC_LETTERS.match(token):
+        return token
+
+    for prefix in ARABIC_PREFIXES:
+        if token.startswith(prefix) and len(token) - len(prefix) >= 2:
+            token = token[len(prefix):]
+            break
+
+    for suffix in ARABIC_SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 2:
+            token = token[:-len(suffix)]
+            break
+
+    return token
+
+
+def tokenize(text):
+    """Normalize, split and stem text into index terms"""
+    terms = []
+    for token in TOKEN_PATTERN.findall(normalize_arabic(text)):
+        if token in ARABIC_STOPWORDS or token in ENGLISH_STOPWORDS:
+            continue
+        stem = light_stem(token)
+        if len(stem) > 1 or stem.isdigit():
+            terms.append(stem)
+    return terms
+
+
+def chunk_text(text, chunk_chars=1200, overlap_chars=150):
+    """Split text into paragraph-aligned chunks of roughly ``chunk_chars``.
+
+    Paragraphs longer than a chunk are cut into overlapping windows so no
+    passage is lost at a boundary.
+    """
+    paragraphs = [p.strip() for p in re.split(r'\n\s*\n', text) if p.strip()]
+
+    pieces = []
+    step = max(1, chunk_chars - overlap_chars)
+    for paragraph in paragraphs:
+        if len(paragraph) <= chunk_chars:
+            pieces.append(paragraph)
+            continue
+        for start in range(0, len(paragraph), step):
+            pieces.append(paragraph[start:start + chunk_chars])
+            if start + chunk_chars >= len(paragraph):
+                break
+
+    chunks = []
+    current = []
+    current_len = 0
+    for piece in pieces:
+        if current and current_len + len(piece) > chunk_chars:
+            chunks.append('\n\n'.join(current))
+            current = []
+            current_len = 0
+        current.append(piece)
+        current_len += len(piece) + 2
+
+    if current:
+        chunks.append('\n\n'.join(current))
+
+    return chunks
+
+
+class RetrievalIndex:
+    """Incremental BM25 inverted index over source chunks.
+
+    Sources are indexed once per ``source_id`` and kept in LRU order; when more
+    than ``max_sources`` are indexed the least recently used one is dropped and
+    will simply be re-indexed on its next use.
+    """
+
+    def __init__(self, chunk_chars=1200, overlap_chars=150, max_sources=64,
+                 k1=1.5, b=0.75):
+        self.chunk_chars = chunk_chars
+        self.overlap_chars = overlap_chars
+        self.max_sources = max_sources
+        self.k1 = k1
+        self.b = b
+
+        self._lock = threading.Lock()
+        self._sources = OrderedDict()  # source_id -> [chunk_key, ...]
+        self._chunks = {}              # chunk_key -> (text, length, terms)
+        self._postings = {}            # term -> {chunk_key: term frequency}
+        self._lengths = {}             # source_id -> total length of its chunks
+        self._total_length = 0
+
+    def has_source(self, source_id):
+        with self._lock:
+            return source_id in self._sources
+
+    def add_source(self, source_id, text):
+        """Index a source unless it is already indexed"""
+        with self._lock:
+            if source_id in self._sources:
+                self._sources.move_to_end(source_id)
+                return
+
+        # Tokenize outside the lock; this is the expensive part
+        indexed = []
+        for position, chunk in enumerate(chunk_text(text, self.chunk_chars, self.overlap_chars)):
+            indexed.append(((source_id, position), chunk, Counter(tokenize(chunk))))
+
+        with self._lock:
+            if source_id in self._sources:
+                return
+
+            keys = []
+            source_length = 0
+            for key, chunk, counts in indexed:
+                length = sum(counts.values())
+                self._chunks[key] = (chunk, length, tuple(counts))
+                source_length += length
+                for term, tf in counts.items():
+                    self._postings.setdefault(term, {})[key] = tf
+                keys.append(key)
+            self._sources[source_id] = keys
+            self._lengths[source_id] = source_length
+            self._total_length += source_length
+
+            while len(self._sources) > self.max_sources:
+                old_id = next(iter(self._sources))
+                self._remove_locked(old_id)
+
+    def remove_source(self, source_id):
+        with self._lock:
+            self._remove_locked(source_id)
+
+    def _remove_locked(self, source_id):
+        keys = self._sources.pop(source_id, None)
+        self._lengths.pop(source_id, None)
+        if not keys:
+            return
+
+        for key in keys:
+            _, length, terms = self._chunks.pop(key)
+            self._total_length -= length
+            for term in terms:
+                postings = self._postings.get(term)
+                if postings is None:
+                    continue
+                postings.pop(key, None)
+                if not postings:
+                    del self._postings[term]
+
+    def search(self, query, source_ids=None, top_k=8):
+        """Return ``[(score, source_id, position, text), ...]`` best first.
+
+        Chunk count, average length and document frequencies are taken over
+        the searched sources only, so scores do not depend on other users'
+        sources sharing the index.
+        """
+        terms = set(tokenize(query))
+        allowed = set(source_ids) if source_ids is not None else None
+
+        with self._lock:
+            if allowed is None:
+                total_chunks = len(self._chunks)
+                total_length = self._total_length
+            else:
+                allowed &= self._sources.keys()
+                for source_id in allowed:
+                    self._sources.move_to_end(source_id)
+                total_chunks = sum(len(self._sources[source_id]) for source_id in allowed)
+                total_length = sum(self._lengths[source_id] for source_id in allowed)
+
+            if not total_chunks or not terms:
+                return []
+            avg_length = total_length / total_chunks or 1.0
+
+            scores = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                if allowed is not None:
+                    postings = {key: tf for key, tf in postings.items() if key[0] in allowed}
+                    if not postings:
+                        continue
+                df = len(postings)
+                idf = math.log(1 + (total_chunks - df + 0.5) / (df + 0.5))
+                for key, tf in postings.items():
+                    length = self._chunks[key][1]
+                    norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+                    scores[key] = scores.get(key, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+            best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+            return [(score, key[0], key[1], self._chunks[key][0]) for key, score in best]
+
+    def first_chunks(self, source_ids, limit):
+        """Return the opening chunks of the given sources (fallback context)"""
+        with self._lock:
+            results = []
+            for source_id in source_ids:
+                for key in self._sources.get(source_id, [])[:limit]:
+                    results.append((0.0, key[0], key[1], self._chunks[key][0]))
+            return results[:limit]
+
+    def select_context(self, query, source_ids, top_k=8, char_budget=12000,
+                       separator='\n\n...\n\n'):
+        """Pick the best chunks for a query and join them in document order"""
+        hits = self.search(query, source_ids, top_k)
+        if not hits:
+            hits = self.first_chunks(source_ids, top_k)
+
+        selected = []
+        used = 0
+        for hit in hits:
+            text = hit[3]
+            if used + len(text) > char_budget:
+                if selected:
+                    continue
+                text = text[:char_budget]
+            selected.append((hit[1], hit[2], text))
+            used += len(text) + len(separator)
+
+        order = {source_id: i for i, source_id in enumerate(source_ids)}
+        selected.sort(key=lambda item: (order.get(item[0], 0), item[1]))
+        return separator.join(text for _, _, text in selected)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sources': len(self._sources),
+                'chunks': len(self._chunks),
+                'terms': len(self._postings)
+            }
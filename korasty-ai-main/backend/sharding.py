@@ -0,0 +1,129 @@
+# Korasty AI - Sharded Generation
+# Count-based studio artifacts (flashcards, quiz questions, slides) are split
+# into shards of a few items, each generated in parallel from its own section
+# of the content. Shards are retried individually and merged back in section
+# order, dropping items that repeat an earlier one.
+
+import logging
+import math
+from concurrent.futures import as_completed
+
+from preprocess import comparison_key
+from retrieval import chunk_text
+from upstream import with_retries
+
+
+logger = logging.getLogger(__name__)
+
+
+def split_sections(content, parts):
+    """Cut ``content`` into ``parts`` contiguous, paragraph-aligned sections of similar size"""
+    pieces = chunk_text(content, chunk_chars=max(1, len(content) // (parts * 4)), overlap_chars=0)
+    remaining = sum(len(piece) for piece in pieces)
+    sections = []
+    current = []
+    current_len = 0
+    for index, piece in enumerate(pieces):
+        # Each section aims at an equal share of what is left, so no tail is starved
+        target = remaining / (parts - len(sections))
+        if current and current_len + len(piece) / 2 > target and len(sections) < parts - 1:
+            sections.append('\n\n'.join(current))
+            remaining -= current_len
+            current = []
+            current_len = 0
+        current.append(piece)
+        current_len += len(piece)
+    if current:
+        sections.append('\n\n'.join(current))
+    return sections
+
+
+def plan_shards(count, content, items_per_shard, min_section_chars):
+    """Return ``[(items, section)]``: ``count`` items spread over content sections.
+
+    Uses ``ceil(count / items_per_shard)`` shards, fewer when the content is
+    too short to give each shard ``min_section_chars`` of its own; a single
+    shard means "generate as usual".
+    """
+    shards = min(math.ceil(count / items_per_shard), len(content) // max(1, min_section_chars))
+    if shards <= 1:
+        return [(count, content)]
+    sections = split_sections(content, shards)
+    base, extra = divmod(count, len(sections))
+    return [(base + (1 if index < extra else 0), section) for index, section in enumerate(sections)]
+
+
+def _words(text):
+    return set(comparison_key(text).split())
+
+
+def similarity(a, b):
+    """Jaccard similarity of the two texts' normalized word sets"""
+    words_a, words_b = _words(a), _words(b)
+    if not words_a or not words_b:
+        return 1.0 if words_a == words_b else 0.0
+    return len(words_a & words_b) / len(words_a | words_b)
+
+
+def dedupe_items(items, item_text, threshold):
+    """Keep items in order, dropping any at least ``threshold`` similar to one kept"""
+    kept = []
+    kept_texts = []
+    for item in items:
+        text = item_text(item)
+        if any(similarity(text, other) >= threshold for other in kept_texts):
+            continue
+        kept.append(item)
+        kept_texts.append(text)
+    return kept
+
+
+def merge_shards(results, items_key, item_text, threshold):
+    """Merge per-shard artifact data (section order; None for failed shards).
+
+    ``items_key`` names the list inside the artifact (None: the artifact is
+    the list); the other fields come from the first shard that succeeded.
+    Returns ``(data, removed)`` where ``removed`` counts dropped duplicates.
+    """
+    merged = None
+    items = []
+    for data in results:
+        if data is None:
+            continue
+        if items_key is None:
+            items.extend(data)
+            continue
+        if merged is None:
+            merged = dict(data)
+        items.extend(data.get(items_key) or [])
+
+    kept = dedupe_items(items, item_text, threshold)
+    if items_key is None:
+        return kept, len(items) - len(kept)
+    merged[items_key] = kept
+    return merged, len(items) - len(kept)
+
+
+def generate_shards(shards, generate_shard, executor, retries=1, backoff=0.5):
+    """Run ``generate_shard(index, items, section)`` for every planned shard on ``executor``.
+
+    Each shard is retried on its own. Returns ``(results, failures)``:
+    results in shard order (None where a shard failed) and ``{index: error}``.
+    """
+    def run(index, items, section):
+        return with_retries(lambda: generate_shard(index, items, section), retries, backoff)
+
+    futures = {
+        executor.submit(run, index, items, section): index
+        for index, (items, section) in enumerate(shards)
+    }
+    results = [None] * len(shards)
+    failures = {}
+    for future in as_completed(futures):
+        index = futures[future]
+        try:
+            results[index] = future.result()
+        except Exception as e:
+            logger.error(f"Shard {index + 1}/{len(shards)} failed: {str(e)}")
+            failures[index] = e
+    return results, failures
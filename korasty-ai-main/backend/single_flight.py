@@ -0,0 +1,216 @@
+# Korasty AI - Single-Flight Request Coalescing
+# Concurrent requests for the same key share one in-progress generation: the
+# first caller runs it and the rest wait for its result. With a lock directory
+# the same holds across gunicorn workers, where waiters pick the result up from
+# the shared cache once the worker holding the key's lock file finishes.
+
+import asyncio
+import inspect
+import logging
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _FileLock:
+    """Exclusive, non-blocking flock on ``<lock_dir>/<key>.lock``.
+
+    The holder unlinks the file before unlocking, so acquiring re-checks that
+    the locked file is still the one on disk.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def try_acquire(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        try:
+            same_file = os.fstat(fd).st_ino == os.stat(self.path).st_ino
+        except FileNotFoundError:
+            same_file = False
+        if not same_file:
+            os.close(fd)
+            return False
+        self.fd = fd
+        return True
+
+    def release(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        os.close(self.fd)  # closing drops the flock
+        self.fd = None
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one execution.
+
+    ``do(key, fn, lookup)`` returns ``(result, shared)``; ``shared`` is True
+    when another caller did the work. In-process waiters get the leader's
+    result (or its exception). If ``lock_dir`` is set, a leader also holds a
+    per-key lock file; callers in other processes poll ``lookup()`` (the
+    shared cache, read without counting misses) until the lock is released, then run ``fn`` themselves only
+    if nothing was stored. ``lock_timeout`` bounds that wait.
+    """
+
+    def __init__(self, lock_dir=None, poll_interval=0.1, lock_timeout=300):
+        if lock_dir and fcntl is None:
+            logger.warning('File locks are not supported here; coalescing is per process only')
+            lock_dir = None
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+        self.lock_dir = lock_dir
+        self.poll_interval = poll_interval
+        self.lock_timeout = lock_timeout
+
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}
+        self._counters = {'leaders': 0, 'followers': 0, 'cross_process': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _file_lock(self, key):
+        return _FileLock(os.path.join(self.lock_dir, f'{key}.lock')) if self.lock_dir else None
+
+    def do(self, key, fn, lookup=None):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._counters['leaders'] += 1
+            else:
+                self._counters['followers'] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result, shared = self._run_locked(key, fn, lookup)
+            return call.result, shared
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _run_locked(self, key, fn, lookup):
+        file_lock = self._file_lock(key)
+        if file_lock is None:
+            return fn(), False
+
+        deadline = time.monotonic() + self.lock_timeout
+        waited = False
+        while not file_lock.try_acquire():
+            waited = True
+            if time.monotonic() > deadline:
+                return fn(), False
+            time.sleep(self.poll_interval)
+            result = lookup() if lookup else None
+            if result is not None:
+                self._count('cross_process')
+                return result, True
+
+        try:
+            # Another worker may have finished between our checks and the lock
+            result = lookup() if (waited and lookup) else None
+            if result is not None:
+                self._count('cross_process')
+                return result, True
+            return fn(), False
+        finally:
+            file_lock.release()
+
+    async def do_async(self, key, fn, lookup=None):
+        """Async counterpart of ``do``; ``fn`` is a coroutine function"""
+        while key in self._async_calls:
+            future = self._async_calls[key]
+            self._count('followers')
+            try:
+                return await asyncio.shield(future), True
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The leader's request went away; take over
+
+        self._count('leaders')
+        future = self._async_calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result, shared = await self._run_locked_async(key, fn, lookup)
+            future.set_result(result)
+            return result, shared
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an unobserved failure is not logged as lost
+            future.exception()
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+            del self._async_calls[key]
+
+    @staticmethod
+    async def _lookup_async(lookup):
+        # ``lookup`` may itself be async (e.g. a cache read run off the loop)
+        result = lookup() if lookup else None
+        return await result if inspect.isawaitable(result) else result
+
+    async def _run_locked_async(self, key, fn, lookup):
+        file_lock = self._file_lock(key)
+        if file_lock is None:
+            return await fn(), False
+
+        deadline = time.monotonic() + self.lock_timeout
+        waited = False
+        while not file_lock.try_acquire():
+            waited = True
+            if time.monotonic() > deadline:
+                return await fn(), False
+            await asyncio.sleep(self.poll_interval)
+            result = await self._lookup_async(lookup)
+            if result is not None:
+                self._count('cross_process')
+                return result, True
+
+        try:
+            result = await self._lookup_async(lookup) if waited else None
+            if result is not None:
+                self._count('cross_process')
+                return result, True
+            return await fn(), False
+        finally:
+            file_lock.release()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, in_flight=len(self._calls) + len(self._async_calls))
@@ -0,0 +1,190 @@
+# Korasty AI - Source Store
+# Keeps extracted source text on the server so clients can reference it by id
+# instead of re-sending the whole corpus with every request.
+
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+
+SOURCE_ID_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+def make_source_id(text):
+    """Return the content hash used as a source id"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def is_valid_source_id(source_id):
+    """Check that a source id is a well-formed content hash"""
+    return isinstance(source_id, str) and bool(SOURCE_ID_PATTERN.match(source_id))
+
+
+class SourceStore:
+    """Bounded LRU store for source text, written through to ``spill_dir``.
+
+    Every source is written to disk when it is stored, and the directory is
+    the record shared by all worker processes: a memory miss falls back to
+    the file even if another process wrote it, and a source whose file is
+    gone (deleted or evicted by any process) is gone everywhere. Memory only
+    holds recently used texts; when the disk budget is exceeded the oldest
+    files this process knows of are deleted.
+    """
+
+    def __init__(self, spill_dir, max_memory_bytes=64 * 1024 * 1024,
+                 max_disk_bytes=1024 * 1024 * 1024):
+        self.spill_dir = spill_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # source_id -> text
+        self._memory_sizes = {}       # source_id -> encoded size
+        self._memory_bytes = 0
+        self._disk = OrderedDict()    # source_id -> encoded size
+        self._disk_bytes = 0
+
+        os.makedirs(spill_dir, exist_ok=True)
+        self._load_disk_index()
+
+    def _path(self, source_id):
+        return os.path.join(self.spill_dir, f'{source_id}.txt')
+
+    def _load_disk_index(self):
+        """Rebuild the disk LRU order from file modification times"""
+        entries = []
+        for name in os.listdir(self.spill_dir):
+            source_id, ext = os.path.splitext(name)
+            if ext != '.txt' or not is_valid_source_id(source_id):
+                continue
+            stat = os.stat(os.path.join(self.spill_dir, name))
+            entries.append((stat.st_mtime, source_id, stat.st_size))
+
+        for _, source_id, size in sorted(entries):
+            self._disk[source_id] = size
+            self._disk_bytes += size
+
+    def put(self, text):
+        """Store text and return its source id"""
+        source_id = make_source_id(text)
+        with self._lock:
+            self._write(source_id, text)
+            if source_id in self._memory:
+                self._memory.move_to_end(source_id)
+                return source_id
+            self._remember(source_id, text)
+        return source_id
+
+    def get(self, source_id):
+        """Return the text for a source id, or None if it is unknown"""
+        if not is_valid_source_id(source_id):
+            return None
+
+        path = self._path(source_id)
+        with self._lock:
+            text = self._memory.get(source_id)
+            if text is not None:
+                if os.path.exists(path):
+                    self._memory.move_to_end(source_id)
+                    return text
+                # Deleted or evicted by another process
+                self._forget_memory(source_id)
+                self._forget_disk(source_id)
+                return None
+
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except OSError:
+                self._forget_disk(source_id)
+                return None
+
+            # The file may have been written by another process
+            if source_id in self._disk:
+                self._disk.move_to_end(source_id)
+            else:
+                self._index(source_id, len(data))
+            text = data.decode('utf-8')
+            self._remember(source_id, text)
+            return text
+
+    def contains(self, source_id):
+        """Check whether a source id is known without loading it"""
+        return is_valid_source_id(source_id) and os.path.exists(self._path(source_id))
+
+    def delete(self, source_id):
+        """Remove a source from both tiers"""
+        if not is_valid_source_id(source_id):
+            return False
+
+        with self._lock:
+            found = os.path.exists(self._path(source_id))
+            self._forget_memory(source_id)
+            self._forget_disk(source_id)
+            return found
+
+    def stats(self):
+        """Return store occupancy figures"""
+        with self._lock:
+            return {
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'disk_entries': len(self._disk),
+                'disk_bytes': self._disk_bytes
+            }
+
+    def _remember(self, source_id, text):
+        """Insert into the memory tier and spill anything over budget"""
+        size = len(text.encode('utf-8'))
+        self._memory[source_id] = text
+        self._memory_sizes[source_id] = size
+        self._memory_bytes += size
+
+        # Everything in memory is already on disk
+        while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+            old_id, _ = self._memory.popitem(last=False)
+            self._memory_bytes -= self._memory_sizes.pop(old_id)
+
+    def _forget_memory(self, source_id):
+        if self._memory.pop(source_id, None) is not None:
+            self._memory_bytes -= self._memory_sizes.pop(source_id)
+
+    def _write(self, source_id, text):
+        """Write an entry to disk unless it is already there"""
+        path = self._path(source_id)
+        if os.path.exists(path):
+            if source_id in self._disk:
+                self._disk.move_to_end(source_id)
+            else:
+                self._index(source_id, os.path.getsize(path))
+            return
+
+        # Per-process temp name: workers may store the same source at once
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        data = text.encode('utf-8')
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        self._index(source_id, len(data))
+
+    def _index(self, source_id, size):
+        """Track a file in the disk LRU and delete the oldest over budget"""
+        self._disk_bytes -= self._disk.pop(source_id, 0)
+        self._disk[source_id] = size
+        self._disk_bytes += size
+
+        while self._disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+            old_id = next(iter(self._disk))
+            self._forget_memory(old_id)
+            self._forget_disk(old_id)
+
+    def _forget_disk(self, source_id):
+        size = self._disk.pop(source_id, 0)
+        self._disk_bytes -= size
+        try:
+            os.remove(self._path(source_id))
+        except OSError:
+            pass
@@ -0,0 +1,197 @@
+# Korasty AI - Structured Output
+# Response schemas for the JSON studio artifacts (sent to Gemini as
+# response_schema), a tolerant JSON parser that repairs fenced or truncated
+# output, a small schema validator and counters for parse failures.
+
+import json
+import threading
+
+
+def _object(properties, required=None):
+    return {
+        'type': 'object',
+        'properties': properties,
+        'required': list(required if required is not None else properties)
+    }
+
+
+def _array(items):
+    return {'type': 'array', 'items': items}
+
+
+STRING = {'type': 'string'}
+
+# Full response shapes, wrapped in the result key each prompt already asks for
+ARTIFACT_SCHEMAS = {
+    'flashcards': _object({
+        'flashcards': _array(_object({'question': STRING, 'answer': STRING}))
+    }),
+    'quiz': _object({
+        'quiz': _object({
+            'title': STRING,
+            'questions': _array(_object({
+                'question': STRING,
+                'options': _array(STRING),
+                'correctIndex': {'type': 'integer'},
+                'explanation': STRING
+            }))
+        })
+    }),
+    'mindmap': _object({
+        'mindmap': _object({
+            'title': STRING,
+            'branches': _array(_object({
+                'name': STRING,
+                'children': _array(_object({'name': STRING}))
+            }, required=['name']))
+        })
+    }),
+    'slides': _object({
+        'presentation': _object({
+            'title': STRING,
+            'slides': _array(_object({
+                'title': STRING,
+                'points': _array(STRING),
+                'speakerNotes': STRING
+            }, required=['title', 'points']))
+        })
+    }),
+    'infographic': _object({
+        'infographic': _object({
+            'title': STRING,
+            'subtitle': STRING,
+            'points': _array(_object({'icon': STRING, 'title': STRING, 'description': STRING})),
+            'stats': _array(_object({'value': STRING, 'label': STRING})),
+            'conclusion': STRING
+        }, required=['title', 'points', 'conclusion'])
+    })
+}
+
+_JSON_TYPES = {
+    'object': dict,
+    'array': list,
+    'string': str,
+    'integer': int,
+    'number': (int, float),
+    'boolean': bool
+}
+
+_CLOSERS = {'{': '}', '[': ']'}
+
+
+def _truncation_candidates(text):
+    """Yield prefixes of truncated JSON closed at the last complete values, newest first"""
+    stack = []
+    in_string = False
+    escaped = False
+    cuts = []  # (end index, open brackets at that point)
+
+    for index, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            in_string = True
+        elif char in '{[':
+            stack.append(char)
+        elif char in '}]':
+            if stack:
+                stack.pop()
+            cuts.append((index + 1, tuple(stack)))
+        elif char == ',':
+            cuts.append((index, tuple(stack)))
+
+    if in_string:
+        # Truncated inside a string: close it and everything still open
+        cuts.append((len(text), ('"',) + tuple(stack)))
+
+    for end, open_brackets in reversed(cuts[-64:]):
+        if open_brackets and open_brackets[0] == '"':
+            closing = '"' + ''.join(_CLOSERS[b] for b in reversed(open_brackets[1:]))
+        else:
+            closing = ''.join(_CLOSERS[b] for b in reversed(open_brackets))
+        yield text[:end] + closing
+
+
+def parse_json_response(text, schema=None):
+    """Parse a model's JSON reply; returns ``(data, repaired)``.
+
+    Tries the raw text first (schema-constrained output is plain JSON), then
+    the outermost ``{...}`` (code fences, leading prose), then closes a
+    truncated object at its last complete value, preferring the longest
+    prefix that satisfies ``schema`` (dropping a half-written last item).
+    ``data`` is None when nothing parses.
+    """
+    text = (text or '').strip()
+    try:
+        return json.loads(text), False
+    except ValueError:
+        pass
+
+    start = text.find('{')
+    if start < 0:
+        return None, False
+    end = text.rfind('}')
+    if end > start:
+        try:
+            return json.loads(text[start:end + 1]), True
+        except ValueError:
+            pass
+
+    fallback = None
+    for candidate in _truncation_candidates(text[start:]):
+        try:
+            data = json.loads(candidate)
+        except ValueError:
+            continue
+        if schema is None or not validate(data, schema):
+            return data, True
+        if fallback is None:
+            fallback = data
+    return fallback, fallback is not None
+
+
+def validate(data, schema, path='$'):
+    """Return a list of human-readable schema violations (empty when valid)"""
+    expected = _JSON_TYPES[schema['type']]
+    if not isinstance(data, expected) or (schema['type'] in ('integer', 'number') and isinstance(data, bool)):
+        return [f"{path}: expected {schema['type']}"]
+
+    errors = []
+    if schema['type'] == 'object':
+        for name in schema.get('required', []):
+            if name not in data:
+                errors.append(f'{path}.{name}: missing')
+        for name, child in schema.get('properties', {}).items():
+            if name in data:
+                errors.extend(validate(data[name], child, f'{path}.{name}'))
+    elif schema['type'] == 'array':
+        for index, item in enumerate(data):
+            errors.extend(validate(item, schema['items'], f'{path}[{index}]'))
+            if len(errors) > 20:
+                break
+    return errors
+
+
+class ParseStats:
+    """Thread-safe per-artifact counters for JSON parsing outcomes"""
+
+    OUTCOMES = ('valid', 'repaired', 'reasked', 'recovered', 'failed')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def record(self, artifact_type, outcome):
+        with self._lock:
+            counts = self._counts.setdefault(artifact_type, dict.fromkeys(self.OUTCOMES, 0))
+            counts[outcome] += 1
+
+    def stats(self):
+        with self._lock:
+            return {artifact_type: dict(counts) for artifact_type, counts in self._counts.items()}
@@ -0,0 +1,403 @@
+# Korasty AI - Stub Model Provider
+# Offline stand-in for Gemini with the same interface as ModelPool: simulated
+# latency distributions, streaming, injected upstream errors, cached contexts
+# and canned JSON for every studio artifact, so load tests never spend API quota.
+
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from types import SimpleNamespace
+
+from google.api_core import exceptions as api_exceptions
+
+
+# Canned studio answers, keyed by the result key each prompt and schema names
+CANNED_JSON = {
+    'flashcards': {'flashcards': [
+        {'question': f'ما المفهوم رقم {i}؟', 'answer': f'شرح موجز للمفهوم رقم {i}.'} for i in range(1, 11)
+    ]},
+    'quiz': {'quiz': {'title': 'اختبار قصير', 'questions': [
+        {
+            'question': f'السؤال رقم {i}؟',
+            'options': ['الخيار الأول', 'الخيار الثاني', 'الخيار الثالث', 'الخيار الرابع'],
+            'correctIndex': i % 4,
+            'explanation': 'لأن النص يذكر ذلك صراحة.'
+        } for i in range(1, 6)
+    ]}},
+    'mindmap': {'mindmap': {'title': 'الموضوع الرئيسي', 'branches': [
+        {'name': f'الفرع {i}', 'children': [{'name': f'فكرة {i}.{j}'} for j in range(1, 4)]} for i in range(1, 5)
+    ]}},
+    'presentation': {'presentation': {'title': 'عرض تقديمي', 'slides': [
+        {'title': f'الشريحة {i}', 'points': ['النقطة الأولى', 'النقطة الثانية', 'النقطة الثالثة'],
+         'speakerNotes': 'ملاحظات المتحدث.'} for i in range(1, 7)
+    ]}},
+    'infographic': {'infographic': {
+        'title': 'إنفوجرافيك',
+        'subtitle': 'ملخص مرئي',
+        'points': [{'icon': '📌', 'title': f'نقطة {i}', 'description': 'وصف قصير.'} for i in range(1, 5)],
+        'stats': [{'value': '75%', 'label': 'نسبة'}, {'value': '12', 'label': 'عدد'}],
+        'conclusion': 'خلاصة الموضوع.'
+    }}
+}
+
+FILLER_TEXT = 'هذا نص تجريبي يولده النموذج البديل لمحاكاة رد حقيقي من النموذج أثناء اختبارات الأداء. '
+
+UPSTREAM_ERRORS = (
+    lambda: api_exceptions.ResourceExhausted('429 Resource has been exhausted (stub)'),
+    lambda: api_exceptions.ServiceUnavailable('503 The service is currently unavailable (stub)'),
+    lambda: api_exceptions.DeadlineExceeded('504 Deadline exceeded (stub)')
+)
+
+
+def parse_latency(spec, rng):
+    """Turn a latency spec into a sampler returning seconds.
+
+    ``0.5`` or ``fixed:0.5``, ``uniform:LOW,HIGH``, ``normal:MEAN,STDDEV`` or
+    ``lognormal:MEDIAN,SIGMA``.
+    """
+    kind, _, params = str(spec).partition(':')
+    if not params:
+        kind, params = 'fixed', kind
+    values = [float(v) for v in params.split(',')]
+
+    if kind == 'fixed':
+        return lambda: values[0]
+    if kind == 'uniform':
+        return lambda: rng.uniform(values[0], values[1])
+    if kind == 'normal':
+        return lambda: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == 'lognormal':
+        median = max(values[0], 1e-6)
+        return lambda: rng.lognormvariate(0, values[1]) * median
+    raise ValueError(f'Unknown latency distribution: {spec}')
+
+
+def _contents_size(contents):
+    """Characters of text plus bytes of inline data and uploaded files in a generate_content request"""
+    if isinstance(contents, str):
+        return len(contents)
+    if isinstance(contents, dict):
+        return len(contents.get('data', b'')) + len(contents.get('text', ''))
+    if isinstance(contents, (list, tuple)):
+        return sum(_contents_size(part) for part in contents)
+    return getattr(contents, 'size_bytes', 0)
+
+
+def _contents_text(contents):
+    if isinstance(contents, str):
+        return contents
+    if isinstance(contents, (list, tuple)):
+        return '\n'.join(part for part in contents if isinstance(part, str))
+    return ''
+
+
+def _sized(data, count, tag):
+    """Copy of a canned answer with its item list cycled to ``count`` distinct items"""
+    if isinstance(data, dict):
+        return {key: _sized(value, count, tag) for key, value in data.items()}
+    if not isinstance(data, list) or not data or not isinstance(data[0], dict):
+        return data
+    items = []
+    for i in range(count):
+        item = dict(data[i % len(data)])
+        field = next(key for key, value in item.items() if isinstance(value, str))
+        item[field] = f'{item[field]} [{tag}-{i + 1}]'
+        items.append(item)
+    return items
+
+
+def _usage(contents, reply, cached_tokens=0):
+    prompt_tokens = _contents_size(contents) // 4 + cached_tokens
+    return SimpleNamespace(
+        prompt_token_count=prompt_tokens,
+        cached_content_token_count=cached_tokens,
+        candidates_token_count=len(reply) // 4,
+        total_token_count=prompt_tokens + len(reply) // 4
+    )
+
+
+class StubResponse:
+    """The parts of a GenerateContentResponse the app reads"""
+
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class _StubStream:
+    """Iterable (sync and async) of response chunks with simulated pacing.
+
+    Like the observed Gemini clients, the observer hears about a stream once
+    it has been fully consumed.
+    """
+
+    def __init__(self, stub, chunks, usage, on_done):
+        self._stub = stub
+        self._chunks = chunks
+        self._usage = usage
+        self._on_done = on_done
+
+    def _responses(self):
+        for index, text in enumerate(self._chunks):
+            last = index == len(self._chunks) - 1
+            yield index, StubResponse(text, self._usage if last else None)
+
+    def __iter__(self):
+        for index, chunk in self._responses():
+            if index:
+                time.sleep(self._stub.chunk_interval)
+            yield chunk
+        self._on_done(chunk)
+
+    async def __aiter__(self):
+        for index, chunk in self._responses():
+            if index:
+                await asyncio.sleep(self._stub.chunk_interval)
+            yield chunk
+        self._on_done(chunk)
+
+
+class StubModel:
+    """Answers like a GenerativeModel after a sampled delay"""
+
+    def __init__(self, stub, api_key, cached_content=None):
+        self._stub = stub
+        self._api_key = api_key
+        self._cached_content = cached_content
+
+    def generate_content(self, contents, generation_config=None, stream=False, **kwargs):
+        return self._stub.call(contents, generation_config, stream, self._api_key, self._cached_content)
+
+    async def generate_content_async(self, contents, generation_config=None, stream=False, **kwargs):
+        return await self._stub.call_async(
+            contents, generation_config, stream, self._api_key, self._cached_content
+        )
+
+    def start_chat(self, history=None):
+        return StubChat(self, history)
+
+
+class StubChat:
+    """Minimal ChatSession: keeps history and sends it along with each message"""
+
+    def __init__(self, model, history=None):
+        self.model = model
+        self.history = list(history or [])
+
+    def _contents(self, content):
+        parts = [part for turn in self.history for part in turn.get('parts', [])]
+        self.history.append({'role': 'user', 'parts': [content]})
+        return parts + [content]
+
+    def send_message(self, content, stream=False, **kwargs):
+        return self.model.generate_content(self._contents(content), stream=stream)
+
+    async def send_message_async(self, content, stream=False, **kwargs):
+        return await self.model.generate_content_async(self._contents(content), stream=stream)
+
+
+class StubFileClient:
+    """File API stand-in: uploads are ACTIVE at once and nothing is stored"""
+
+    def create_file(self, fileobj, mime_type=None, **kwargs):
+        size = 0
+        while chunk := fileobj.read(1024 * 1024):
+            size += len(chunk)
+        return SimpleNamespace(
+            name=f'files/stub-{uuid.uuid4().hex}', mime_type=mime_type, state='ACTIVE', size_bytes=size
+        )
+
+    def get_file(self, name, **kwargs):
+        return SimpleNamespace(name=name, state='ACTIVE')
+
+    def delete_file(self, name, **kwargs):
+        pass
+
+
+class StubPool:
+    """Drop-in replacement for ModelPool backed by the stub model.
+
+    ``latency`` is sampled for whole replies and ``first_token_latency`` for
+    the first streamed chunk (see parse_latency); later chunks of
+    ``stream_chunk_chars`` arrive every ``chunk_interval`` seconds. A share
+    ``error_rate`` of calls fails with a 429/503/504 upstream error, and a key
+    starting more than ``key_rps`` calls within a second is answered 429 at
+    once, like a real per-key quota (0 disables it). Text
+    replies are ``output_chars`` long; JSON artifacts get their canned answer,
+    fenced in a code block unless a response schema was requested, with as
+    many items as the prompt's first line asks for.
+
+    Reading the prompt adds ``prefill_per_1k_tokens`` seconds per 1000 input
+    tokens before the first token (a tenth of that for tokens served from a
+    cached context), and whole (non-streamed) replies take
+    ``decode_per_1k_tokens`` seconds per 1000 output tokens. With ``context_caching`` off, creating a cached context
+    fails the way an unsupported model does.
+    """
+
+    def __init__(self, latency='lognormal:0.8,0.4', first_token_latency='lognormal:0.3,0.3',
+                 chunk_interval=0.02, stream_chunk_chars=80, error_rate=0.0, output_chars=2000,
+                 key_rps=0, prefill_per_1k_tokens=0.02, decode_per_1k_tokens=0.0, context_caching=True,
+                 seed=None, observer=None):
+        self._rng = random.Random(seed)
+        self.latency = parse_latency(latency, self._rng)
+        self.first_token_latency = parse_latency(first_token_latency, self._rng)
+        self.chunk_interval = chunk_interval
+        self.stream_chunk_chars = stream_chunk_chars
+        self.error_rate = error_rate
+        self.output_chars = output_chars
+        self.key_rps = key_rps
+        self.prefill_per_1k_tokens = prefill_per_1k_tokens
+        self.decode_per_1k_tokens = decode_per_1k_tokens
+        self.context_caching = context_caching
+        self.observer = observer
+
+        self._lock = threading.Lock()
+        self._counters = {'calls': 0, 'errors': 0, 'quota_exceeded': 0, 'cached_contexts': 0}
+        self._recent_calls = {}  # api key -> start times within the last second
+        self._contexts = {}  # cached context name -> (api key, tokens, expires_at)
+        self._file_client = StubFileClient()
+
+    def reply(self, contents, generation_config=None):
+        """The text the stub answers with for these contents"""
+        prompt = _contents_text(contents)
+        # Count-based prompts ("create 20 flashcards ...") get that many items
+        requested = re.search(r'\d+', prompt.split('\n', 1)[0])
+        tag = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:6]
+
+        def canned(data):
+            return _sized(data, int(requested.group()), tag) if requested else data
+
+        schema = (generation_config or {}).get('response_schema')
+        if schema:
+            key = next(iter(schema.get('properties', {})), None)
+            if key in CANNED_JSON:
+                return json.dumps(canned(CANNED_JSON[key]), ensure_ascii=False)
+
+        for key, data in CANNED_JSON.items():
+            if f'"{key}"' in prompt:
+                return '```json\n' + json.dumps(canned(data), ensure_ascii=False, indent=2) + '\n```'
+
+        repeats = self.output_chars // len(FILLER_TEXT) + 1
+        return ('# عنوان\n\n' + FILLER_TEXT * repeats)[:self.output_chars]
+
+    def _over_quota(self, api_key):
+        now = time.monotonic()
+        recent = self._recent_calls.setdefault(api_key, deque())
+        while recent and now - recent[0] > 1:
+            recent.popleft()
+        if len(recent) >= self.key_rps:
+            return True
+        recent.append(now)
+        return False
+
+    def _context_tokens(self, api_key, cached_content):
+        context = self._contexts.get(cached_content)
+        if context is None or context[0] != api_key or context[2] <= time.time():
+            return None
+        return context[1]
+
+    def _start(self, stream, api_key, contents, cached_content=None, generation_config=None):
+        """Count the call and decide its delay, whether it fails and its cached tokens"""
+        with self._lock:
+            self._counters['calls'] += 1
+            if self.key_rps and self._over_quota(api_key):
+                self._counters['quota_exceeded'] += 1
+                return 0.005, api_exceptions.ResourceExhausted('429 Quota exceeded for this key (stub)'), 0
+            cached_tokens = 0
+            if cached_content:
+                cached_tokens = self._context_tokens(api_key, cached_content)
+                if cached_tokens is None:
+                    return 0.005, api_exceptions.NotFound(f'404 CachedContent not found: {cached_content} (stub)'), 0
+            delay = self.first_token_latency() if stream else self.latency()
+            input_tokens = _contents_size(contents) // 4 + cached_tokens / 10
+            delay += self.prefill_per_1k_tokens * input_tokens / 1000
+            if not stream and self.decode_per_1k_tokens:
+                delay += self.decode_per_1k_tokens * len(self.reply(contents, generation_config)) / 4000
+            error = UPSTREAM_ERRORS[self._rng.randrange(len(UPSTREAM_ERRORS))]() \
+                if self._rng.random() < self.error_rate else None
+            if error is not None:
+                self._counters['errors'] += 1
+        return delay, error, cached_tokens
+
+    def _finish(self, method, started, contents, generation_config, stream, error, cached_tokens=0):
+        if error is not None:
+            if self.observer:
+                self.observer(method, time.perf_counter() - started, None, error)
+            raise error
+
+        text = self.reply(contents, generation_config)
+        usage = _usage(contents, text, cached_tokens)
+        if not stream:
+            if self.observer:
+                self.observer(method, time.perf_counter() - started, StubResponse(text, usage), None)
+            return StubResponse(text, usage)
+
+        def on_done(last):
+            if self.observer:
+                self.observer(method, time.perf_counter() - started, last, None)
+
+        size = self.stream_chunk_chars
+        chunks = [text[i:i + size] for i in range(0, len(text), size)] or ['']
+        return _StubStream(self, chunks, usage, on_done)
+
+    def call(self, contents, generation_config=None, stream=False, api_key='', cached_content=None):
+        method = 'stream_generate_content' if stream else 'generate_content'
+        started = time.perf_counter()
+        delay, error, cached_tokens = self._start(stream, api_key, contents, cached_content, generation_config)
+        time.sleep(delay)
+        return self._finish(method, started, contents, generation_config, stream, error, cached_tokens)
+
+    async def call_async(self, contents, generation_config=None, stream=False, api_key='', cached_content=None):
+        method = 'stream_generate_content' if stream else 'generate_content'
+        started = time.perf_counter()
+        delay, error, cached_tokens = self._start(stream, api_key, contents, cached_content, generation_config)
+        await asyncio.sleep(delay)
+        return self._finish(method, started, contents, generation_config, stream, error, cached_tokens)
+
+    def get_model(self, api_key, model_name, cached_content=None):
+        return StubModel(self, api_key, cached_content)
+
+    def get_async_model(self, api_key, model_name, cached_content=None):
+        return StubModel(self, api_key, cached_content)
+
+    def create_cached_content(self, api_key, model_name, system_instruction, contents, ttl):
+        if not self.context_caching:
+            raise api_exceptions.MethodNotImplemented('501 Context caching is not supported (stub)')
+        tokens = (len(system_instruction or '') + _contents_size(contents)) // 4
+        name = f'cachedContents/stub-{uuid.uuid4().hex}'
+        expires_at = time.time() + ttl
+        with self._lock:
+            for expired in [n for n, context in self._contexts.items() if context[2] <= time.time()]:
+                del self._contexts[expired]
+            self._counters['cached_contexts'] += 1
+            self._contexts[name] = (api_key, tokens, expires_at)
+        return name, expires_at
+
+    def refresh_cached_content(self, api_key, name, ttl):
+        with self._lock:
+            tokens = self._context_tokens(api_key, name)
+            if tokens is None:
+                raise api_exceptions.NotFound(f'404 CachedContent not found: {name} (stub)')
+            expires_at = time.time() + ttl
+            self._contexts[name] = (api_key, tokens, expires_at)
+        return expires_at
+
+    def delete_cached_content(self, api_key, name):
+        with self._lock:
+            if self._context_tokens(api_key, name) is None:
+                raise api_exceptions.NotFound(f'404 CachedContent not found: {name} (stub)')
+            del self._contexts[name]
+
+    def get_file_client(self, api_key):
+        return self._file_client
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, hits=0, misses=0, evictions=0, keys=len(self._recent_calls),
+                        live_contexts=len(self._contexts), provider='stub')
@@ -0,0 +1,7 @@
+# Korasty AI - Test Configuration
+# The backend modules are imported as top-level modules, as app.py does.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,78 @@
+# Korasty AI - Artifact Store Tests
+
+import gzip
+import json
+
+import pytest
+
+import artifact_store
+from artifact_store import ArtifactStore, accepted_encodings, compress, etag_matches
+
+
+@pytest.fixture
+def without_brotli(monkeypatch):
+    monkeypatch.setattr(artifact_store, 'brotli', None)
+
+
+@pytest.fixture
+def with_brotli(monkeypatch):
+    # Stands in for the optional package; only availability matters here
+    monkeypatch.setattr(artifact_store, 'brotli', object())
+
+
+def test_accepted_encodings_prefers_brotli(with_brotli):
+    assert accepted_encodings('gzip, deflate, br') == ['br', 'gzip']
+    assert accepted_encodings('GZIP') == ['gzip']
+
+
+def test_accepted_encodings_without_brotli(without_brotli):
+    assert accepted_encodings('br, gzip') == ['gzip']
+    assert accepted_encodings('br') == []
+
+
+def test_accepted_encodings_honours_quality(with_brotli):
+    assert accepted_encodings('br;q=0, gzip;q=0.5') == ['gzip']
+    assert accepted_encodings('*;q=0.1, gzip;q=0') == ['br']
+    assert accepted_encodings('br;q=oops') == []
+
+
+def test_accepted_encodings_with_no_header(with_brotli):
+    assert accepted_encodings(None) == []
+    assert accepted_encodings('') == []
+    assert accepted_encodings('identity') == []
+
+
+def test_etag_matches():
+    assert etag_matches('"abc"', 'abc')
+    assert etag_matches('W/"abc"', 'abc')
+    assert etag_matches('"xyz", W/"abc"', 'abc')
+    assert etag_matches('*', 'abc')
+    assert not etag_matches('"abcd"', 'abc')
+    assert not etag_matches('', 'abc')
+    assert not etag_matches(None, 'abc')
+
+
+def test_compress_skips_small_bodies():
+    assert compress(b'{}', ['gzip']) == (b'{}', None)
+    assert compress(b'x' * 2048, []) == (b'x' * 2048, None)
+
+    body, encoding = compress(b'x' * 2048, ['gzip'])
+    assert encoding == 'gzip'
+    assert gzip.decompress(body) == b'x' * 2048
+
+
+def test_store_serves_stored_gzip_and_identity(tmp_path, without_brotli):
+    store = ArtifactStore(str(tmp_path / 'artifacts.sqlite3'))
+    artifact_id = store.save('owner', 'quiz', {'title': 'اختبار'}, title='اختبار')
+
+    assert store.save('owner', 'quiz', {'title': 'اختبار'}) == artifact_id
+    assert store.get(artifact_id, 'someone else') is None
+
+    etag, body, encoding = store.get(artifact_id, 'owner', ['br', 'gzip'])
+    assert encoding == 'gzip'
+    assert etag == store.etag(artifact_id, 'owner')
+
+    _, plain, encoding = store.get(artifact_id, 'owner')
+    assert encoding is None
+    assert plain == gzip.decompress(body)
+    assert json.loads(plain)['artifact']['data'] == {'title': 'اختبار'}
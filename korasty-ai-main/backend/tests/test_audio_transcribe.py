@@ -0,0 +1,55 @@
+# Korasty AI - Audio Transcription Tests
+
+from audio_transcribe import merge_overlap, plan_segments
+
+
+def test_merge_overlap_drops_the_shared_passage():
+    previous = 'في هذه المحاضرة نتحدث عن قوانين نيوتن للحركة'
+    current = 'قوانين نيوتن للحركة وأولها قانون القصور الذاتي'
+
+    assert merge_overlap(previous, current, 5) == 'في هذه المحاضرة نتحدث عن قوانين نيوتن للحركة وأولها قانون القصور الذاتي'
+
+
+def test_merge_overlap_allows_clipped_words_at_the_cuts():
+    # The first segment ends mid-word and the second starts with a partial word
+    previous = 'نبدأ الآن تعريف السرعة المتجهة للجس'
+    current = 'ـم تعريف السرعة المتجهة للجسم هو'
+
+    assert merge_overlap(previous, current, 5) == 'نبدأ الآن تعريف السرعة المتجهة للجسم هو'
+
+
+def test_merge_overlap_ignores_diacritics_and_punctuation():
+    previous = 'وهذا هو القانونُ الأولُ، قانون القصور'
+    current = 'القانون الأول قانون القصور الذاتي'
+
+    assert merge_overlap(previous, current, 5) == 'وهذا هو القانونُ الأولُ، قانون القصور الذاتي'
+
+
+def test_merge_overlap_concatenates_without_a_long_enough_match():
+    previous = 'ثم ننتقل إلى الموضوع التالي'
+    current = 'التالي هو الطاقة الحركية'
+
+    assert merge_overlap(previous, current, 5) == f'{previous}\n\n{current}'
+
+
+def test_merge_overlap_bounds_the_overlap_by_duration():
+    # Half a second holds fewer words than a trustworthy match needs
+    previous = 'بداية واحد اثنان ثلاثة'
+    current = 'واحد اثنان ثلاثة نهاية'
+
+    assert merge_overlap(previous, current, 0.5) == f'{previous}\n\n{current}'
+    assert merge_overlap(previous, current, 1) == 'بداية واحد اثنان ثلاثة نهاية'
+
+
+def test_merge_overlap_with_an_empty_side():
+    assert merge_overlap('', 'نص', 5) == 'نص'
+    assert merge_overlap('نص', '', 5) == 'نص'
+
+
+def test_plan_segments_overlap_and_cover_the_recording():
+    segments = plan_segments(650, 300, 5)
+
+    assert segments[0][0] == 0
+    assert segments[-1][1] == 650
+    for (_, end), (start, _) in zip(segments, segments[1:]):
+        assert end - start == 5
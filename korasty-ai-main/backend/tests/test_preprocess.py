@@ -0,0 +1,90 @@
+# Korasty AI - Preprocessing Tests
+
+from preprocess import PAGE_BREAK, dedupe_paragraphs, preprocess_text, remove_boilerplate
+
+
+HEADER = 'مقرر الفيزياء العامة - الفصل الأول'
+
+
+def _pages(count, body):
+    """Lines of ``count`` pages, each with the same header, its body and a page number"""
+    lines = []
+    for page in range(1, count + 1):
+        if lines:
+            lines.append(PAGE_BREAK)
+        lines.append(HEADER)
+        lines.extend(body(page))
+        lines.append(str(page))
+    return lines
+
+
+def test_remove_boilerplate_drops_repeated_headers_and_page_numbers():
+    topics = ['الحركة', 'القوة', 'الطاقة', 'الزخم']
+    lines = _pages(4, lambda page: [f'مقدمة عن {topics[page - 1]} في هذا الدرس', 'نص إضافي', 'نص آخر'])
+    kept, removed = remove_boilerplate(lines)
+
+    # The first header stays; three copies and four page numbers go
+    assert removed == 7
+    assert kept.count(HEADER) == 1
+    assert not any(line.strip().isdigit() for line in kept)
+    assert 'مقدمة عن الطاقة في هذا الدرس' in kept
+
+
+def test_remove_boilerplate_keeps_repeated_lines_inside_pages():
+    step = 'التمرين: احسب السرعة النهائية للجسم'
+    lines = _pages(3, lambda page: ['مقدمة الصفحة', 'شرح', step, 'حل', step, 'حل آخر', step, 'خاتمة', 'نهاية'])
+    kept, _ = remove_boilerplate(lines)
+
+    assert kept.count(step) == 9
+
+
+def test_remove_boilerplate_needs_page_edges():
+    # Without page breaks or page numbers no line is known to be a header
+    heading = 'السؤال الأول: اختر الإجابة الصحيحة'
+    lines = [heading, 'أ', 'ب', heading, 'ج', 'د', heading, 'هـ']
+    kept, removed = remove_boilerplate(lines)
+
+    assert removed == 0
+    assert kept == lines
+
+
+def test_remove_boilerplate_turns_page_breaks_into_blank_lines():
+    kept, _ = remove_boilerplate(['سطر أول', PAGE_BREAK, 'سطر ثان'])
+
+    assert kept == ['سطر أول', '', 'سطر ثان']
+
+
+def test_dedupe_paragraphs_drops_exact_and_near_repeats():
+    paragraph = 'الطاقة الحركية هي الطاقة التي يمتلكها الجسم بسبب حركته وتعتمد على كتلته وسرعته'
+    respelled = 'الطاقة الحركية هي الطاقة التى يمتلكها الجسم بسبب حركته، وتعتمد على كتلته وسرعته.'
+    near = paragraph + ' دائما'
+    other = 'الطاقة الكامنة هي الطاقة المختزنة في الجسم بسبب موضعه أو شكله بالنسبة لجسم آخر'
+
+    kept, removed = dedupe_paragraphs([paragraph, respelled, near, other])
+
+    assert kept == [paragraph, other]
+    assert removed == 2
+
+
+def test_dedupe_paragraphs_keeps_short_paragraphs():
+    paragraphs = ['الإجابة: ب', 'الإجابة: ب', 'خطوة 1', 'خطوة 1']
+    kept, removed = dedupe_paragraphs(paragraphs)
+
+    assert kept == paragraphs
+    assert removed == 0
+
+
+def test_preprocess_text_reports_removals():
+    topics = ['الحركة', 'القوة', 'الطاقة']
+    text = PAGE_BREAK.join(
+        f'{HEADER}\nدرس {topic} الأول\nشرح {topic} بالتفصيل\nأمثلة على {topic}\n{n}'
+        for n, topic in enumerate(topics, 1)
+    )
+
+    cleaned, report = preprocess_text(text)
+
+    assert report['boilerplate_lines'] == 5
+    assert cleaned.count(HEADER) == 1
+    assert report['input_chars'] == len(text)
+    assert report['output_chars'] == len(cleaned)
+    assert report['compression_ratio'] > 1
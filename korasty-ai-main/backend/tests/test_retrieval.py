@@ -0,0 +1,83 @@
+# Korasty AI - Retrieval Tests
+
+from retrieval import RetrievalIndex, chunk_text, normalize_arabic, tokenize
+
+
+def test_normalize_arabic_unifies_spellings():
+    assert normalize_arabic('إِسْتِقْبَالٌ') == 'استقبال'
+    assert normalize_arabic('مدرسة') == normalize_arabic('مدرسه')
+    assert normalize_arabic('مستشفى') == 'مستشفي'
+    assert normalize_arabic('العـــلم') == 'العلم'
+
+
+def test_tokenize_stems_and_drops_stopwords():
+    assert tokenize('والطلاب في المدرسة') == tokenize('الطلاب المدرسه')
+    assert tokenize('the speed of light') == ['speed', 'light']
+
+
+def test_chunk_text_splits_long_paragraphs_with_overlap():
+    paragraph = 'أ' * 250
+    chunks = chunk_text(paragraph, chunk_chars=100, overlap_chars=20)
+
+    assert [len(chunk) for chunk in chunk_text('قصير\n\nقصير آخر', 100)] == [14]
+    assert chunks[0][-20:] == chunks[1][:20]
+    assert all(len(chunk) <= 100 for chunk in chunks)
+
+
+def _index():
+    index = RetrievalIndex(chunk_chars=200, overlap_chars=20)
+    index.add_source('physics', '\n\n'.join([
+        'قانون نيوتن الأول يصف القصور الذاتي للأجسام الساكنة والمتحركة.',
+        'الطاقة الحركية تساوي نصف الكتلة في مربع السرعة.',
+        'التسارع هو معدل تغير السرعة بالنسبة للزمن.'
+    ]))
+    index.add_source('chemistry', 'الرابطة التساهمية تنشأ من مشاركة الإلكترونات بين ذرتين.')
+    return index
+
+
+def test_search_ranks_the_matching_chunk_first():
+    hits = _index().search('ما هي الطاقة الحركية؟')
+
+    assert hits[0][1] == 'physics'
+    assert 'الطاقة الحركية' in hits[0][3]
+
+
+def test_search_prefers_more_matched_terms():
+    index = RetrievalIndex(chunk_chars=60, overlap_chars=10)
+    index.add_source('s', '\n\n'.join([
+        'السرعة والزمن في الحركة المنتظمة',
+        'السرعة وحدها بلا شيء آخر هنا الآن',
+        'موضوع مختلف تماماً عن الكيمياء'
+    ]))
+    hits = index.search('السرعة والزمن')
+
+    assert [hit[2] for hit in hits] == [0, 1]
+    assert hits[0][0] > hits[1][0] > 0
+
+
+def test_search_is_limited_to_the_given_sources():
+    index = _index()
+
+    assert index.search('الإلكترونات', source_ids=['physics']) == []
+    assert [hit[1] for hit in index.search('الإلكترونات', source_ids=['chemistry'])] == ['chemistry']
+
+
+def test_scores_do_not_depend_on_other_sources():
+    alone = RetrievalIndex(chunk_chars=200, overlap_chars=20)
+    alone.add_source('chemistry', 'الرابطة التساهمية تنشأ من مشاركة الإلكترونات بين ذرتين.')
+
+    shared = _index().search('الرابطة التساهمية', source_ids=['chemistry'])
+
+    assert shared[0][0] == alone.search('الرابطة التساهمية', source_ids=['chemistry'])[0][0]
+
+
+def test_least_recently_used_source_is_dropped():
+    index = RetrievalIndex(max_sources=2)
+    index.add_source('a', 'نص المصدر الأول')
+    index.add_source('b', 'نص المصدر الثاني')
+    index.search('نص', source_ids=['a'])
+    index.add_source('c', 'نص المصدر الثالث')
+
+    assert index.has_source('a')
+    assert not index.has_source('b')
+    assert index.has_source('c')
@@ -0,0 +1,71 @@
+# Korasty AI - Structured Output Tests
+
+from structured_output import ARTIFACT_SCHEMAS, parse_json_response, validate
+
+
+FLASHCARDS = ARTIFACT_SCHEMAS['flashcards']
+
+
+def test_plain_json_is_not_repaired():
+    data, repaired = parse_json_response('{"flashcards": []}', FLASHCARDS)
+
+    assert data == {'flashcards': []}
+    assert not repaired
+
+
+def test_fenced_json_with_prose_is_repaired():
+    text = 'إليك البطاقات:\n```json\n{"flashcards": [{"question": "س", "answer": "ج"}]}\n```'
+    data, repaired = parse_json_response(text, FLASHCARDS)
+
+    assert data == {'flashcards': [{'question': 'س', 'answer': 'ج'}]}
+    assert repaired
+
+
+def test_truncated_json_keeps_the_complete_items():
+    text = '{"flashcards": [{"question": "س1", "answer": "ج1"}, {"question": "س2", "ans'
+    data, repaired = parse_json_response(text, FLASHCARDS)
+
+    # The half-written second card has no answer, so it is dropped
+    assert data == {'flashcards': [{'question': 'س1', 'answer': 'ج1'}]}
+    assert repaired
+    assert validate(data, FLASHCARDS) == []
+
+
+def test_truncated_json_keeps_a_cut_off_last_value():
+    text = '{"flashcards": [{"question": "س1", "answer": "ج1"}, {"question": "س2", "answer": "ج'
+    data, _ = parse_json_response(text, FLASHCARDS)
+
+    assert data['flashcards'][1] == {'question': 'س2', 'answer': 'ج'}
+
+
+def test_truncated_json_without_a_schema_closes_the_open_string():
+    data, repaired = parse_json_response('{"title": "عنوان غير مكت')
+
+    assert data == {'title': 'عنوان غير مكت'}
+    assert repaired
+
+
+def test_escaped_quotes_do_not_end_strings():
+    text = '{"flashcards": [{"question": "ما معنى \\"القوة\\"؟", "answer": "دفع أو سحب"}, {"quest'
+    data, _ = parse_json_response(text, FLASHCARDS)
+
+    assert data == {'flashcards': [{'question': 'ما معنى "القوة"؟', 'answer': 'دفع أو سحب'}]}
+
+
+def test_unparseable_text_gives_none():
+    assert parse_json_response('لا يوجد JSON هنا', FLASHCARDS) == (None, False)
+    assert parse_json_response('', FLASHCARDS) == (None, False)
+
+
+def test_validate_reports_paths():
+    quiz = ARTIFACT_SCHEMAS['quiz']
+    data = {'quiz': {'title': 'اختبار', 'questions': [
+        {'question': 'س', 'options': ['أ', 'ب'], 'correctIndex': True, 'explanation': 'ش'},
+        {'question': 'س', 'options': ['أ', 2], 'correctIndex': 0}
+    ]}}
+
+    assert validate(data, quiz) == [
+        '$.quiz.questions[0].correctIndex: expected integer',
+        '$.quiz.questions[1].explanation: missing',
+        '$.quiz.questions[1].options[1]: expected string'
+    ]
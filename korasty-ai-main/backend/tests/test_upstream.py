@@ -0,0 +1,165 @@
+# Korasty AI - Upstream Scheduler Tests
+
+import asyncio
+
+import pytest
+from google.api_core import exceptions as api_exceptions
+
+import upstream
+from upstream import (
+    THROTTLED, TRANSIENT, UpstreamBusyError, UpstreamScheduler, classify_error, with_retries,
+    worth_retrying_work
+)
+
+
+def _failing(errors, result='ok'):
+    """A call that raises each of ``errors`` in turn, then returns ``result``"""
+    calls = []
+
+    def fn():
+        calls.append(len(calls))
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+    return fn, calls
+
+
+def _scheduler(**kwargs):
+    options = dict(rate=1000, burst=1000, max_concurrency=8, retries=3, base_backoff=0, queue_timeout=1)
+    options.update(kwargs)
+    return UpstreamScheduler(**options)
+
+
+def test_classify_error():
+    assert classify_error(api_exceptions.ResourceExhausted('quota')) == THROTTLED
+    assert classify_error(api_exceptions.TooManyRequests('slow down')) == THROTTLED
+    assert classify_error(api_exceptions.ServiceUnavailable('down')) == TRANSIENT
+    assert classify_error(api_exceptions.DeadlineExceeded('late')) == TRANSIENT
+    assert classify_error(ConnectionResetError()) == TRANSIENT
+    assert classify_error(api_exceptions.InvalidArgument('bad')) is None
+    assert classify_error(api_exceptions.PermissionDenied('key')) is None
+    assert classify_error(ValueError('bad output')) is None
+
+
+def test_worth_retrying_work():
+    assert worth_retrying_work(ValueError('bad output'))
+    assert worth_retrying_work(api_exceptions.ServiceUnavailable('down'))
+    assert not worth_retrying_work(UpstreamBusyError('busy'))
+    # Already retried by the scheduler, or final
+    assert not worth_retrying_work(api_exceptions.ResourceExhausted('quota'))
+    assert not worth_retrying_work(api_exceptions.InvalidArgument('bad'))
+
+
+def test_with_retries_backs_off_exponentially(monkeypatch):
+    delays = []
+    monkeypatch.setattr(upstream.time, 'sleep', delays.append)
+    fn, calls = _failing([ValueError(), ValueError()])
+
+    assert with_retries(fn, retries=3, backoff=0.5) == 'ok'
+    assert len(calls) == 3
+    assert delays == [0.5, 1.0]
+
+
+def test_with_retries_gives_up(monkeypatch):
+    monkeypatch.setattr(upstream.time, 'sleep', lambda seconds: None)
+    fn, calls = _failing([ValueError('1'), ValueError('2'), ValueError('3')])
+
+    with pytest.raises(ValueError, match='3'):
+        with_retries(fn, retries=2, backoff=1)
+    assert len(calls) == 3
+
+
+@pytest.mark.parametrize('error', [
+    UpstreamBusyError('busy'),
+    api_exceptions.PermissionDenied('key'),
+    api_exceptions.ResourceExhausted('quota')
+])
+def test_with_retries_raises_final_errors_at_once(monkeypatch, error):
+    monkeypatch.setattr(upstream.time, 'sleep', lambda seconds: None)
+    fn, calls = _failing([error])
+
+    with pytest.raises(type(error)):
+        with_retries(fn, retries=3, backoff=1)
+    assert len(calls) == 1
+
+
+def test_scheduler_retries_transient_errors():
+    scheduler = _scheduler()
+    fn, calls = _failing([api_exceptions.ServiceUnavailable('down'), ConnectionResetError()])
+
+    assert scheduler.call('key', fn) == 'ok'
+    assert len(calls) == 3
+    assert scheduler.stats()['retries'] == 2
+    assert scheduler.stats()['in_flight'] == 0
+
+
+def test_scheduler_raises_errors_not_worth_retrying():
+    scheduler = _scheduler()
+    error = api_exceptions.InvalidArgument('bad request')
+    fn, calls = _failing([error])
+
+    with pytest.raises(api_exceptions.InvalidArgument) as raised:
+        scheduler.call('key', fn)
+    assert raised.value is error
+    assert len(calls) == 1
+    assert scheduler.stats()['retries'] == 0
+
+
+def test_scheduler_gives_up_when_throttled():
+    scheduler = _scheduler(retries=2)
+    fn, calls = _failing([api_exceptions.ResourceExhausted('quota')] * 3)
+
+    with pytest.raises(UpstreamBusyError) as raised:
+        scheduler.call('key', fn)
+    assert raised.value.status == 429
+    assert len(calls) == 3
+    stats = scheduler.stats()
+    assert stats['throttled'] == 3
+    assert stats['failed'] == 1
+    assert stats['throttled_keys'] == 1
+
+
+def test_scheduler_gives_up_when_unavailable():
+    scheduler = _scheduler(retries=1)
+    fn, _ = _failing([api_exceptions.ServiceUnavailable('down')] * 2)
+
+    with pytest.raises(UpstreamBusyError) as raised:
+        scheduler.call('key', fn)
+    assert raised.value.status == 503
+
+
+def test_throttling_halves_limits_and_success_grows_them_back():
+    scheduler = _scheduler(max_concurrency=8, retries=1)
+    fn, _ = _failing([api_exceptions.ResourceExhausted('quota')])
+    scheduler.call('key', fn)
+
+    # Halved by the 429, then the retry's success adds 1/limit and 5% of the rate
+    state = scheduler._state('key')
+    assert state.limit == pytest.approx(4 + 1 / 4)
+    assert state.rate == pytest.approx(500 + 50)
+
+    for _ in range(100):
+        scheduler.call('key', lambda: 'ok')
+    assert state.limit == 8
+    assert state.rate == 1000
+
+
+def test_backoff_is_jittered_and_capped():
+    scheduler = _scheduler(base_backoff=0.5, max_backoff=4)
+    for attempt in range(8):
+        for _ in range(20):
+            assert 0 <= scheduler._backoff(attempt) <= min(4, 0.5 * 2 ** attempt)
+
+
+def test_call_async_retries_transient_errors():
+    scheduler = _scheduler()
+    errors = [api_exceptions.ServiceUnavailable('down')]
+
+    async def fn():
+        if errors:
+            raise errors.pop()
+        return 'ok'
+
+    assert asyncio.run(scheduler.call_async('key', fn)) == 'ok'
+    assert scheduler.stats()['retries'] == 1
+    assert scheduler.stats()['in_flight'] == 0
@@ -0,0 +1,215 @@
+# Korasty AI - Upload Handling
+# Reads uploaded files from multipart, raw binary or legacy JSON/base64 bodies
+# into spooled temp files (constant memory), and hands large files to the
+# Gemini File API instead of inlining their bytes in the request.
+
+import base64
+import binascii
+import hashlib
+import io
+import tempfile
+import time
+
+from google.ai import generativelanguage as glm
+
+from request_timing import timed_stage
+
+
+# Uploads stay in memory up to this size, then spill to a temp file
+SPOOL_MEMORY_BYTES = 1024 * 1024
+READ_CHUNK_BYTES = 64 * 1024
+
+
+class UploadError(Exception):
+    """Invalid or oversized upload; carries the HTTP status to return"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _spool(chunks, max_bytes):
+    """Copy byte chunks into a spooled temp file, enforcing ``max_bytes``"""
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+        if size > max_bytes:
+            spooled.close()
+            raise UploadError('حجم الملف أكبر من الحد المسموح', 413)
+        spooled.write(chunk)
+    spooled.seek(0)
+    return spooled, size
+
+
+def _iter_stream(stream):
+    while True:
+        chunk = stream.read(READ_CHUNK_BYTES)
+        if not chunk:
+            return
+        yield chunk
+
+
+def read_upload(request, max_bytes, default_mime):
+    """Return ``(fileobj, mime_type, size)`` for the uploaded file.
+
+    Supported bodies:
+    - ``multipart/form-data`` with a ``file`` field (and optional ``mimeType``)
+    - raw bytes with the file's own Content-Type (or ``X-Mime-Type``)
+    - the legacy JSON body ``{"content": "<base64>", "mimeType": ...}``
+
+    Returns ``(None, None, 0)`` when the request carries no file.
+    """
+    # Reject obviously oversized bodies before reading anything; allow for
+    # base64 (4/3) and multipart framing overhead
+    if request.content_length and request.content_length > max_bytes * 4 // 3 + 64 * 1024:
+        raise UploadError('حجم الملف أكبر من الحد المسموح', 413)
+
+    content_type = request.mimetype or ''
+
+    if content_type == 'multipart/form-data':
+        upload = request.files.get('file')
+        if upload is None:
+            return None, None, 0
+        mime_type = request.form.get('mimeType') or upload.mimetype or default_mime
+        fileobj, size = _spool(_iter_stream(upload.stream), max_bytes)
+        return fileobj, mime_type, size
+
+    if content_type in ('application/json', ''):
+        data = request.get_json(silent=True) or {}
+        encoded = data.get('content', '')
+        if not encoded:
+            return None, None, 0
+        if len(encoded) * 3 // 4 > max_bytes:
+            raise UploadError('حجم الملف أكبر من الحد المسموح', 413)
+        try:
+            with timed_stage('base64'):
+                decoded = base64.b64decode(encoded, validate=False)
+        except (binascii.Error, ValueError):
+            raise UploadError('محتوى الملف ليس base64 صالحاً')
+        fileobj, size = _spool([decoded], max_bytes)
+        return fileobj, data.get('mimeType') or default_mime, size
+
+    # Raw binary body
+    if content_type == 'application/octet-stream':
+        mime_type = request.headers.get('X-Mime-Type') or default_mime
+    else:
+        mime_type = content_type
+    fileobj, size = _spool(_iter_stream(request.stream), max_bytes)
+    if not size:
+        fileobj.close()
+        return None, None, 0
+    return fileobj, mime_type, size
+
+
+def _decode_item(item, max_bytes):
+    encoded = item.get('content', '') if isinstance(item, dict) else ''
+    if not encoded:
+        raise UploadError('محتوى الملف مطلوب')
+    if len(encoded) * 3 // 4 > max_bytes:
+        raise UploadError('حجم الملف أكبر من الحد المسموح', 413)
+    try:
+        with timed_stage('base64'):
+            return base64.b64decode(encoded, validate=False)
+    except (binascii.Error, ValueError):
+        raise UploadError('محتوى الملف ليس base64 صالحاً')
+
+
+def read_uploads(request, max_bytes, default_mime, max_files):
+    """Return one dict per file of a multi-file upload, in request order.
+
+    Supported bodies:
+    - ``multipart/form-data`` with one or more ``files`` (or ``file``) fields
+    - JSON ``{"files": [{"content": "<base64>", "mimeType": ..., "name": ...}]}``
+
+    Each item has ``name`` and either ``fileobj``, ``mime_type`` and ``size``
+    or, for a file that could not be read, ``error`` and ``status``. The
+    caller closes the file objects. Raises ``UploadError`` for more than
+    ``max_files`` files or a body too large for all of them together.
+    """
+    if request.content_length and request.content_length > max_files * (max_bytes * 4 // 3 + 64 * 1024):
+        raise UploadError('حجم الطلب أكبر من الحد المسموح', 413)
+
+    if request.mimetype == 'multipart/form-data':
+        uploads = request.files.getlist('files') or request.files.getlist('file')
+        entries = [(upload.filename or '', upload.mimetype, lambda u=upload: _iter_stream(u.stream))
+                   for upload in uploads]
+    else:
+        data = request.get_json(silent=True) or {}
+        files = data.get('files') or []
+        if not isinstance(files, list):
+            raise UploadError('قائمة الملفات غير صالحة')
+        entries = [
+            (item.get('name', '') if isinstance(item, dict) else '',
+             item.get('mimeType') if isinstance(item, dict) else None,
+             lambda item=item: [_decode_item(item, max_bytes)])
+            for item in files
+        ]
+
+    if len(entries) > max_files:
+        raise UploadError(f'الحد الأقصى {max_files} ملفات في الطلب الواحد')
+
+    items = []
+    for name, mime_type, chunks in entries:
+        try:
+            fileobj, size = _spool(chunks(), max_bytes)
+        except UploadError as e:
+            items.append({'name': name, 'error': str(e), 'status': e.status})
+            continue
+        if not size:
+            fileobj.close()
+            items.append({'name': name, 'error': 'محتوى الملف مطلوب', 'status': 400})
+            continue
+        items.append({'name': name, 'fileobj': fileobj, 'mime_type': mime_type or default_mime, 'size': size})
+    return items
+
+
+def file_sha256(fileobj):
+    """Hex SHA-256 of the file's bytes; leaves the file rewound"""
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for chunk in _iter_stream(fileobj):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def _io_stream(fileobj):
+    """The file object itself, or the one a SpooledTemporaryFile wraps.
+
+    The SDK only streams ``io.IOBase`` objects and takes anything else for a
+    path; SpooledTemporaryFile is not one before Python 3.11.
+    """
+    if isinstance(fileobj, io.IOBase):
+        return fileobj
+    inner = fileobj._file
+    # On Windows a rolled-over TemporaryFile is itself a wrapper around the file
+    return getattr(inner, 'file', inner)
+
+
+def upload_to_file_api(file_client, fileobj, mime_type, timeout=300, poll_seconds=2):
+    """Upload through the File API and wait until the file is ACTIVE"""
+    fileobj.seek(0)
+    uploaded = file_client.create_file(_io_stream(fileobj), mime_type=mime_type)
+
+    deadline = time.monotonic() + timeout
+    while uploaded.state == glm.File.State.PROCESSING:
+        if time.monotonic() > deadline:
+            delete_uploaded_file(file_client, uploaded)
+            raise UploadError('انتهت مهلة معالجة الملف المرفوع', 504)
+        time.sleep(poll_seconds)
+        uploaded = file_client.get_file(name=uploaded.name)
+
+    if uploaded.state == glm.File.State.FAILED:
+        delete_uploaded_file(file_client, uploaded)
+        raise UploadError('فشلت معالجة الملف المرفوع', 502)
+
+    return uploaded
+
+
+def delete_uploaded_file(file_client, uploaded):
+    """Best-effort cleanup of an uploaded file"""
+    try:
+        file_client.delete_file(name=uploaded.name)
+    except Exception:
+        pass
@@ -0,0 +1,379 @@
+# Korasty AI - Upstream Scheduler
+# Every model call goes through a per-API-key token bucket and concurrency
+# limit. Both shrink when the provider answers 429/RESOURCE_EXHAUSTED and
+# grow back as calls succeed (AIMD). Throttled and transient failures are
+# retried with jittered exponential backoff, and callers over the limit
+# queue for a bounded time instead of failing at once.
+
+import asyncio
+import hashlib
+import random
+import threading
+import time
+
+from google.api_core import exceptions as api_exceptions
+
+
+THROTTLED = 'throttled'
+TRANSIENT = 'transient'
+# Release outcomes besides the two error kinds: only SUCCEEDED grows the
+# key's limits; FAILED (an error not worth retrying) leaves them unchanged
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+_THROTTLED_ERRORS = (api_exceptions.ResourceExhausted, api_exceptions.TooManyRequests)
+_TRANSIENT_ERRORS = (
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.InternalServerError,
+    api_exceptions.DeadlineExceeded,
+    api_exceptions.GatewayTimeout,
+    api_exceptions.BadGateway,
+    api_exceptions.Aborted,
+    ConnectionError,
+    TimeoutError
+)
+
+
+class UpstreamBusyError(Exception):
+    """The provider stayed throttled/unavailable or the local queue wait ran out"""
+
+    def __init__(self, message, status=503):
+        super().__init__(message)
+        self.status = status
+
+
+def classify_error(error):
+    """``THROTTLED``, ``TRANSIENT`` or None (not worth retrying)"""
+    if isinstance(error, _THROTTLED_ERRORS):
+        return THROTTLED
+    if isinstance(error, _TRANSIENT_ERRORS):
+        return TRANSIENT
+    return None
+
+
+def worth_retrying_work(error):
+    """Whether a failed unit of work may succeed on a second try.
+
+    Bad or unparseable output and transient errors may; an UpstreamBusyError
+    (the scheduler already retried, or the queue wait ran out) and provider
+    errors not worth retrying (PermissionDenied, InvalidArgument) may not.
+    """
+    if isinstance(error, UpstreamBusyError):
+        return False
+    if isinstance(error, api_exceptions.GoogleAPICallError):
+        return classify_error(error) == TRANSIENT
+    return True
+
+
+def with_retries(func, retries, backoff):
+    """Call ``func()``, retrying failures worth retrying up to ``retries`` times with exponential backoff.
+
+    For whole units of work (a PDF page range, an audio segment, a shard)
+    whose failure may be bad output rather than a provider error; the
+    individual model calls inside are already scheduled and retried above,
+    so their final errors are raised at once (see ``worth_retrying_work``).
+    """
+    for attempt in range(retries + 1):
+        try:
+            return func()
+        except Exception as e:
+            if attempt == retries or not worth_retrying_work(e):
+                raise
+            time.sleep(backoff * (2 ** attempt))
+
+
+class _KeyState:
+    def __init__(self, rate, burst, limit):
+        self.rate = rate
+        self.tokens = float(burst)
+        self.refilled = time.monotonic()
+        self.limit = float(limit)
+        self.in_flight = 0
+        self.queued = 0
+        self.last_used = self.refilled
+
+
+class _StreamPermit:
+    """Holds the concurrency slot of a streamed call until the stream ends"""
+
+    def __init__(self, response, release):
+        self._response = response
+        self._release = release
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def _done(self):
+        release, self._release = self._release, None
+        if release:
+            release()
+
+    def __iter__(self):
+        try:
+            yield from self._response
+        finally:
+            self._done()
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._response:
+                yield chunk
+        finally:
+            self._done()
+
+    def __del__(self):
+        # A stream abandoned without being iterated
+        self._done()
+
+
+class UpstreamScheduler:
+    """Per-key rate and concurrency control with adaptive limits and retries.
+
+    Each key may start ``rate`` calls per second (bursts up to ``burst``) and
+    run at most ``max_concurrency`` at once. A throttled answer halves the
+    key's concurrency limit and rate; each success adds back ``1/limit`` of a
+    slot and 5% of the rate. Callers wait up to ``queue_timeout`` seconds for
+    a slot, and throttled or transient failures are retried up to ``retries``
+    times after ``uniform(0, min(max_backoff, base_backoff * 2**attempt))``.
+    """
+
+    def __init__(self, rate=5.0, burst=10, max_concurrency=8, min_concurrency=1,
+                 queue_timeout=30.0, retries=3, base_backoff=0.5, max_backoff=8.0,
+                 idle_seconds=900):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.queue_timeout = queue_timeout
+        self.retries = retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.idle_seconds = idle_seconds
+
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._async_waiters = []  # (loop, future) pairs woken on release
+        self._states = {}
+        self._last_purge = 0.0
+        self._rng = random.Random()
+        self._counters = {'calls': 0, 'retries': 0, 'throttled': 0, 'rejected': 0, 'failed': 0}
+
+    def _state(self, api_key):
+        fingerprint = hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+        now = time.monotonic()
+        with self._lock:
+            self._purge(now)
+            state = self._states.get(fingerprint)
+            if state is None:
+                state = self._states[fingerprint] = _KeyState(self.rate, self.burst, self.max_concurrency)
+            state.last_used = now
+            return state
+
+    def _purge(self, now):
+        """Forget idle keys (at most once a minute)"""
+        if now - self._last_purge < 60:
+            return
+        self._last_purge = now
+        for fingerprint, state in list(self._states.items()):
+            if not state.in_flight and not state.queued and now - state.last_used > self.idle_seconds:
+                del self._states[fingerprint]
+
+    def _try_take(self, state):
+        """Take a slot and a token; returns 0 on success, else seconds to wait (None: until a release)"""
+        now = time.monotonic()
+        state.tokens = min(self.burst, state.tokens + (now - state.refilled) * state.rate)
+        state.refilled = now
+        if state.in_flight >= max(self.min_concurrency, int(state.limit)):
+            return None
+        if state.tokens < 1:
+            return (1 - state.tokens) / state.rate
+        state.tokens -= 1
+        state.in_flight += 1
+        return 0
+
+    def _rejected(self):
+        self._counters['rejected'] += 1
+        return UpstreamBusyError('الخادم مشغول حالياً، حاول مرة أخرى بعد قليل', 503)
+
+    def _acquire(self, state):
+        deadline = time.monotonic() + self.queue_timeout
+        with self._lock:
+            state.queued += 1
+            try:
+                while True:
+                    wait = self._try_take(state)
+                    if wait == 0:
+                        return
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._rejected()
+                    self._changed.wait(remaining if wait is None else min(wait, remaining))
+            finally:
+                state.queued -= 1
+
+    async def _acquire_async(self, state):
+        deadline = time.monotonic() + self.queue_timeout
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            state.queued += 1
+        try:
+            while True:
+                with self._lock:
+                    wait = self._try_take(state)
+                    if wait == 0:
+                        return
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._rejected()
+                    waiter = (loop, loop.create_future())
+                    self._async_waiters.append(waiter)
+                try:
+                    await asyncio.wait_for(waiter[1], remaining if wait is None else min(wait, remaining))
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    with self._lock:
+                        if waiter in self._async_waiters:
+                            self._async_waiters.remove(waiter)
+        finally:
+            with self._lock:
+                state.queued -= 1
+
+    def _release(self, state, outcome):
+        with self._lock:
+            state.in_flight -= 1
+            if outcome == THROTTLED:
+                state.limit = max(self.min_concurrency, state.limit / 2)
+                state.rate = max(self.rate / 20, state.rate / 2)
+                state.tokens = min(state.tokens, 0)
+            elif outcome == SUCCEEDED:
+                state.limit = min(self.max_concurrency, state.limit + 1 / state.limit)
+                state.rate = min(self.rate, state.rate + self.rate * 0.05)
+            self._changed.notify_all()
+            waiters, self._async_waiters = self._async_waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+
+    def _backoff(self, attempt):
+        return self._rng.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+
+    def _give_up(self, error, kind):
+        self._count('failed')
+        if kind == THROTTLED:
+            return UpstreamBusyError('تم تجاوز حد الطلبات لمفتاح Gemini، حاول مرة أخرى بعد قليل', 429)
+        return UpstreamBusyError('خدمة Gemini غير متاحة مؤقتاً، حاول مرة أخرى بعد قليل', 503)
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _failed(self, state, error, attempt):
+        """Release after a failed attempt; returns the error to raise, or None to retry"""
+        kind = classify_error(error)
+        self._release(state, kind or FAILED)
+        if kind == THROTTLED:
+            self._count('throttled')
+        if kind is None:
+            return error
+        if attempt >= self.retries:
+            return self._give_up(error, kind)
+        self._count('retries')
+        return None
+
+    def call(self, api_key, fn, stream=False):
+        """Run ``fn()`` under the key's limits, retrying throttled/transient failures"""
+        state = self._state(api_key)
+        self._count('calls')
+        attempt = 0
+        while True:
+            self._acquire(state)
+            try:
+                result = fn()
+            except Exception as e:
+                error = self._failed(state, e, attempt)
+                if error is e:
+                    raise
+                if error is not None:
+                    raise error from e
+                time.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+            if stream:
+                return _StreamPermit(result, lambda: self._release(state, SUCCEEDED))
+            self._release(state, SUCCEEDED)
+            return result
+
+    async def call_async(self, api_key, fn, stream=False):
+        """Async counterpart of ``call``; ``fn`` is a coroutine function"""
+        state = self._state(api_key)
+        self._count('calls')
+        attempt = 0
+        while True:
+            await self._acquire_async(state)
+            try:
+                result = await fn()
+            except Exception as e:
+                error = self._failed(state, e, attempt)
+                if error is e:
+                    raise
+                if error is not None:
+                    raise error from e
+                await asyncio.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+            except BaseException:
+                # Cancelled while waiting on the provider
+                self._release(state, TRANSIENT)
+                raise
+            if stream:
+                return _StreamPermit(result, lambda: self._release(state, SUCCEEDED))
+            self._release(state, SUCCEEDED)
+            return result
+
+    def wrap(self, model, api_key):
+        """Proxy ``model`` so its generation calls (and chats) are scheduled"""
+        return ScheduledModel(model, self, api_key)
+
+    def stats(self):
+        with self._lock:
+            states = list(self._states.values())
+            return dict(
+                self._counters,
+                keys=len(states),
+                in_flight=sum(s.in_flight for s in states),
+                queued=sum(s.queued for s in states),
+                throttled_keys=sum(1 for s in states if s.limit < self.max_concurrency or s.rate < self.rate)
+            )
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class ScheduledModel:
+    """GenerativeModel proxy routing generate_content through the scheduler"""
+
+    def __init__(self, model, scheduler, api_key):
+        self._model = model
+        self._scheduler = scheduler
+        self._api_key = api_key
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+    def generate_content(self, *args, stream=False, **kwargs):
+        return self._scheduler.call(
+            self._api_key, lambda: self._model.generate_content(*args, stream=stream, **kwargs), stream
+        )
+
+    async def generate_content_async(self, *args, stream=False, **kwargs):
+        return await self._scheduler.call_async(
+            self._api_key, lambda: self._model.generate_content_async(*args, stream=stream, **kwargs), stream
+        )
+
+    def start_chat(self, **kwargs):
+        chat = self._model.start_chat(**kwargs)
+        # The chat session calls model.generate_content(_async) for each message
+        chat.model = self
+        return chat
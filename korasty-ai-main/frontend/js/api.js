@@ -60,12 +60,113 @@ const API = {
 
     if (!response.ok) {
       const error = await response.json().catch(() => ({ error: 'خطأ في الاتصال بالخادم' }));
-      throw new Error(error.error || 'خطأ في API');
+      const err = new Error(error.error || 'خطأ في API');
+      err.status = response.status;
+      err.missingSourceIds = error.missing_source_ids || [];
+      throw err;
     }
 
     return response.json();
   },
 
+  /**
+   * Make a streaming (Server-Sent Events) request to the backend.
+   * Calls onDelta with the accumulated text and resolves with the final text.
+   */
+  async callBackendStream(endpoint, body, onDelta) {
+    const backendUrl = this.getBackendUrl();
+    const response = await fetch(`${backendUrl}${endpoint}`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        'Accept': 'text/event-stream',
+        'X-API-Key': this.getApiKey() || ''
+      },
+      body: JSON.stringify({ ...body, stream: true })
+    });
+
+    if (!response.ok) {
+      const error = await response.json().catch(() => ({ error: 'خطأ في الاتصال بالخادم' }));
+      const err = new Error(error.error || 'خطأ في API');
+      err.status = response.status;
+      err.missingSourceIds = error.missing_source_ids || [];
+      throw err;
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let text = '';
+
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      // Events are separated by a blank line
+      let boundary;
+      while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+        const raw = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+
+        const event = (raw.match(/^event: (.*)$/m) || [])[1];
+        const data = (raw.match(/^data: (.*)$/m) || [])[1];
+        if (!data) continue;
+        const payload = JSON.parse(data);
+
+        if (event === 'delta') {
+          text += payload.text;
+          onDelta(text);
+        } else if (event === 'error') {
+          throw new Error(payload.error || 'خطأ في API');
+        }
+      }
+    }
+
+    return text;
+  },
+
+  // Last context registered with the backend, so it is only uploaded once
+  _registeredSource: { text: null, id: null },
+
+  /**
+   * Register source text with the backend and return its source id
+   */
+  async registerSource(text, force = false) {
+    if (!force && this._registeredSource.text === text && this._registeredSource.id) {
+      return this._registeredSource.id;
+    }
+
+    const result = await this.callBackend('/api/sources', { text });
+    this._registeredSource = { text, id: result.source_id };
+    return result.source_id;
+  },
+
+  /**
+   * Generate a studio artifact on the backend from the registered source.
+   * Resolves with the artifact data, or null when there is no backend or it
+   * failed (the caller then uses the direct Gemini API).
+   */
+  async generateOnBackend(type, content, options) {
+    if (!this.hasBackendUrl()) return null;
+    try {
+      const body = { source_ids: [await this.registerSource(content)], options };
+      let result;
+      try {
+        result = await this.callBackend(`/api/studio/${type}`, body);
+      } catch (error) {
+        // The backend evicted our source; upload it again and retry once
+        if (error.status !== 404) throw error;
+        body.source_ids = [await this.registerSource(content, true)];
+        result = await this.callBackend(`/api/studio/${type}`, body);
+      }
+      return result.data;
+    } catch (error) {
+      console.warn('Backend call failed, falling back to direct Gemini API:', error);
+      return null;
+    }
+  },
+
   /**
    * Make a request to Google AI Studio (Gemini) directly
    */
@@ -119,19 +220,41 @@ const API = {
     return result.candidates?.[0]?.content?.parts?.[0]?.text || '';
   },
 
+  // Chat sessions the backend has already been given the history for
+  _syncedSessions: new Set(),
+
   /**
    * Chat with context (for Teacher AI)
    */
-  async chat(message, context = '', history = []) {
+  async chat(message, context = '', history = [], onDelta = null, sessionId = null) {
     // Try backend first if configured, otherwise use direct Gemini API
     if (this.hasBackendUrl()) {
       try {
-        const result = await this.callBackend('/api/chat', {
-          message,
-          context,
-          history
-        });
-        return result.response;
+        // With a session the backend keeps the conversation itself; the local
+        // history is only sent once per page load to seed an unknown session
+        const body = { message };
+        if (sessionId) body.session_id = sessionId;
+        if (!sessionId || !this._syncedSessions.has(sessionId)) body.history = history;
+        if (context) {
+          body.source_ids = [await this.registerSource(context)];
+        }
+
+        // Stream tokens as they arrive when the caller can render them
+        const send = () => onDelta
+          ? this.callBackendStream('/api/chat', body, onDelta)
+          : this.callBackend('/api/chat', body).then(result => result.response);
+
+        let reply;
+        try {
+          reply = await send();
+        } catch (error) {
+          // The backend evicted our source; upload it again and retry once
+          if (error.status !== 404 || !context) throw error;
+          body.source_ids = [await this.registerSource(context, true)];
+          reply = await send();
+        }
+        if (sessionId) this._syncedSessions.add(sessionId);
+        return reply;
       } catch (error) {
         console.warn('Backend call failed, falling back to direct Gemini API:', error);
       }
@@ -186,10 +309,26 @@ ${context ? `المحتوى المتاح للرجوع إليه:\n${context}` : '
     return result.candidates?.[0]?.content?.parts?.[0]?.text || '';
   },
 
+  /**
+   * Forget a chat session's memory on the backend (best effort)
+   */
+  async deleteChatSession(sessionId) {
+    if (!this.hasBackendUrl() || !sessionId) return;
+    this._syncedSessions.delete(sessionId);
+    try {
+      await this.callBackend(`/api/chat/sessions/${encodeURIComponent(sessionId)}`, {}, 'DELETE');
+    } catch (error) {
+      console.warn('Could not delete chat session:', error);
+    }
+  },
+
   /**
    * Generate Arabic audio overview script
    */
   async generateAudioScript(content, options = {}) {
+    const audio = await this.generateOnBackend('audio', content, options);
+    if (audio) return audio.script;
+
     const prompt = `اكتب نصاً للقراءة الصوتية (Audio Overview) باللغة العربية يلخص المحتوى التالي.
 
 المتطلبات:
@@ -215,6 +354,9 @@ ${content}
    * Generate flashcards in Arabic
    */
   async generateFlashcards(content, options = {}) {
+    const flashcards = await this.generateOnBackend('flashcards', content, options);
+    if (flashcards) return { flashcards };
+
     const count = options.length === 'short' ? 10 : options.length === 'long' ? 30 : 20;
     
     const prompt = `أنشئ ${count} بطاقة تعليمية (Flashcards) باللغة العربية من المحتوى التالي.
@@ -258,6 +400,9 @@ ${content}
    * Generate quiz in Arabic
    */
   async generateQuiz(content, options = {}) {
+    const quiz = await this.generateOnBackend('quiz', content, options);
+    if (quiz) return { quiz };
+
     const count = options.length === 'short' ? 5 : options.length === 'long' ? 15 : 10;
     
     const prompt = `أنشئ اختباراً من ${count} أسئلة باللغة العربية من المحتوى التالي.
@@ -307,6 +452,9 @@ ${content}
    * Generate mind map structure in Arabic
    */
   async generateMindMap(content, options = {}) {
+    const mindmap = await this.generateOnBackend('mindmap', content, options);
+    if (mindmap) return { mindmap };
+
     const prompt = `أنشئ خريطة ذهنية (Mind Map) باللغة العربية تلخص المحتوى التالي.
 
 المتطلبات:
@@ -355,6 +503,9 @@ ${content}
    * Generate report in Arabic
    */
   async generateReport(content, options = {}) {
+    const report = await this.generateOnBackend('report', content, options);
+    if (report) return report.markdown;
+
     const prompt = `اكتب تقريراً شاملاً باللغة العربية عن المحتوى التالي.
 
 المتطلبات:
@@ -384,6 +535,9 @@ ${content}
    * Generate slide deck content in Arabic
    */
   async generateSlides(content, options = {}) {
+    const presentation = await this.generateOnBackend('slides', content, options);
+    if (presentation) return { presentation };
+
     const slideCount = options.length === 'short' ? 8 : options.length === 'long' ? 20 : 12;
     
     const prompt = `أنشئ محتوى عرض تقديمي من ${slideCount} شريحة باللغة العربية.
@@ -431,6 +585,9 @@ ${content}
    * Generate infographic content in Arabic
    */
   async generateInfographic(content, options = {}) {
+    const infographic = await this.generateOnBackend('infographic', content, options);
+    if (infographic) return { infographic };
+
     const prompt = `أنشئ محتوى إنفوجرافيك باللغة العربية يلخص المحتوى التالي.
 
 المتطلبات:
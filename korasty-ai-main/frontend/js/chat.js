@@ -96,17 +96,39 @@ const Chat = {
     // Show typing indicator
     this.showTypingIndicator();
 
+    // Render streamed tokens in a live message as they arrive
+    let liveMessage = null;
+
     try {
+      const onDelta = (text) => {
+        if (!liveMessage) {
+          document.getElementById('typingIndicator')?.remove();
+          liveMessage = document.createElement('div');
+          liveMessage.className = 'message assistant';
+          liveMessage.innerHTML = `
+            <div class="message-avatar">👨‍🏫</div>
+            <div class="message-content"></div>
+          `;
+          document.getElementById('chatMessages')?.appendChild(liveMessage);
+        }
+        liveMessage.querySelector('.message-content').innerHTML = this.formatMessage(text);
+        this.scrollToBottom();
+      };
+
       // Get response from API
-      const response = await API.chat(message, this.context, this.getHistoryForAPI());
+      const response = await API.chat(
+        message, this.context, this.getHistoryForAPI(), onDelta, Storage.getChatSessionId()
+      );
       
       // Remove typing indicator and add response
       this.hideTypingIndicator();
+      liveMessage?.remove();
       this.addMessage(response, 'assistant');
 
     } catch (error) {
       console.error('Chat error:', error);
       this.hideTypingIndicator();
+      liveMessage?.remove();
       this.addMessage('عذراً، حدث خطأ. يرجى المحاولة مرة أخرى.', 'assistant');
       Utils.showToast(error.message || 'خطأ في الاتصال', 'error');
     }
@@ -244,6 +266,7 @@ const Chat = {
     if (!confirm('هل أنت متأكد من مسح المحادثة؟')) return;
 
     Storage.clearChatHistory();
+    API.deleteChatSession(Storage.resetChatSessionId());
     this.history = [];
     this.loadChatHistory();
     
@@ -138,6 +138,7 @@ const CONFIG = {
     SETTINGS: 'korasty_settings',
     SOURCES: 'korasty_sources',
     CHAT_HISTORY: 'korasty_chat_history',
+    CHAT_SESSION: 'korasty_chat_session',
     OUTPUTS: 'korasty_outputs'
   },
   
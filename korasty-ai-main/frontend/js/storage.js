@@ -213,6 +213,27 @@ const Storage = {
     return this.set(CONFIG.STORAGE_KEYS.CHAT_HISTORY, []);
   },
 
+  /**
+   * Get the chat session id (backend session memory), creating one if needed
+   */
+  getChatSessionId() {
+    let sessionId = this.get(CONFIG.STORAGE_KEYS.CHAT_SESSION);
+    if (!sessionId) {
+      sessionId = Utils.generateId();
+      this.set(CONFIG.STORAGE_KEYS.CHAT_SESSION, sessionId);
+    }
+    return sessionId;
+  },
+
+  /**
+   * Start a new chat session, returning the previous id
+   */
+  resetChatSessionId() {
+    const previous = this.get(CONFIG.STORAGE_KEYS.CHAT_SESSION);
+    this.remove(CONFIG.STORAGE_KEYS.CHAT_SESSION);
+    return previous;
+  },
+
   // ========================================
   // STUDIO OUTPUTS
   // ========================================